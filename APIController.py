@@ -1,13 +1,32 @@
-from typing import List
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, Field
+import asyncio
+import threading
+from pathlib import Path
+from typing import List, Optional
+import time
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.staticfiles import StaticFiles
+from pydantic import BaseModel, Field, field_validator
 import uvicorn
 from starlette.middleware.cors import CORSMiddleware
 
-from agent_core import StoryCreationAgent
-from memory import MemorySystem
+from agent_core import StoryCreationAgent, project_result
+from memory import MemorySystem, is_safe_project_name
+from config import get_config
+from deadline import Deadline, DeadlineExceeded
+from jobs import JobCancelled, JobExists, get_job_registry
+from accounting import DEFAULT_TENANT, BudgetExceeded, get_accounting_store
+from metrics import REQUEST_DURATION, get_metrics_registry
+from tracing import start_span
+from logger import get_logger
 
 
+logger = get_logger("api")
+
+# 检查客户端是否断开连接的间隔（秒）
+DISCONNECT_POLL_INTERVAL = 0.5
+
 # 引入我们在上面定义的业务逻辑模块
 # from LLM_conversion import generate_story_data
 
@@ -15,6 +34,33 @@ from memory import MemorySystem
 # ================= Pydantic 模型定义 (用于Swagger文档和校验) =================
 class StoryRequest(BaseModel):
     prompt: str = Field(..., example="给我创作一个一家五口三代同堂，在一个200平米的大平层房子里温馨的一天")
+    timeout: Optional[float] = Field(None, gt=0, description="本次请求的总预算（秒），不能超过服务端 REQUEST_DEADLINE")
+    job_id: Optional[str] = Field(None, description="任务 ID（可选），可用于 DELETE /api/jobs/{job_id} 取消任务")
+    project_name: str = Field(
+        "测试漫画",
+        description="项目名称，之后可按此名称重新生成单格画面；用作文件名，不能包含空白、路径分隔符或 \\ / : * ? \" < > |，也不能只由 . 组成"
+    )
+    resume_key: Optional[str] = Field(
+        None,
+        min_length=1,
+        description=(
+            "续跑键（可选）：崩溃、超时（504）、取消（499）或预算用完（402）后用同一个键重新提交，"
+            "从最后完成的节点继续，只补画未完成的画面；流程跑完（包括部分画面重试后仍失败）即不再续跑。不传则每次重新生成"
+        )
+    )
+
+    @field_validator("project_name")
+    @classmethod
+    def _check_project_name(cls, value: str) -> str:
+        if not is_safe_project_name(value):
+            raise ValueError(f"项目名称不能用作文件名: {value!r}")
+        return value
+
+
+class RegenerateRequest(BaseModel):
+    panel_ids: List[int] = Field(..., min_length=1, example=[3, 7], description="需要重新生成的画面 ID")
+    timeout: Optional[float] = Field(None, gt=0, description="本次请求的总预算（秒），不能超过服务端 REQUEST_DEADLINE")
+    job_id: Optional[str] = Field(None, description="任务 ID（可选），可用于 DELETE /api/jobs/{job_id} 取消任务")
 
 
 class StoryboardFrame(BaseModel):
@@ -39,92 +85,384 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 本地资源存储（内容寻址，文件名不可变，可由 CDN 长期缓存）
+_asset_config = get_config()
+if _asset_config.asset_store_enabled and _asset_config.asset_public_base_url.startswith("/"):
+    Path(_asset_config.asset_storage_path).mkdir(parents=True, exist_ok=True)
+    app.mount(
+        _asset_config.asset_public_base_url,
+        StaticFiles(directory=_asset_config.asset_storage_path),
+        name="assets"
+    )
+
+
+def check_project_name(project_name: str):
+    """路径参数中的项目名称用作文件名，不能用作文件名时返回 400（防止 ../ 等路径穿越）"""
+    if not is_safe_project_name(project_name):
+        raise HTTPException(status_code=400, detail=f"项目名称不能用作文件名: {project_name!r}")
+
+
+def save_result(project_name: str, result: list):
+    """保存格式化结果到 output/<project_name>_result.json"""
+    import json
+    output_file = f"output/{project_name}_result.json"
+    Path("output").mkdir(exist_ok=True)
+    with start_span("result.write", file=output_file), open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    logger.info("结果已保存", extra={"file": output_file})
+
+
+class ResultFile:
+    """
+    一次请求的结果文件 output/<project_name>_result.json
+
+    后台转存（ASSET_STORE_BLOCKING=false）在响应返回后才完成：完成时已保存的结果被改写为本地稳定地址；
+    若转存先于保存完成，保存和返回的就是稳定地址。
+    """
+
+    def __init__(self, project_name: str):
+        self.project_name = project_name
+        self._lock = threading.Lock()
+        self._stored_result: Optional[list] = None
+        self._saved = False
+
+    def save(self, result: list) -> list:
+        """保存请求结果，返回实际保存的结果"""
+        with self._lock:
+            if self._stored_result is not None:
+                result = self._stored_result
+            save_result(self.project_name, result)
+            self._saved = True
+            return result
+
+    def assets_stored(self, result: list):
+        """后台转存完成（StoryCreationAgent 的 on_assets_stored 回调）"""
+        with self._lock:
+            self._stored_result = result
+            if self._saved:
+                save_result(self.project_name, result)
+
+
+def run_storybook(
+    comic_idea: str,
+    project_name: str,
+    resume_key: Optional[str],
+    outcome: dict,
+    deadline: Deadline,
+    job_id: str,
+    tenant: str = DEFAULT_TENANT
+) -> list:
+    """
+    同步执行一次漫画生成（在线程池中运行，不阻塞事件循环）
+
+    Args:
+        comic_idea: 用户输入的漫画创意
+        project_name: 项目名称
+        resume_key: 续跑键（可选），作为检查点 thread ID
+        outcome: 运行信息输出，写入 "resumed"（是否从检查点恢复）
+        deadline: 请求截止时间
+        job_id: 任务 ID（用于取消）
+        tenant: 租户（用量计入该租户）
+
+    Returns:
+        [{"word": "文本", "url": "图片URL"}, ...]
+    """
+    # 调用分离出去的业务逻辑函数
+    # data = generate_story_data(request.prompt)
+    logger.info("开始生成漫画", extra={"project": project_name, "job_id": job_id})
+    logger.debug("漫画创意: %s", comic_idea)
+
+    # 初始化 Memory
+    memory = MemorySystem(project_name)
+    memory.profile.update_settings({
+        "project_type": "comic",
+        "comic_style": "manga"
+    })
+
+    # 创建 Agent（后台转存完成后改写已保存的结果）
+    result_file = ResultFile(project_name)
+    agent = StoryCreationAgent(memory, on_assets_stored=result_file.assets_stored)
+
+    # 运行流程
+    try:
+        result = agent.run(project_name, comic_idea, deadline=deadline, job_id=job_id, thread_id=resume_key, tenant=tenant)
+    finally:
+        outcome["resumed"] = agent.resumed
+
+    # 任务已被取消：不再输出和保存结果
+    cancel_token = get_job_registry().token_for(job_id)
+    if cancel_token:
+        cancel_token.check("保存结果")
+
+    # 输出结果
+    logger.info("运行完成，生成了 %d 格漫画", len(result), extra={"project": project_name})
+    for i, item in enumerate(result, 1):
+        logger.debug("第 %d 格: %s %s", i, item.get("word", "无文本"), item.get("url", "无URL"))
+
+    # 保存结果到 JSON 文件
+    return result_file.save(result)
+
+    # # 数据完整性兜底处理
+    # frames = data.get("frames", [])
+    # # 确保只取前9帧（虽然Prompt要求了9帧，但做个防御性编程）
+    # if len(frames) > 9:
+    #     frames = frames[:9]
+
+    # return StoryResponse(
+    #     main_story=data.get("main_story", "生成失败，未获取到故事内容"),
+    #     character_settings=data.get("character_settings", "无设定"),
+    #     frames=[
+    #         StoryboardFrame(
+    #             frame_index=f.get("frame_index", i + 1),
+    #             scene_description=f.get("scene_description", ""),
+    #             visual_prompt=f.get("visual_prompt", "")
+    #         ) for i, f in enumerate(frames)
+    #     ]
+    # )
+
+
+def regenerate_storybook_panels(
+    project_name: str,
+    panel_ids: List[int],
+    deadline: Deadline,
+    job_id: str,
+    tenant: str = DEFAULT_TENANT
+) -> list:
+    """
+    同步执行单格重新生成（在线程池中运行，不阻塞事件循环）
+
+    Args:
+        project_name: 项目名称
+        panel_ids: 需要重新生成的画面 ID
+        deadline: 请求截止时间
+        job_id: 任务 ID（用于取消）
+        tenant: 租户（用量计入该租户）
+
+    Returns:
+        [{"word": "文本", "url": "图片URL"}, ...]
+    """
+    logger.info("重新生成画面", extra={"project": project_name, "panel_ids": panel_ids, "job_id": job_id})
+
+    memory = MemorySystem(project_name)
+    result_file = ResultFile(project_name)
+    agent = StoryCreationAgent(memory, on_assets_stored=result_file.assets_stored)
+    result = agent.regenerate_panels(project_name, panel_ids, deadline=deadline, job_id=job_id, tenant=tenant)
+
+    cancel_token = get_job_registry().token_for(job_id)
+    if cancel_token:
+        cancel_token.check("保存结果")
+
+    return result_file.save(result)
+
+
+async def run_job(http_request: Request, response: Response, timeout: Optional[float], job_id: Optional[str], func, *args):
+    """
+    以可取消任务的方式在线程池中执行 func(*args, deadline=..., job_id=..., tenant=...)
+
+    在入口处设定整个请求的截止时间；客户端断开连接或调用 DELETE /api/jobs/{job_id} 时，
+    取消信号会沿 Agent 流程传递，停止调度新的图片并中断进行中的请求。
+    租户由请求头 X-Tenant-Id 指定，预算已用完时直接返回 402。
+    """
+    # 在入口处设定整个请求的截止时间，沿 Agent 流程向下传递
+    budget = get_config().request_deadline
+    if timeout:
+        budget = min(budget, timeout) if budget > 0 else timeout
+    deadline = Deadline.after(budget)
+
+    tenant = http_request.headers.get("X-Tenant-Id") or DEFAULT_TENANT
+    try:
+        get_accounting_store().check_budget(tenant)
+    except BudgetExceeded as e:
+        raise HTTPException(status_code=402, detail=str(e))
+
+    registry = get_job_registry()
+    try:
+        job = registry.create(job_id)
+    except JobExists as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    response.headers["X-Job-Id"] = job.job_id
+
+    route = http_request.scope.get("route")
+    endpoint = getattr(route, "path", http_request.url.path)
+    started = time.perf_counter()
+    status = "error"
+
+    # 每个请求一条 trace；run_in_threadpool 会复制上下文，Agent 中的 span 都挂在这条 trace 下
+    with start_span(f"{http_request.method} {endpoint}", new_trace=True, job_id=job.job_id) as span:
+        response.headers["X-Trace-Id"] = span.trace_id
+        # 出错时 HTTPException 不会带上 response 中的头，单独传入，便于按 trace 排查失败请求
+        headers = {"X-Job-Id": job.job_id, "X-Trace-Id": span.trace_id}
+        try:
+            result = await _await_job(http_request, job, func, *args, deadline=deadline, tenant=tenant)
+            status = "ok"
+            return result
+        except JobCancelled as e:
+            # 499: 客户端关闭请求（nginx 约定）
+            status = "cancelled"
+            raise HTTPException(status_code=499, detail=str(e), headers=headers)
+        except DeadlineExceeded as e:
+            status = "deadline"
+            raise HTTPException(status_code=504, detail=str(e), headers=headers)
+        except BudgetExceeded as e:
+            status = "budget"
+            raise HTTPException(status_code=402, detail=str(e), headers=headers)
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e), headers=headers)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e), headers=headers)
+        except Exception as e:
+            # 捕获 service 层抛出的异常，转化为 HTTP 500
+            raise HTTPException(status_code=500, detail=str(e), headers=headers)
+        finally:
+            registry.finish(job.job_id)
+            REQUEST_DURATION.observe(time.perf_counter() - started, endpoint=endpoint, status=status)
+            span.set_attribute("status", status)
+
+
+async def _await_job(http_request: Request, job, func, *args, deadline: Deadline, tenant: str):
+    """
+    在线程池中执行任务，期间检测客户端是否断开（断开时取消任务），
+    多进程部署时同时检查落在其他 worker 上的取消请求
+    """
+    task = asyncio.ensure_future(
+        run_in_threadpool(func, *args, deadline=deadline, job_id=job.job_id, tenant=tenant)
+    )
+    registry = get_job_registry()
+
+    # 等待生成完成，期间检测客户端是否断开
+    while not task.done():
+        await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+        if task.done():
+            break
+        if await http_request.is_disconnected():
+            logger.warning("客户端已断开连接，取消任务", extra={"job_id": job.job_id})
+            job.cancel("客户端已断开连接")
+            break
+        if registry.shared and await run_in_threadpool(registry.poll_cancel, job):
+            logger.info("收到其他 worker 转交的取消请求", extra={"job_id": job.job_id})
+            break
+
+    return await task
+
+
 @app.post("/api/generate_storybook")
-async def api_generate_storybook(request: StoryRequest):
+async def api_generate_storybook(request: StoryRequest, http_request: Request, response: Response):
     """
     API 入口：接收前端请求 -> 调用业务逻辑 -> 返回结果
+
+    生成过程在线程池中运行；客户端断开连接或调用 DELETE /api/jobs/{job_id} 时，
+    取消信号会沿 Agent 流程传递，停止调度新的图片并中断进行中的请求。
+    带 resume_key 时从该键未完成的检查点继续，响应头 X-Resumed 表示是否发生了续跑。
     """
-    print(f"收到生成请求: {request.prompt}")
+    logger.info("收到生成请求", extra={"project": request.project_name, "resume_key": request.resume_key})
+    logger.debug("请求提示词: %s", request.prompt)
 
+    outcome = {}
     try:
-        # 调用分离出去的业务逻辑函数
-        # data = generate_story_data(request.prompt)
-        comic_idea = request.prompt
-        print("=" * 70)
-        print("🎨 测试漫画生成 Agent")
-        print("=" * 70)
-        print(f"\n📝 漫画创意: {comic_idea}")
-        print("\n" + "-" * 70)
-
-        # 创建项目
-        project_name = "测试漫画"
-
-        # 初始化 Memory
-        memory = MemorySystem(project_name)
-        memory.profile.update_settings({
-            "project_type": "comic",
-            "comic_style": "manga"
-        })
-
-        # 创建 Agent
-        agent = StoryCreationAgent(memory)
-
-        # 运行流程
-        print("\n🚀 开始运行 Agent...\n")
-        result = agent.run(project_name, comic_idea)
-
-        # 输出结果
-        print("\n" + "=" * 70)
-        print("✅ 运行完成！以下是生成结果：")
-        print("=" * 70)
-
-        print(f"\n📊 生成了 {len(result)} 格漫画\n")
-
-        # 显示每一格的内容
-        for i, item in enumerate(result, 1):
-            word = item.get("word", "无文本")
-            url = item.get("url", "无URL")
-
-            print(f"【第 {i} 格】")
-            print(f"  文本: {word}")
-            print(f"  图片: {url}")
-            print()
-
-        # 保存结果到 JSON 文件
-        import json
-        output_file = f"output/{project_name}_result.json"
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(result, f, ensure_ascii=False, indent=2)
-
-        print(f"💾 结果已保存到: {output_file}")
-
-        print("\n" + "=" * 70)
-        print("🎉 测试完成！")
-        print("=" * 70)
-        return result
-
-        # # 数据完整性兜底处理
-        # frames = data.get("frames", [])
-        # # 确保只取前9帧（虽然Prompt要求了9帧，但做个防御性编程）
-        # if len(frames) > 9:
-        #     frames = frames[:9]
-
-        # return StoryResponse(
-        #     main_story=data.get("main_story", "生成失败，未获取到故事内容"),
-        #     character_settings=data.get("character_settings", "无设定"),
-        #     frames=[
-        #         StoryboardFrame(
-        #             frame_index=f.get("frame_index", i + 1),
-        #             scene_description=f.get("scene_description", ""),
-        #             visual_prompt=f.get("visual_prompt", "")
-        #         ) for i, f in enumerate(frames)
-        #     ]
-        # )
-
-    except Exception as e:
-        # 捕获 service 层抛出的异常，转化为 HTTP 500
-        raise HTTPException(status_code=500, detail=str(e))
+        return await run_job(
+            http_request, response, request.timeout, request.job_id,
+            run_storybook, request.prompt, request.project_name, request.resume_key, outcome
+        )
+    finally:
+        response.headers["X-Resumed"] = "true" if outcome.get("resumed") else "false"
+
+
+@app.post("/api/projects/{project_name}/panels/regenerate")
+async def api_regenerate_panels(project_name: str, request: RegenerateRequest, http_request: Request, response: Response):
+    """
+    重新生成指定画面（如状态为 failed 或效果不满意的画面）
+
+    从 Memory 加载项目，复用已保存的提示词和其余画面，只对指定画面调用文生图，
+    并更新 Memory、拼版和 output/<project_name>_result.json。
+    """
+    check_project_name(project_name)
+    logger.info("收到重新生成请求", extra={"project": project_name, "panel_ids": request.panel_ids})
+
+    return await run_job(
+        http_request, response, request.timeout, request.job_id,
+        regenerate_storybook_panels, project_name, request.panel_ids
+    )
+
+
+@app.delete("/api/jobs/{job_id}")
+async def api_cancel_job(job_id: str):
+    """
+    取消正在运行的生成任务（多进程部署时任务可以在任意 worker 上）
+    """
+    job = get_job_registry().cancel(job_id, "任务已被用户取消")
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在或已结束: {job_id}")
+    return job
+
+
+@app.get("/api/projects/{project_name}/composition")
+async def api_get_composition(project_name: str):
+    """
+    获取服务端合成的绘本（3×3 拼版大图和 PDF）
+
+    后台转存模式下合成在响应返回后才完成，前端可轮询此接口。
+    """
+    check_project_name(project_name)
+    memory = MemorySystem(project_name)
+    if not memory.load_from_disk(f"{project_name}.json"):
+        raise HTTPException(status_code=404, detail=f"项目不存在: {project_name}")
+
+    composition = memory.semantic.get_knowledge("composition")
+    if not composition:
+        raise HTTPException(status_code=404, detail=f"绘本尚未合成: {project_name}")
+    return composition
+
+
+@app.get("/api/projects/{project_name}/assets")
+async def api_get_project_assets(project_name: str):
+    """
+    获取项目结果（已转存到本地的画面使用稳定地址）
+
+    后台转存模式下生成接口返回的是提供商的临时 URL；pending 为空后 result 中全部是稳定地址，前端可轮询此接口。
+    """
+    check_project_name(project_name)
+    memory = MemorySystem(project_name)
+    if not memory.load_from_disk(f"{project_name}.json"):
+        raise HTTPException(status_code=404, detail=f"项目不存在: {project_name}")
+    return project_result(memory)
+
+
+@app.get("/api/usage")
+async def api_get_usage(tenant: Optional[str] = None):
+    """
+    累计用量与成本：LLM 调用次数、输入 / 输出 / 缓存命中 token、图片数、估算成本和缓存节省的成本
+
+    指定 tenant 时只返回该租户（含预算和剩余额度）。
+    """
+    store = get_accounting_store()
+    if tenant:
+        return store.tenant_usage(tenant)
+    return store.totals()
+
+
+@app.get("/api/projects/{project_name}/usage")
+async def api_get_project_usage(project_name: str):
+    """
+    项目的累计用量与成本（包括所有生成和单格重绘）
+    """
+    usage = get_accounting_store().project_usage(project_name)
+    if usage is None:
+        raise HTTPException(status_code=404, detail=f"项目没有用量记录: {project_name}")
+    return usage
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def api_metrics():
+    """
+    Prometheus 格式的运行指标：节点耗时、LLM 调用耗时与 token 数、文生图排队与调用耗时
+    """
+    return PlainTextResponse(
+        get_metrics_registry().render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 if __name__ == "__main__":
+    # 单进程开发模式；生产环境多进程部署使用 python server.py
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -1,22 +1,18 @@
-import json
-import os
-
-from openai import OpenAI
-
-# ================= 配置区域 =================
-# 1. 这里必须填入阿里云 DashScope 的真实 API KEY (以 sk- 开头)
-# 如果你没有，请去阿里云百炼控制台创建一个，或者询问主办方索要 "sk-" 开头的 key
-DASHSCOPE_API_KEY = "sk-b2badc27d4b747d6965d782e1638cfde"
-
-# 2. 初始化 OpenAI 客户端 (适配 DashScope)
-client = OpenAI(
-    api_key=DASHSCOPE_API_KEY,
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-)
+"""
+一次性生成 9 帧故事数据（角色设定 + 故事梗概 + 9 帧画面描述与提示词）
+与 tools.py 中的其他调用共用 LLMClient：提供商配置（LLM_PROVIDER）、结构化输出、提示词缓存、
+结果缓存、并发上限、JSON 修复以及用量记录都在 LLMClient 中完成。
+"""
 
+from typing import Optional
 
+from config import get_config
+from deadline import Deadline, DeadlineExceeded
+from jobs import CancelToken, JobCancelled
+from llm_client import get_llm_client
+from logger import get_logger
 
-MODEL_NAME = "qwen3-max"  # 或 "qwen-max"
+logger = get_logger("llm_conversion")
 
 # ================= Prompt 设计 =================
 SYSTEM_PROMPT = """
@@ -59,31 +55,44 @@ SYSTEM_PROMPT = """
 """
 
 
-def generate_story_data(user_prompt: str) -> dict:
-    """
-    核心函数：使用 OpenAI SDK 调用 Qwen
+def generate_story_data(
+    user_prompt: str,
+    deadline: Optional[Deadline] = None,
+    cancel_token: Optional[CancelToken] = None
+) -> dict:
     """
-    try:
-        completion = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.7,
-            # 告诉模型强制返回 JSON (如果模型支持，Qwen-max/plus 效果通常很好)
-            response_format={"type": "json_object"}
-        )
+    核心函数：通过 LLMClient 一次性生成 9 帧故事数据
 
-        content = completion.choices[0].message.content
+    Args:
+        user_prompt: 用户输入
+        deadline: 请求截止时间（可选），本次调用只使用剩余预算
+        cancel_token: 取消信号（可选），已取消时不再发起调用
 
-        # 清洗 Markdown 标记 (以防万一)
-        if content.strip().startswith("```"):
-            content = content.replace("```json", "").replace("```", "")
+    Returns:
+        {"character_settings": ..., "main_story": ..., "frames": [...]}
 
-        return json.loads(content)
+    Raises:
+        DeadlineExceeded: 截止时间已到
+        JobCancelled: 任务已被取消
+        Exception: 调用失败或输出（包括修复之后）不符合格式，消息以「模型调用失败」开头
+    """
+    # schemas 依赖 pydantic，首次调用时才导入
+    from schemas import StoryData
 
+    config = get_config()
+    try:
+        # 系统提示词固定、只有用户输入不同：启用 LLM_PROMPT_CACHE 时系统提示词即为缓存前缀
+        return get_llm_client().generate(
+            user_prompt,
+            SYSTEM_PROMPT,
+            deadline=deadline,
+            cancel_token=cancel_token,
+            schema=StoryData,
+            max_tokens=config.story_max_tokens,
+            timeout=config.story_timeout
+        )
+    except (DeadlineExceeded, JobCancelled):
+        raise
     except Exception as e:
-        print(f"[Service Error] LLM Call failed: {e}")
-        # 如果是 401，这里会打印具体的鉴权错误信息
-        raise Exception(f"模型调用失败: {str(e)}")
\ No newline at end of file
+        logger.error("LLM Call failed: %s", e)
+        raise Exception(f"模型调用失败: {str(e)}")
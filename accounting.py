@@ -0,0 +1,343 @@
+"""
+用量与成本核算模块
+记录每次 LLM 调用的输入 / 输出 / 缓存命中 token 数和每次文生图的图片数，按价格配置估算成本：
+- UsageLedger: 一次图运行（生成或单格重绘）的账本，通过 contextvars 传递到各节点和线程池任务
+- AccountingStore: 按租户和项目累计的用量，持久化到本地 JSON 文件，用于租户预算控制和 /api/usage
+
+缓存命中的 token 按缓存价格计费，差价计入 saved_cost，用于衡量缓存实际节省了多少。
+"""
+
+import contextvars
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows：只在进程内加锁
+    fcntl = None
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from config import get_config
+
+
+# 未指定租户时使用的租户名
+DEFAULT_TENANT = "default"
+
+# 不计费的提供商（模拟模式）
+FREE_PROVIDERS = {"mock"}
+
+# 当前运行的账本
+_current_ledger: contextvars.ContextVar[Optional["UsageLedger"]] = contextvars.ContextVar("current_ledger", default=None)
+
+
+class BudgetExceeded(Exception):
+    """租户预算已用完"""
+    pass
+
+
+@contextmanager
+def _file_lock(path: Path) -> Iterator[None]:
+    """跨进程文件锁（多 worker 同时累加用量时避免互相覆盖）"""
+    if fcntl is None:
+        yield
+        return
+
+    lock_path = path.with_name(path.name + ".lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class Usage:
+    """一组累计用量"""
+
+    FIELDS = ("llm_calls", "input_tokens", "output_tokens", "cached_tokens", "images", "cost", "saved_cost")
+
+    def __init__(self, **values):
+        for field in self.FIELDS:
+            setattr(self, field, values.get(field, 0))
+
+    def add(self, other: "Usage"):
+        """累加另一组用量"""
+        for field in self.FIELDS:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典（成本保留 6 位小数）"""
+        data = {field: getattr(self, field) for field in self.FIELDS}
+        data["cost"] = round(data["cost"], 6)
+        data["saved_cost"] = round(data["saved_cost"], 6)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "Usage":
+        """从字典恢复"""
+        return cls(**(data or {}))
+
+
+def llm_cost(provider: str, input_tokens: int, output_tokens: int, cached_tokens: int = 0) -> Dict[str, float]:
+    """
+    按价格配置估算一次 LLM 调用的成本（价格单位：每百万 token）
+
+    Args:
+        provider: 提供商
+        input_tokens: 输入 token 数（含缓存命中部分）
+        output_tokens: 输出 token 数
+        cached_tokens: 缓存命中的输入 token 数
+
+    Returns:
+        {"cost": 估算成本, "saved_cost": 缓存节省的成本}
+    """
+    if provider in FREE_PROVIDERS:
+        return {"cost": 0.0, "saved_cost": 0.0}
+
+    config = get_config()
+    uncached = max(0, input_tokens - cached_tokens)
+    cost = (
+        uncached * config.llm_price_input
+        + cached_tokens * config.llm_price_cached_input
+        + output_tokens * config.llm_price_output
+    ) / 1_000_000
+    saved = cached_tokens * (config.llm_price_input - config.llm_price_cached_input) / 1_000_000
+    return {"cost": cost, "saved_cost": saved}
+
+
+def image_cost(provider: str, images: int) -> float:
+    """按价格配置估算文生图成本（价格单位：每张图片）"""
+    if provider in FREE_PROVIDERS:
+        return 0.0
+    return images * get_config().image_price
+
+
+class UsageLedger:
+    """一次图运行的账本（多个线程并发记录）"""
+
+    def __init__(self, tenant: str, project_name: str):
+        self.tenant = tenant
+        self.project_name = project_name
+        self.usage = Usage()
+        self.calls: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def record(self, entry: Dict[str, Any]):
+        """记录一次调用"""
+        usage = Usage(**entry)
+        with self._lock:
+            self.usage.add(usage)
+            self.calls.append(entry)
+
+    def check_budget(self, stage: str = ""):
+        """
+        租户累计成本加上本次运行的成本达到预算时抛出 BudgetExceeded
+
+        Raises:
+            BudgetExceeded: 预算已用完
+        """
+        with self._lock:
+            running = self.usage.cost
+        get_accounting_store().check_budget(self.tenant, stage, pending_cost=running)
+
+    def summary(self) -> Dict[str, Any]:
+        """本次运行的用量汇总"""
+        with self._lock:
+            return {"tenant": self.tenant, "calls": len(self.calls), **self.usage.to_dict()}
+
+
+class AccountingStore:
+    """
+    按租户和项目累计的用量（本地 JSON 文件）
+
+    多进程部署时各 worker 共用同一文件：累加时加文件锁并先读取最新内容，
+    查询时文件有变化（其他 worker 写入）则重新读取。
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        config = get_config()
+        self.path = Path(path or config.accounting_path)
+        self.default_budget = config.tenant_budget
+        self.budgets = config.tenant_budgets
+        self._lock = threading.Lock()
+        self._data: Dict[str, Dict[str, Dict[str, Any]]] = {"tenants": {}, "projects": {}}
+        self._mtime: Optional[int] = None
+        self._load()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            self._mtime = self.path.stat().st_mtime_ns
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._data["tenants"] = data.get("tenants", {})
+            self._data["projects"] = data.get("projects", {})
+        except Exception:
+            # 文件损坏时从零开始累计，不影响生成
+            pass
+
+    def _refresh(self):
+        """文件被其他进程更新过时重新读取（调用方持有 self._lock）"""
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self._load()
+
+    def _save(self):
+        """原子写入（先写临时文件再替换）"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.path.parent, suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self._data, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
+        self._mtime = self.path.stat().st_mtime_ns
+
+    def add(self, tenant: str, project_name: str, usage: Usage):
+        """把一次运行的用量累加到租户和项目"""
+        with self._lock, _file_lock(self.path):
+            self._refresh()
+            for section, key in (("tenants", tenant), ("projects", project_name)):
+                totals = Usage.from_dict(self._data[section].get(key))
+                totals.add(usage)
+                self._data[section][key] = {**totals.to_dict(), "updated_at": datetime.now().isoformat()}
+            self._save()
+
+    def budget_for(self, tenant: str) -> float:
+        """租户预算（0 表示不限）"""
+        return self.budgets.get(tenant, self.default_budget)
+
+    def tenant_usage(self, tenant: str) -> Dict[str, Any]:
+        """租户累计用量、预算和剩余额度"""
+        with self._lock:
+            self._refresh()
+            usage = dict(self._data["tenants"].get(tenant) or Usage().to_dict())
+        budget = self.budget_for(tenant)
+        usage["budget"] = budget
+        usage["remaining"] = round(max(0.0, budget - usage["cost"]), 6) if budget else None
+        return usage
+
+    def project_usage(self, project_name: str) -> Optional[Dict[str, Any]]:
+        """项目累计用量（没有记录时返回 None）"""
+        with self._lock:
+            self._refresh()
+            usage = self._data["projects"].get(project_name)
+        return dict(usage) if usage else None
+
+    def totals(self) -> Dict[str, Any]:
+        """全部租户的累计用量"""
+        with self._lock:
+            self._refresh()
+            tenants = list(self._data["tenants"])
+        return {"tenants": {tenant: self.tenant_usage(tenant) for tenant in tenants}}
+
+    def check_budget(self, tenant: str, stage: str = "", pending_cost: float = 0.0):
+        """
+        检查租户预算
+
+        Args:
+            tenant: 租户
+            stage: 当前阶段（用于错误信息）
+            pending_cost: 尚未累计到 store 的成本（进行中的运行）
+
+        Raises:
+            BudgetExceeded: 累计成本已达到预算
+        """
+        budget = self.budget_for(tenant)
+        if not budget:
+            return
+        with self._lock:
+            self._refresh()
+            spent = (self._data["tenants"].get(tenant) or {}).get("cost", 0.0)
+        if spent + pending_cost >= budget:
+            message = f"租户 {tenant} 的预算已用完（{spent + pending_cost:.4f}/{budget}）"
+            raise BudgetExceeded(f"{message}，放弃: {stage}" if stage else message)
+
+
+# 全局用量存储实例
+_accounting_store: Optional[AccountingStore] = None
+_accounting_store_lock = threading.Lock()
+
+
+def get_accounting_store() -> AccountingStore:
+    """获取全局用量存储（单例模式）"""
+    global _accounting_store
+    with _accounting_store_lock:
+        if _accounting_store is None:
+            _accounting_store = AccountingStore()
+        return _accounting_store
+
+
+def current_ledger() -> Optional[UsageLedger]:
+    """当前运行的账本（不在运行中时返回 None）"""
+    return _current_ledger.get()
+
+
+@contextmanager
+def track_usage(tenant: Optional[str], project_name: str) -> Iterator[UsageLedger]:
+    """
+    为一次图运行开启账本，结束时（无论成功与否）把用量累加到租户和项目
+
+    Args:
+        tenant: 租户（为空时使用 DEFAULT_TENANT）
+        project_name: 项目名称
+
+    Yields:
+        UsageLedger
+    """
+    ledger = UsageLedger(tenant or DEFAULT_TENANT, project_name)
+    token = _current_ledger.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _current_ledger.reset(token)
+        if ledger.calls:
+            get_accounting_store().add(ledger.tenant, ledger.project_name, ledger.usage)
+
+
+def record_llm_call(
+    provider: str,
+    model: str,
+    input_tokens: Optional[int],
+    output_tokens: Optional[int],
+    cached_tokens: Optional[int] = None
+):
+    """记录一次 LLM 调用（不在运行中时忽略）"""
+    ledger = _current_ledger.get()
+    if ledger is None:
+        return
+
+    input_tokens, output_tokens, cached_tokens = input_tokens or 0, output_tokens or 0, cached_tokens or 0
+    ledger.record({
+        "kind": "llm",
+        "provider": provider,
+        "model": model,
+        "llm_calls": 1,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "cached_tokens": cached_tokens,
+        **llm_cost(provider, input_tokens, output_tokens, cached_tokens)
+    })
+
+
+def record_image_call(provider: str, model: str, images: int):
+    """记录一次文生图调用生成的图片数（不在运行中时忽略）"""
+    ledger = _current_ledger.get()
+    if ledger is None or images <= 0:
+        return
+
+    ledger.record({
+        "kind": "image",
+        "provider": provider,
+        "model": model,
+        "images": images,
+        "cost": image_cost(provider, images)
+    })
@@ -3,16 +3,37 @@ LangGraph Agent 核心模块
 实现基于状态图的创作流程
 """
 
-from typing import TypedDict, Annotated, Literal
-from langgraph.graph import StateGraph, END
-import operator
+import hashlib
+import time
+import uuid
+from typing import TYPE_CHECKING, Callable, TypedDict, Literal, Optional, Tuple
 from memory import MemorySystem
+from deadline import Deadline, DeadlineExceeded
+from jobs import CancelToken, JobCancelled, get_job_registry
+from config import get_config
+from asset_store import get_asset_pipeline
+from composer import get_storybook_composer
+from checkpointer import get_checkpointer, delete_thread, has_pending_thread
+from metrics import instrument_node
+from tracing import start_span
+from accounting import BudgetExceeded, Usage, current_ledger, track_usage
+from logger import get_logger
 from tools import (
     generate_frames_from_llm,
     design_characters,
     generate_images_from_prompts
 )
 
+if TYPE_CHECKING:
+    from langgraph.graph import StateGraph
+
+
+logger = get_logger("agent_core")
+
+# 节点不吞掉这些异常：截止时间已到、任务取消或预算用完时中止整个流程（检查点保留在最后完成的节点），
+# 由调用方返回 504 / 499 / 402；其他异常记录到 error_message 后继续后续节点
+ABORT_ERRORS = (DeadlineExceeded, JobCancelled, BudgetExceeded)
+
 
 class AgentState(TypedDict):
     """
@@ -25,7 +46,7 @@ class AgentState(TypedDict):
 
     # 流程状态
     current_step: str
-    completed_steps: Annotated[list, operator.add]
+    completed_steps: list      # 各节点自行追加并返回完整列表（不用 operator.add 归并，避免检查点中重复累积）
 
     # 创作内容（漫画）- 新流程
     character_settings: str    # 角色设定（从LLM返回）
@@ -34,31 +55,52 @@ class AgentState(TypedDict):
     story_segments: list       # 分段故事文本（9帧）
     image_prompts: list        # 图片提示词列表（9帧）
     images: list               # 生成的图片列表（9帧）
+    assets: dict               # 已转存到本地的图片 {panel_id: {"hash", "url", "variants", ...}}
+    composition: dict          # 服务端合成的绘本 {"sheet": 拼版大图URL, "pdf": PDF URL, ...}
 
     # 控制流
     next_action: str
     error_message: str
+    deadline: float            # 请求截止时间（绝对时间戳，0 表示不限时）
+    job_id: str                # 任务 ID（用于查找取消信号，空表示不可取消）
+    regenerate_panel_ids: list # 需要重新生成的画面 ID（仅增量重新执行时使用）
+    image_retries: int         # 失败画面已重试的轮数
 
 
 class StoryCreationAgent:
     """创作型 Agent - 使用 LangGraph 管理工作流"""
 
-    def __init__(self, memory_system: MemorySystem):
+    def __init__(self, memory_system: MemorySystem, on_assets_stored: Optional[Callable[[list], None]] = None):
+        """
+        Args:
+            memory_system: 项目的 Memory
+            on_assets_stored: 后台转存完成后的回调（可选），参数为使用本地稳定地址的格式化结果，
+                              可用于改写响应返回后已保存的结果文件
+        """
         self.memory = memory_system
+        self.on_assets_stored = on_assets_stored
         self.graph = self._build_graph()
+        self.regenerate_graph = self._build_regenerate_graph()
+        # 最近一次 run() 是否从检查点恢复，以及流程中记录的错误（空字符串表示没有出错）
+        self.resumed = False
+        self.error_message = ""
 
-    def _build_graph(self) -> StateGraph:
+    def _build_graph(self) -> "StateGraph":
         """构建 LangGraph 状态图 - 新漫画生成流程（使用 LLM_conversion）"""
+        # LangGraph 在首次构建图时才导入，只导入本模块（如 CLI 菜单、--help）不加载
+        from langgraph.graph import StateGraph, END
 
         # 创建状态图
         workflow = StateGraph(AgentState)
 
-        # 添加节点（新流程：LLM生成 → 角色设计 → 文生图）
-        workflow.add_node("init", self.initialize_node)
-        workflow.add_node("generate_frames", self.generate_frames_node)
-        workflow.add_node("design_characters", self.design_characters_node)
-        workflow.add_node("generate_images", self.generate_images_node)
-        workflow.add_node("finalize", self.finalize_node)
+        # 添加节点（新流程：LLM生成 → 角色设计 → 文生图），每个节点记录耗时指标
+        workflow.add_node("init", instrument_node("init", self.initialize_node))
+        workflow.add_node("generate_frames", instrument_node("generate_frames", self.generate_frames_node))
+        workflow.add_node("design_characters", instrument_node("design_characters", self.design_characters_node))
+        workflow.add_node("generate_images", instrument_node("generate_images", self.generate_images_node))
+        workflow.add_node("retry_failed_images", instrument_node("retry_failed_images", self.retry_failed_images_node))
+        workflow.add_node("store_assets", instrument_node("store_assets", self.store_assets_node))
+        workflow.add_node("finalize", instrument_node("finalize", self.finalize_node))
 
         # 设置入口点
         workflow.set_entry_point("init")
@@ -67,34 +109,82 @@ class StoryCreationAgent:
         workflow.add_edge("init", "generate_frames")
         workflow.add_edge("generate_frames", "design_characters")
         workflow.add_edge("design_characters", "generate_images")
-        workflow.add_edge("generate_images", "finalize")
+        # 有失败画面时只重试失败的画面（有次数上限），全部成功或放弃后再转存
+        workflow.add_conditional_edges("generate_images", self._route_after_images)
+        workflow.add_conditional_edges("retry_failed_images", self._route_after_images)
+        workflow.add_edge("store_assets", "finalize")
+        workflow.add_edge("finalize", END)
+
+        # 编译图（启用检查点时每个节点完成后状态即持久化，可从中断处恢复）
+        return workflow.compile(checkpointer=get_checkpointer())
+
+    def _build_regenerate_graph(self) -> "StateGraph":
+        """
+        构建增量重新执行的状态图 - 只重新生成指定画面
+
+        复用 Memory 中已有的提示词和图片，跳过 LLM 与角色设计：
+        regenerate_images →（retry_failed_images）→ store_assets → finalize
+        """
+        from langgraph.graph import StateGraph, END
+
+        workflow = StateGraph(AgentState)
+
+        workflow.add_node("regenerate_images", instrument_node("regenerate_images", self.regenerate_images_node))
+        workflow.add_node("retry_failed_images", instrument_node("retry_failed_images", self.retry_failed_images_node))
+        workflow.add_node("store_assets", instrument_node("store_assets", self.store_assets_node))
+        workflow.add_node("finalize", instrument_node("finalize", self.finalize_node))
+
+        workflow.set_entry_point("regenerate_images")
+
+        workflow.add_conditional_edges("regenerate_images", self._route_after_images)
+        workflow.add_conditional_edges("retry_failed_images", self._route_after_images)
+        workflow.add_edge("store_assets", "finalize")
         workflow.add_edge("finalize", END)
 
-        # 编译图
         return workflow.compile()
 
+    def _run_context(self, state: AgentState, stage: str) -> Tuple[Deadline, Optional[CancelToken]]:
+        """
+        获取本次运行的截止时间和取消信号，并检查是否还能继续
+
+        Raises:
+            DeadlineExceeded: 截止时间已到
+            JobCancelled: 任务已被取消
+            BudgetExceeded: 租户预算已用完
+        """
+        deadline = Deadline.from_state(state)
+        cancel_token = get_job_registry().token_for(state.get("job_id"))
+
+        deadline.check(stage)
+        if cancel_token:
+            cancel_token.check(stage)
+        ledger = current_ledger()
+        if ledger:
+            ledger.check_budget(stage)
+
+        return deadline, cancel_token
+
     def initialize_node(self, state: AgentState) -> AgentState:
         """初始化节点 - 准备工作环境"""
-        print("\n" + "=" * 50)
-        print("🚀 初始化漫画创作流程（新流程：LLM → 角色设计 → 文生图）")
-        print("=" * 50)
-
-        # 记录到 Episodic Memory
-        self.memory.episodic.add_episode(
-            "workflow_start",
-            f"开始创作漫画项目: {state['project_name']}",
-            {"user_input": state["user_input"]}
-        )
+        logger.info("初始化漫画创作流程（LLM → 角色设计 → 文生图）", extra={"project": state["project_name"]})
 
-        # 设置 Working Memory
-        self.memory.working.set("current_project", state["project_name"])
-        self.memory.working.set("workflow_status", "initialized")
+        with self.memory.lock:
+            # 记录到 Episodic Memory
+            self.memory.episodic.add_episode(
+                "workflow_start",
+                f"开始创作漫画项目: {state['project_name']}",
+                {"user_input": state["user_input"]}
+            )
 
-        # 设置 Profile Memory（项目偏好）
-        self.memory.profile.update_settings({
-            "project_type": "storybook",
-            "total_frames": 9
-        })
+            # 设置 Working Memory
+            self.memory.working.set("current_project", state["project_name"])
+            self.memory.working.set("workflow_status", "initialized")
+
+            # 设置 Profile Memory（项目偏好）
+            self.memory.profile.update_settings({
+                "project_type": "storybook",
+                "total_frames": 9
+            })
 
         state["current_step"] = "初始化完成"
         state["completed_steps"] = ["init"]
@@ -102,16 +192,17 @@ class StoryCreationAgent:
 
     def generate_frames_node(self, state: AgentState) -> AgentState:
         """使用 LLM_conversion 生成 9 帧漫画文本和提示词节点"""
-        print("\n📝 Step 1: 使用 LLM 生成 9 帧漫画（文本+提示词）")
-        print("-" * 50)
+        logger.info("Step 1: 使用 LLM 生成 9 帧漫画（文本+提示词）")
 
         try:
+            deadline, cancel_token = self._run_context(state, "生成帧内容")
+
             memory_context = {
                 "project_name": state["project_name"]
             }
 
             # 调用 LLM_conversion 工具
-            result = generate_frames_from_llm(state["user_input"], memory_context)
+            result = generate_frames_from_llm(state["user_input"], memory_context, deadline=deadline, cancel_token=cancel_token)
 
             # 更新状态
             state["character_settings"] = result.get("character_settings", "")
@@ -121,40 +212,42 @@ class StoryCreationAgent:
             state["current_step"] = "9帧漫画内容已生成"
             state["completed_steps"] = state.get("completed_steps", []) + ["generate_frames"]
 
-            # 保存到 Semantic Memory
-            self.memory.semantic.update_knowledge("character_settings", result.get("character_settings"))
-            self.memory.semantic.update_knowledge("main_story", result.get("main_story"))
-            self.memory.semantic.update_knowledge("story_segments", result.get("segments"))
-            self.memory.semantic.update_knowledge("image_prompts", result.get("prompts"))
+            with self.memory.lock:
+                # 保存到 Semantic Memory
+                self.memory.semantic.update_knowledge("character_settings", result.get("character_settings"))
+                self.memory.semantic.update_knowledge("main_story", result.get("main_story"))
+                self.memory.semantic.update_knowledge("story_segments", result.get("segments"))
+                self.memory.semantic.update_knowledge("image_prompts", result.get("prompts"))
 
-            # 记录到 Episodic Memory
-            self.memory.episodic.add_episode(
-                "frames_generated",
-                result,
-                {"total_frames": result.get("total_frames", 9)}
-            )
+                # 记录到 Episodic Memory
+                self.memory.episodic.add_episode(
+                    "frames_generated",
+                    result,
+                    {"total_frames": result.get("total_frames", 9)}
+                )
 
-            print(f"✓ 角色设定: {result.get('character_settings', '')[:60]}...")
-            print(f"✓ 故事概要: {result.get('main_story', '')[:60]}...")
-            print(f"✓ 生成帧数: {len(result.get('segments', []))}")
+            logger.info("帧内容已生成", extra={"frames": len(result.get("segments", []))})
 
+        except ABORT_ERRORS:
+            raise
         except Exception as e:
             state["error_message"] = f"生成帧内容失败: {str(e)}"
-            print(f"✗ 错误: {state['error_message']}")
+            logger.error(state["error_message"])
 
         return state
 
     def design_characters_node(self, state: AgentState) -> AgentState:
         """设计角色详细形象节点（基于 LLM 返回的角色设定）"""
-        print("\n🎭 Step 2: 设计角色详细形象")
-        print("-" * 50)
+        logger.info("Step 2: 设计角色详细形象")
 
         try:
+            deadline, cancel_token = self._run_context(state, "设计角色")
+
             character_settings = state.get("character_settings", "")
             main_story = state.get("main_story", "")
 
             if not character_settings:
-                print("⚠️ 没有角色设定，跳过角色设计")
+                logger.warning("没有角色设定，跳过角色设计")
                 state["characters"] = []
                 state["current_step"] = "角色设计已跳过"
                 state["completed_steps"] = state.get("completed_steps", []) + ["design_characters"]
@@ -173,39 +266,43 @@ class StoryCreationAgent:
             }
 
             # 调用工具设计角色
-            characters = design_characters(outline, memory_context)
+            characters = design_characters(outline, memory_context, deadline=deadline, cancel_token=cancel_token)
 
             # 更新状态
             state["characters"] = characters
             state["current_step"] = "角色形象已设计"
             state["completed_steps"] = state.get("completed_steps", []) + ["design_characters"]
 
-            # 保存到 Semantic Memory
-            self.memory.semantic.update_knowledge("characters", characters)
+            with self.memory.lock:
+                # 保存到 Semantic Memory
+                self.memory.semantic.update_knowledge("characters", characters)
 
-            # 记录到 Episodic Memory
-            self.memory.episodic.add_episode(
-                "characters_designed",
-                characters,
-                {"character_count": len(characters)}
-            )
+                # 记录到 Episodic Memory
+                self.memory.episodic.add_episode(
+                    "characters_designed",
+                    characters,
+                    {"character_count": len(characters)}
+                )
 
-            print(f"✓ 角色数量: {len(characters)}")
+            logger.info("角色已设计", extra={"characters": len(characters)})
             for char in characters:
-                print(f"  - {char.get('name')}: {char.get('role')}")
+                logger.debug("角色 %s: %s", char.get("name"), char.get("role"))
 
+        except ABORT_ERRORS:
+            raise
         except Exception as e:
             state["error_message"] = f"设计角色失败: {str(e)}"
-            print(f"✗ 错误: {state['error_message']}")
+            logger.error(state["error_message"])
 
         return state
 
     def generate_images_node(self, state: AgentState) -> AgentState:
         """生成漫画图片节点"""
-        print("\n🖼️  Step 3: 生成漫画图片（9帧）")
-        print("-" * 50)
+        logger.info("Step 3: 生成漫画图片（9帧）")
 
         try:
+            deadline, cancel_token = self._run_context(state, "生成图片")
+
             prompts = state.get("image_prompts", [])
             if not prompts:
                 raise ValueError("缺少图片提示词")
@@ -215,78 +312,428 @@ class StoryCreationAgent:
             }
 
             # 调用工具生成图片
-            images = generate_images_from_prompts(prompts, memory_context)
+            images = generate_images_from_prompts(prompts, memory_context, deadline=deadline, cancel_token=cancel_token)
 
             # 更新状态
             state["images"] = images
             state["current_step"] = "漫画图片已生成"
             state["completed_steps"] = state.get("completed_steps", []) + ["generate_images"]
 
-            # 保存到 Semantic Memory
-            self.memory.semantic.update_knowledge("images", images)
+            with self.memory.lock:
+                # 保存到 Semantic Memory
+                self.memory.semantic.update_knowledge("images", images)
 
-            # 记录到 Episodic Memory
-            for img in images:
+                # 记录到 Episodic Memory
+                for img in images:
+                    self.memory.episodic.add_episode(
+                        "image_generated",
+                        img,
+                        {"panel_id": img.get("panel_id")}
+                    )
+
+            logger.info("图片已生成", extra={"images": len(images)})
+
+        except ABORT_ERRORS:
+            raise
+        except Exception as e:
+            state["error_message"] = f"生成图片失败: {str(e)}"
+            logger.error(state["error_message"])
+
+        return state
+
+    def _merge_images(self, state: AgentState, new_images: list):
+        """
+        按 panel_id 把新生成的图片合并回 state["images"]
+
+        成功的画面替换旧图片并作废旧的本地副本；失败时保留原来已生成的图片。
+        """
+        images = {img.get("panel_id"): img for img in state.get("images", [])}
+        assets = dict(state.get("assets") or {})
+        for img in new_images:
+            panel_id = img.get("panel_id")
+            old = images.get(panel_id, {})
+            if img.get("status") in ("generated", "mocked") or old.get("status") not in ("generated", "mocked"):
+                images[panel_id] = img
+                assets.pop(panel_id, None)
+
+        # 保持原有画面顺序
+        order = [img.get("panel_id") for img in state.get("images", [])]
+        order += [panel_id for panel_id in images if panel_id not in order]
+        state["images"] = [images[panel_id] for panel_id in order]
+        state["assets"] = assets
+
+    def _route_after_images(self, state: AgentState) -> Literal["retry_failed_images", "store_assets"]:
+        """
+        图片生成后的路由：有失败画面且未超过重试次数、截止时间未到、任务未取消时重试失败画面
+
+        有因截止时间或取消而放弃（cancelled）的画面时总是进入重试节点：重试节点检查截止时间和取消信号时
+        抛出异常中止流程，检查点停在已生成的图片之后，用同一续跑键重新提交时只补画这些画面。
+        """
+        images = state.get("images", [])
+        if any(img.get("status") == "cancelled" for img in images):
+            return "retry_failed_images"
+
+        failed = [img for img in images if img.get("status") == "failed"]
+        if not failed:
+            return "store_assets"
+
+        if state.get("image_retries", 0) >= get_config().image_retry_attempts:
+            logger.warning("%d 张图片重试 %d 次后仍失败，放弃重试", len(failed), state.get("image_retries", 0))
+            return "store_assets"
+
+        cancel_token = get_job_registry().token_for(state.get("job_id"))
+        if Deadline.from_state(state).expired() or (cancel_token and cancel_token.cancelled):
+            return "store_assets"
+
+        return "retry_failed_images"
+
+    def retry_failed_images_node(self, state: AgentState) -> AgentState:
+        """
+        重试失败画面节点 - 只重新生成状态为 failed 或 cancelled 的画面，按 panel_id 合并回结果
+
+        有失败画面时先退避等待；只有被放弃的画面（续跑时）不等待。
+        """
+        attempt = state.get("image_retries", 0) + 1
+        images = state.get("images", [])
+        failed_ids = [img.get("panel_id") for img in images if img.get("status") in ("failed", "cancelled")]
+        backoff = any(img.get("status") == "failed" for img in images)
+        logger.info("重试失败画面（第 %d 次）", attempt, extra={"panel_ids": failed_ids})
+
+        state["image_retries"] = attempt
+
+        try:
+            deadline, cancel_token = self._run_context(state, "重试失败画面")
+
+            # 指数退避，不超过剩余预算；取消信号可以打断等待
+            delay = get_config().image_retry_backoff * (2 ** (attempt - 1)) if backoff else 0.0
+            remaining = deadline.remaining()
+            if remaining is not None:
+                delay = min(delay, remaining)
+            if cancel_token:
+                cancel_token.wait(delay)
+            else:
+                time.sleep(delay)
+            deadline, cancel_token = self._run_context(state, "重试失败画面")
+
+            prompts = [p for p in state.get("image_prompts", []) if p.get("panel_id") in failed_ids]
+            memory_context = {
+                "project_name": state["project_name"]
+            }
+            # 不读取结果缓存：重试需要新的调用
+            new_images = generate_images_from_prompts(
+                prompts, memory_context, deadline=deadline, cancel_token=cancel_token, use_cache=False
+            )
+
+            self._merge_images(state, new_images)
+            state["current_step"] = f"失败画面已重试 {attempt} 次"
+            state["completed_steps"] = state.get("completed_steps", []) + ["retry_failed_images"]
+
+            with self.memory.lock:
+                # 保存到 Semantic Memory
+                self.memory.semantic.update_knowledge("images", state["images"])
+
+                # 记录到 Episodic Memory
                 self.memory.episodic.add_episode(
-                    "image_generated",
-                    img,
-                    {"panel_id": img.get("panel_id")}
+                    "images_retried",
+                    new_images,
+                    {"attempt": attempt, "panel_ids": failed_ids}
                 )
 
-            print(f"✓ 生成图片数量: {len(images)}")
-            for img in images:
-                print(f"  - Panel {img.get('panel_id')}: {img.get('image_path')}")
+            recovered = [img.get("panel_id") for img in new_images if img.get("status") == "generated"]
+            logger.info("重试完成，仍失败 %d 张", len(failed_ids) - len(recovered), extra={"recovered": recovered})
 
+        except ABORT_ERRORS:
+            raise
         except Exception as e:
-            state["error_message"] = f"生成图片失败: {str(e)}"
-            print(f"✗ 错误: {state['error_message']}")
+            state["error_message"] = f"重试失败画面出错: {str(e)}"
+            logger.error(state["error_message"])
+
+        return state
+
+    def regenerate_images_node(self, state: AgentState) -> AgentState:
+        """重新生成指定画面节点（其余画面保持不变）"""
+        panel_ids = state.get("regenerate_panel_ids", [])
+        logger.info("Step 3: 重新生成画面", extra={"panel_ids": panel_ids})
+
+        try:
+            deadline, cancel_token = self._run_context(state, "重新生成图片")
+
+            prompts = [p for p in state.get("image_prompts", []) if p.get("panel_id") in panel_ids]
+            if not prompts:
+                raise ValueError(f"没有找到画面的提示词: {panel_ids}")
+
+            memory_context = {
+                "project_name": state["project_name"]
+            }
+
+            # 只为指定画面调用文生图；不读取结果缓存，否则相同提示词会拿回原来的图片
+            new_images = generate_images_from_prompts(
+                prompts, memory_context, deadline=deadline, cancel_token=cancel_token, use_cache=False
+            )
+
+            self._merge_images(state, new_images)
+            state["current_step"] = "指定画面已重新生成"
+            state["completed_steps"] = state.get("completed_steps", []) + ["regenerate_images"]
+
+            with self.memory.lock:
+                # 保存到 Semantic Memory
+                self.memory.semantic.update_knowledge("images", state["images"])
+                self.memory.semantic.update_knowledge("assets", state["assets"])
+
+                # 记录到 Episodic Memory
+                self.memory.episodic.add_episode(
+                    "panels_regenerated",
+                    new_images,
+                    {"panel_ids": panel_ids}
+                )
+
+            for img in new_images:
+                logger.info("画面已重新生成: %s", img.get("status"), extra={"panel_id": img.get("panel_id")})
+
+        except ABORT_ERRORS:
+            raise
+        except Exception as e:
+            state["error_message"] = f"重新生成图片失败: {str(e)}"
+            logger.error(state["error_message"])
 
         return state
 
+    def store_assets_node(self, state: AgentState) -> AgentState:
+        """
+        资源转存节点 - 将提供商返回的图片转存到本地内容寻址存储
+
+        默认在后台执行（不阻塞响应），完成后写入 Memory；
+        ASSET_STORE_BLOCKING=true 时等待完成，结果中直接使用本地稳定地址。
+        转存完成后接着合成 3×3 拼版大图和 PDF（COMPOSER_ENABLED）。
+        """
+        logger.info("Step 4: 转存图片到本地资源存储")
+
+        config = get_config()
+        images = state.get("images", [])
+        segments = state.get("story_segments", [])
+        state["assets"] = state.get("assets") or {}
+        state["composition"] = state.get("composition") or {}
+        state["completed_steps"] = state.get("completed_steps", []) + ["store_assets"]
+
+        # 只转存还没有本地副本的画面（重新生成单格时其余格直接复用）
+        stored = state["assets"]
+        pending = [
+            img for img in images
+            if img.get("status") == "generated" and img.get("panel_id") not in stored
+        ]
+        if config.use_mock_mode or not config.asset_store_enabled or not pending:
+            logger.info("没有需要转存的图片，跳过")
+            return state
+
+        try:
+            pipeline = get_asset_pipeline()
+            if config.asset_store_blocking:
+                assets = {**stored, **pipeline.process(pending)}
+                self._record_assets(assets)
+                state["assets"] = assets
+                logger.info("已转存图片", extra={"assets": len(assets)})
+                state["composition"] = self._compose_storybook(segments, assets)
+            else:
+                def on_complete(new_assets: dict):
+                    assets = {**stored, **new_assets}
+                    self._record_assets(assets)
+                    self._notify_assets_stored(segments, images, assets)
+                    self._compose_storybook(segments, assets)
+
+                pipeline.submit(pending, on_complete=on_complete)
+                logger.info("已提交后台转存", extra={"assets": len(pending)})
+        except Exception as e:
+            # 转存失败不影响主流程，继续使用提供商 URL
+            logger.error("转存图片失败: %s", e)
+
+        return state
+
+    def _record_assets(self, assets: dict):
+        """记录转存结果到 Memory 并保存（可能在后台线程中调用）"""
+        if not assets:
+            return
+
+        with self.memory.lock:
+            self.memory.semantic.update_knowledge("assets", assets)
+            self.memory.episodic.add_episode(
+                "assets_stored",
+                {str(panel_id): asset["url"] for panel_id, asset in assets.items()},
+                {"asset_count": len(assets)}
+            )
+            self.memory.save_to_disk()
+
+    def _notify_assets_stored(self, segments: list, images: list, assets: dict):
+        """后台转存完成后，把使用本地稳定地址的结果交给 on_assets_stored 回调"""
+        if not self.on_assets_stored or not assets:
+            return
+
+        result = self._format_result({"story_segments": segments, "images": images, "assets": assets})
+        try:
+            self.on_assets_stored(result)
+        except Exception as e:
+            logger.error("转存完成回调失败: %s", e)
+
+    def _compose_storybook(self, segments: list, assets: dict) -> dict:
+        """
+        合成拼版大图和 PDF，并记录到 Memory（可能在后台线程中调用）
+
+        Returns:
+            {"sheet": url, "pdf": url, ...}；未启用或合成失败时返回空字典
+        """
+        if not assets or not get_config().composer_enabled:
+            return {}
+
+        try:
+            composition = get_storybook_composer().compose(segments, assets)
+        except Exception as e:
+            # 合成失败不影响主流程，前端仍可使用单格图片
+            logger.error("合成绘本失败: %s", e)
+            return {}
+
+        if composition:
+            with self.memory.lock:
+                self.memory.semantic.update_knowledge("composition", composition)
+                self.memory.episodic.add_episode(
+                    "storybook_composed",
+                    {"sheet": composition["sheet"], "pdf": composition["pdf"]},
+                    {"rendered_tiles": composition["rendered_tiles"]}
+                )
+                self.memory.save_to_disk()
+            logger.info("已合成绘本", extra={"sheet": composition["sheet"], "rendered_tiles": composition["rendered_tiles"]})
+
+        return composition
+
     def finalize_node(self, state: AgentState) -> AgentState:
         """完成节点 - 整理和保存结果"""
-        print("\n✅ Step 4: 完成漫画创作流程")
-        print("-" * 50)
+        logger.info("Step 5: 完成漫画创作流程")
 
         # 更新 Working Memory
-        self.memory.working.set("workflow_status", "completed")
-        self.memory.working.set("total_steps", len(state.get("completed_steps", [])))
-
-        # 记录到 Episodic Memory
-        self.memory.episodic.add_episode(
-            "workflow_completed",
-            {
-                "completed_steps": state.get("completed_steps", []),
-                "main_story": state.get("main_story", ""),
-                "total_frames": len(state.get("story_segments", [])),
-                "total_images": len(state.get("images", []))
-            }
-        )
+        cancel_token = get_job_registry().token_for(state.get("job_id"))
+        cancelled = cancel_token is not None and cancel_token.cancelled
+        ledger = current_ledger()
+
+        # 后台转存/拼版线程也会写 Memory 并落盘，这里的修改和保存需持有同一把锁
+        with self.memory.lock:
+            self.memory.working.set("workflow_status", "cancelled" if cancelled else "completed")
+            self.memory.working.set("total_steps", len(state.get("completed_steps", [])))
+
+            # 记录到 Episodic Memory
+            self.memory.episodic.add_episode(
+                "workflow_completed",
+                {
+                    "completed_steps": state.get("completed_steps", []),
+                    "main_story": state.get("main_story", ""),
+                    "total_frames": len(state.get("story_segments", [])),
+                    "total_images": len(state.get("images", []))
+                }
+            )
 
-        # 保存 Memory 到磁盘
-        self.memory.save_to_disk()
+            # 本次运行的用量：累加到 Profile Memory 并记录到 Episodic Memory
+            if ledger:
+                run_usage = ledger.summary()
+                totals = Usage.from_dict(self.memory.profile.get_profile("usage"))
+                totals.add(ledger.usage)
+                self.memory.profile.set_profile("usage", totals.to_dict())
+                self.memory.episodic.add_episode("usage_recorded", run_usage, {"tenant": ledger.tenant})
+
+            # 保存 Memory 到磁盘（锁可重入，save_to_disk 内部会再次获取）
+            self.memory.save_to_disk()
+
+        if ledger:
+            logger.info("本次运行用量", extra={"cost": run_usage["cost"], "llm_calls": run_usage["llm_calls"], "images": run_usage["images"]})
 
         state["current_step"] = "全部完成"
         state["completed_steps"] = state.get("completed_steps", []) + ["finalize"]
 
-        print(f"✓ 项目已保存到: memory_storage/{state['project_name']}.json")
-        print(f"✓ 完成步骤: {len(state.get('completed_steps', []))}")
-        print(f"✓ 生成帧数: {len(state.get('story_segments', []))}")
-        print(f"✓ 生成图片: {len(state.get('images', []))}")
+        logger.info(
+            "项目已保存",
+            extra={
+                "project": state["project_name"],
+                "steps": len(state.get("completed_steps", [])),
+                "frames": len(state.get("story_segments", [])),
+                "images": len(state.get("images", []))
+            }
+        )
 
         return state
 
-    def run(self, project_name: str, user_input: str):
+    def run(
+        self,
+        project_name: str,
+        user_input: str,
+        deadline: Optional[Deadline] = None,
+        job_id: Optional[str] = None,
+        thread_id: Optional[str] = None,
+        tenant: Optional[str] = None
+    ):
         """
         运行漫画生成 Agent 工作流
 
+        启用检查点（CHECKPOINT_ENABLED）且传入 thread_id（续跑键）时，同一 thread_id 上次未完成的运行
+        会从最后完成的节点继续，不会重复调用 LLM 或重新生成已完成的图片；正常结束后删除该 thread 的检查点，
+        出错时保留，以便用同一续跑键重新提交。未传入 thread_id 时每次都重新生成，结束后即删除检查点。
+        是否从检查点恢复记录在 self.resumed 中，节点出错（如截止时间已到、图片生成失败）记录在 self.error_message 中。
+
         Args:
             project_name: 项目名称
             user_input: 用户输入的漫画创意
+            deadline: 请求截止时间（可选），各节点只使用剩余预算，到期后跳过后续工作
+            job_id: 任务 ID（可选），在 JobRegistry 中登记后可通过该 ID 取消
+            thread_id: 续跑键（可选），作为检查点 thread ID；可用 resume_key() 由项目名称和创意内容生成
+            tenant: 租户（可选），用量计入该租户并受其预算限制
 
         Returns:
             格式化的结果列表：[{"word": "文本", "url": "图片URL"}, ...]
         """
+        self.resumed = False
+        self.error_message = ""
+        if not thread_id:
+            # 一次性运行：独立的 thread，无论成败都在结束后删除
+            thread_id = f"run:{uuid.uuid4().hex}"
+            try:
+                return self._run_thread(project_name, user_input, deadline, job_id, thread_id, tenant)
+            finally:
+                delete_thread(thread_id)
+
+        return self._run_thread(project_name, user_input, deadline, job_id, thread_id, tenant)
+
+    @staticmethod
+    def resume_key(project_name: str, user_input: str) -> str:
+        """由项目名称和创意内容生成续跑键（同一项目重新提交同一创意时从检查点继续）"""
+        digest = hashlib.sha256(user_input.encode("utf-8")).hexdigest()[:16]
+        return f"{project_name}:{digest}"
+
+    def _run_thread(
+        self,
+        project_name: str,
+        user_input: str,
+        deadline: Optional[Deadline],
+        job_id: Optional[str],
+        thread_id: str,
+        tenant: Optional[str]
+    ):
+        """在指定 thread 上运行工作流；有未完成的检查点时从中断处继续，正常结束后删除检查点"""
+        run_config = {"configurable": {"thread_id": thread_id}}
+
+        # 有未完成的检查点：更新本次请求的截止时间和任务 ID 后从中断处继续
+        checkpointer = self.graph.checkpointer
+        if checkpointer is not None and has_pending_thread(checkpointer, thread_id):
+            snapshot = self.graph.get_state(run_config)
+            if snapshot.next:
+                self.resumed = True
+                logger.info("从检查点恢复运行（下一步: %s）", ", ".join(snapshot.next), extra={"thread_id": thread_id})
+                self._restore_memory(snapshot.values)
+                self.graph.update_state(run_config, {
+                    "deadline": deadline.to_state() if deadline else 0.0,
+                    "job_id": job_id or ""
+                })
+                with track_usage(tenant, project_name), \
+                        start_span("agent.run", project_name=project_name, thread_id=thread_id, resumed=True):
+                    final_state = self.graph.invoke(None, run_config)
+                delete_thread(thread_id)
+                self.error_message = final_state.get("error_message", "")
+                return self._format_result(final_state)
+
         # 初始化状态
         initial_state: AgentState = {
             "project_name": project_name,
@@ -299,19 +746,108 @@ class StoryCreationAgent:
             "story_segments": [],
             "image_prompts": [],
             "images": [],
+            "assets": {},
+            "composition": {},
             "next_action": "continue",
-            "error_message": ""
+            "error_message": "",
+            "deadline": deadline.to_state() if deadline else 0.0,
+            "job_id": job_id or "",
+            "regenerate_panel_ids": [],
+            "image_retries": 0
         }
 
         # 执行工作流
-        final_state = self.graph.invoke(initial_state)
+        with track_usage(tenant, project_name), start_span("agent.run", project_name=project_name, thread_id=thread_id):
+            final_state = self.graph.invoke(initial_state, run_config)
+        delete_thread(thread_id)
+        self.error_message = final_state.get("error_message", "")
 
         # 格式化返回结果
         result = self._format_result(final_state)
 
         return result
 
-    def _format_result(self, state: AgentState) -> list:
+    def _restore_memory(self, values: dict):
+        """从检查点恢复时，把已完成节点的产出写回 Memory（进程重启后 Memory 为空）"""
+        project_name = values.get("project_name", "")
+        with self.memory.lock:
+            if (self.memory.storage_path / f"{project_name}.json").exists():
+                self.memory.load_from_disk(f"{project_name}.json")
+
+            self.memory.working.set("current_project", project_name)
+            for key in ("character_settings", "main_story", "story_segments", "image_prompts", "characters", "images"):
+                if values.get(key):
+                    self.memory.semantic.update_knowledge(key, values[key])
+
+    def regenerate_panels(
+        self,
+        project_name: str,
+        panel_ids: list,
+        deadline: Optional[Deadline] = None,
+        job_id: Optional[str] = None,
+        tenant: Optional[str] = None
+    ):
+        """
+        增量重新执行：从 Memory 加载项目，只重新生成指定画面
+
+        复用已保存的提示词、图片和本地副本，不再调用 LLM，
+        只对指定画面调用文生图（提示词相同的画面仍会合并请求），拼版也只重排变化的格。
+
+        Args:
+            project_name: 项目名称（对应 memory_storage/<project_name>.json）
+            panel_ids: 需要重新生成的画面 ID 列表
+            deadline: 请求截止时间（可选）
+            job_id: 任务 ID（可选）
+            tenant: 租户（可选），用量计入该租户并受其预算限制
+
+        Returns:
+            格式化的结果列表：[{"word": "文本", "url": "图片URL"}, ...]
+
+        Raises:
+            FileNotFoundError: 项目不存在
+            ValueError: 画面 ID 不存在
+        """
+        if not self.memory.load_from_disk(f"{project_name}.json"):
+            raise FileNotFoundError(f"项目不存在: {project_name}")
+
+        semantic = self.memory.semantic
+        image_prompts = semantic.get_knowledge("image_prompts") or []
+        known_ids = {p.get("panel_id") for p in image_prompts}
+        unknown_ids = [panel_id for panel_id in panel_ids if panel_id not in known_ids]
+        if unknown_ids:
+            raise ValueError(f"画面不存在: {unknown_ids}")
+
+        assets = stored_assets(self.memory)
+
+        state: AgentState = {
+            "project_name": project_name,
+            "user_input": "",
+            "current_step": "starting",
+            "completed_steps": [],
+            "character_settings": semantic.get_knowledge("character_settings") or "",
+            "main_story": semantic.get_knowledge("main_story") or "",
+            "characters": semantic.get_knowledge("characters") or [],
+            "story_segments": semantic.get_knowledge("story_segments") or [],
+            "image_prompts": image_prompts,
+            "images": semantic.get_knowledge("images") or [],
+            "assets": assets,
+            "composition": semantic.get_knowledge("composition") or {},
+            "next_action": "continue",
+            "error_message": "",
+            "deadline": deadline.to_state() if deadline else 0.0,
+            "job_id": job_id or "",
+            "regenerate_panel_ids": list(panel_ids),
+            "image_retries": 0
+        }
+
+        with track_usage(tenant, project_name), \
+                start_span("agent.regenerate_panels", project_name=project_name, panel_ids=list(panel_ids)):
+            final_state = self.regenerate_graph.invoke(state)
+
+        return self._format_result(final_state)
+
+    @staticmethod
+    def _format_result(state: AgentState) -> list:
         """
         格式化最终结果为简洁的列表格式
 
@@ -323,6 +859,7 @@ class StoryCreationAgent:
         """
         segments = state.get("story_segments", [])
         images = state.get("images", [])
+        assets = state.get("assets") or {}
 
         # 创建 panel_id 到图片的映射
         image_map = {img.get("panel_id"): img for img in images}
@@ -333,9 +870,10 @@ class StoryCreationAgent:
             panel_id = segment.get("panel_id")
             text = segment.get("text", "")
 
-            # 获取对应的图片
+            # 获取对应的图片（已转存到本地的优先使用稳定地址）
             img = image_map.get(panel_id, {})
-            image_url = img.get("image_url", "")
+            asset = assets.get(panel_id, {})
+            image_url = asset.get("url") or img.get("image_url", "")
 
             result.append({
                 "word": text,
@@ -352,5 +890,53 @@ class StoryCreationAgent:
 2. generate_frames - 使用LLM生成9帧文本+提示词（一次性）
 3. design_characters - 设计角色详细形象
 4. generate_images - 生成漫画图片（9帧）
-5. finalize - 完成并保存
+   retry_failed_images - 有失败画面时只重试失败的画面（退避，次数有上限）
+5. store_assets - 转存图片到本地资源存储，并合成拼版大图和 PDF（默认后台执行）
+6. finalize - 完成并保存
+
+增量重新执行（regenerate_panels）：
+regenerate_images →（retry_failed_images）→ store_assets → finalize，只重新生成指定画面
         """.strip()
+
+
+def stored_assets(memory: MemorySystem) -> dict:
+    """
+    读取 Memory 中的转存结果
+
+    Memory 以 JSON 保存，assets 的键会变成字符串，这里还原为画面 ID。
+
+    Returns:
+        {panel_id: {"url": ..., ...}}
+    """
+    return {
+        int(key) if isinstance(key, str) and key.isdigit() else key: asset
+        for key, asset in (memory.semantic.get_knowledge("assets") or {}).items()
+    }
+
+
+def project_result(memory: MemorySystem) -> dict:
+    """
+    由已保存的项目 Memory 重建结果（已转存的画面使用本地稳定地址）
+
+    后台转存模式下响应中是提供商的临时 URL，转存完成后可通过此结果取得稳定地址。
+
+    Args:
+        memory: 已从磁盘加载的项目 Memory
+
+    Returns:
+        {"result": [{"word": "文本", "url": "图片URL"}, ...], "pending": [尚未转存的画面 ID]}
+    """
+    with memory.lock:
+        semantic = memory.semantic
+        images = semantic.get_knowledge("images") or []
+        state = {
+            "story_segments": semantic.get_knowledge("story_segments") or [],
+            "images": images,
+            "assets": stored_assets(memory)
+        }
+
+    pending = [
+        img.get("panel_id") for img in images
+        if img.get("status") == "generated" and img.get("panel_id") not in state["assets"]
+    ]
+    return {"result": StoryCreationAgent._format_result(state), "pending": pending}
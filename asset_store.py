@@ -0,0 +1,305 @@
+"""
+本地资源存储模块
+将文生图提供商返回的（会过期的）图片 URL 转存到本地，生成稳定的访问路径：
+- 内容寻址：文件名为内容的 sha256，按前两级分片目录存放（ab/cd/<hash>.png）
+- 并行下载：所有画面在线程池中同时下载
+- 衍生图：缩略图和 WebP 版本在进程池中用 Pillow 生成，不占用 API 进程的 GIL
+- 后台执行：AssetPipeline 在后台线程中运行，不阻塞接口响应
+
+文件名由内容决定且永不改变，可直接交给 CDN 按不可变资源长期缓存。
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+
+from config import get_config
+from tracing import start_span, wrap_context
+from logger import get_logger
+
+
+logger = get_logger("asset_store")
+
+# 下载分块大小（字节）
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Content-Type 到扩展名的映射
+CONTENT_TYPE_EXTENSIONS = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+}
+
+
+def render_variants(source_path: str, sizes: List[int]) -> Dict[str, str]:
+    """
+    生成缩略图和 WebP 衍生图（在进程池中运行）
+
+    Args:
+        source_path: 原图路径
+        sizes: 缩略图边长列表（按长边等比缩放）
+
+    Returns:
+        {"webp": 路径, "thumb_256": 路径, ...}；Pillow 未安装时返回空字典
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return {}
+
+    source = Path(source_path)
+    variants: Dict[str, str] = {}
+
+    with Image.open(source) as img:
+        img.load()
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+
+        webp_path = source.with_suffix(".webp")
+        if source.suffix != ".webp" and not webp_path.exists():
+            img.save(webp_path, "WEBP", quality=85, method=4)
+        variants["webp"] = str(webp_path)
+
+        for size in sizes:
+            thumb_path = source.with_name(f"{source.stem}_{size}.webp")
+            if not thumb_path.exists():
+                thumb = img.copy()
+                thumb.thumbnail((size, size), Image.LANCZOS)
+                thumb.save(thumb_path, "WEBP", quality=80, method=4)
+            variants[f"thumb_{size}"] = str(thumb_path)
+
+    return variants
+
+
+class AssetStore:
+    """内容寻址的本地图片存储"""
+
+    def __init__(self, root: str = "asset_storage", public_base_url: str = "/assets"):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.public_base_url = public_base_url.rstrip("/")
+
+    def path_for(self, digest: str, extension: str) -> Path:
+        """内容哈希对应的分片存储路径：<root>/ab/cd/<hash><ext>"""
+        return self.root / digest[:2] / digest[2:4] / f"{digest}{extension}"
+
+    def url_for(self, path: Path) -> str:
+        """存储路径对应的稳定访问 URL"""
+        relative = Path(path).relative_to(self.root).as_posix()
+        return f"{self.public_base_url}/{relative}"
+
+    def _commit(self, temp_path: str, digest: str, extension: str, size: int) -> Dict[str, Any]:
+        """将临时文件移动到内容寻址路径（已存在则丢弃临时文件）"""
+        final_path = self.path_for(digest, extension)
+        if final_path.exists():
+            os.remove(temp_path)
+        else:
+            final_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(temp_path, final_path)
+
+        return {
+            "hash": digest,
+            "path": str(final_path),
+            "url": self.url_for(final_path),
+            "size": size,
+        }
+
+    def store_url(self, url: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        流式下载图片，边下载边计算 sha256，完成后放入内容寻址路径
+
+        Args:
+            url: 图片 URL
+            timeout: 下载超时（秒）
+
+        Returns:
+            {"hash", "path", "url", "size"}
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix=".part")
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                with requests.get(url, timeout=timeout or get_config().api_timeout, stream=True) as response:
+                    response.raise_for_status()
+                    content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        digest.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+
+            extension = CONTENT_TYPE_EXTENSIONS.get(content_type) or Path(url.split("?")[0]).suffix or ".png"
+            return self._commit(temp_path, digest.hexdigest(), extension, size)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def store_file(self, source_path: str) -> Dict[str, Any]:
+        """
+        将本地文件（如 Stability 已解码保存的图片）复制进存储
+
+        Returns:
+            {"hash", "path", "url", "size"}
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix=".part")
+
+        try:
+            with os.fdopen(fd, "wb") as dst, open(source_path, "rb") as src:
+                for chunk in iter(lambda: src.read(DOWNLOAD_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    dst.write(chunk)
+                    size += len(chunk)
+
+            extension = Path(source_path).suffix or ".png"
+            return self._commit(temp_path, digest.hexdigest(), extension, size)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+
+class AssetPipeline:
+    """
+    资源转存流水线：并行下载 → 进程池生成衍生图 → 回调通知
+
+    submit() 立即返回，整个流程在后台线程中执行。
+    """
+
+    def __init__(self, store: Optional[AssetStore] = None):
+        config = get_config()
+        self.store = store or AssetStore(config.asset_storage_path, config.asset_public_base_url)
+        self.download_workers = config.asset_download_workers
+        self.variant_processes = config.asset_variant_processes
+        self.thumbnail_sizes = config.asset_thumbnail_sizes
+        self._background = ThreadPoolExecutor(max_workers=2, thread_name_prefix="asset-pipeline")
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def get_process_pool(self) -> Optional[ProcessPoolExecutor]:
+        """延迟创建进程池（variant_processes <= 0 时在当前进程生成衍生图）"""
+        if self.variant_processes <= 0:
+            return None
+        with self._lock:
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(max_workers=self.variant_processes)
+            return self._process_pool
+
+    def download_all(self, images: List[Dict[str, Any]]) -> Dict[Any, Dict[str, Any]]:
+        """
+        并行下载所有已生成的画面
+
+        Args:
+            images: generate_images_from_prompts 返回的图片列表
+
+        Returns:
+            {panel_id: asset}；下载失败的画面不包含在内
+        """
+        targets = [
+            img for img in images
+            if img.get("status") == "generated" and (img.get("image_url") or img.get("local_path"))
+        ]
+        assets: Dict[Any, Dict[str, Any]] = {}
+        if not targets:
+            return assets
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.download_workers, len(targets)))) as executor:
+            futures = {
+                (
+                    executor.submit(self.store.store_file, img["local_path"]) if img.get("local_path")
+                    else executor.submit(self.store.store_url, img["image_url"])
+                ): img.get("panel_id")
+                for img in targets
+            }
+            for future, panel_id in futures.items():
+                try:
+                    assets[panel_id] = future.result()
+                except Exception as e:
+                    logger.warning("图片转存失败: %s", e, extra={"panel_id": panel_id})
+
+        return assets
+
+    def add_variants(self, assets: Dict[Any, Dict[str, Any]]):
+        """为已转存的图片生成缩略图和 WebP 版本，并写入 asset["variants"]"""
+        if not assets:
+            return
+
+        pool = self.get_process_pool()
+        if pool is None:
+            results = {
+                panel_id: render_variants(asset["path"], self.thumbnail_sizes)
+                for panel_id, asset in assets.items()
+            }
+        else:
+            futures = {
+                panel_id: pool.submit(render_variants, asset["path"], self.thumbnail_sizes)
+                for panel_id, asset in assets.items()
+            }
+            results = {}
+            for panel_id, future in futures.items():
+                try:
+                    results[panel_id] = future.result()
+                except Exception as e:
+                    logger.warning("衍生图生成失败: %s", e, extra={"panel_id": panel_id})
+                    results[panel_id] = {}
+
+        for panel_id, variants in results.items():
+            assets[panel_id]["variants"] = {
+                name: self.store.url_for(Path(path)) for name, path in variants.items()
+            }
+
+    def process(self, images: List[Dict[str, Any]]) -> Dict[Any, Dict[str, Any]]:
+        """同步执行完整流程：下载 + 衍生图"""
+        with start_span("assets.process", images=len(images)) as span:
+            assets = self.download_all(images)
+            self.add_variants(assets)
+            span.set_attribute("stored", len(assets))
+        return assets
+
+    def submit(
+        self,
+        images: List[Dict[str, Any]],
+        on_complete: Optional[Callable[[Dict[Any, Dict[str, Any]]], None]] = None
+    ):
+        """
+        在后台执行完整流程，完成后调用 on_complete(assets)
+
+        Returns:
+            Future
+        """
+        def run():
+            assets = self.process(images)
+            if on_complete:
+                on_complete(assets)
+            return assets
+
+        # 后台任务继续记录在发起请求的 trace 下
+        return self._background.submit(wrap_context(run))
+
+    def shutdown(self):
+        """关闭后台线程和进程池"""
+        self._background.shutdown(wait=True)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=True)
+
+
+# 全局资源流水线实例
+_asset_pipeline: Optional[AssetPipeline] = None
+
+
+def get_asset_pipeline() -> AssetPipeline:
+    """获取全局资源流水线实例（单例模式）"""
+    global _asset_pipeline
+    if _asset_pipeline is None:
+        _asset_pipeline = AssetPipeline()
+    return _asset_pipeline
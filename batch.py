@@ -0,0 +1,360 @@
+"""
+批量生成绘本（离线）
+从 JSONL 读取创意，在同一进程内并发运行多条 StoryCreationAgent 流程：
+- 所有绘本共享进程内的 LLM / 文生图并发上限（MAX_CONCURRENT_REQUESTS / MAX_CONCURRENT_IMAGES），
+  同时运行的绘本数只决定排队的深度，不会放大对提供商的并发
+- 每完成一本立即向输出 JSONL 追加一行并刷新，中途退出不丢失已完成的结果
+- 可续跑：输出文件中已成功的 id 直接跳过；失败和部分完成的 id 重新生成（同一 id 以最后一行为准）。
+  未完成的流程在启用检查点（CHECKPOINT_ENABLED）时从最后完成的节点继续
+- 结束时打印吞吐量汇总
+
+输入每行一个 JSON 对象：
+    {"id": "cat-001", "prompt": "一只会魔法的小猫咪在森林里冒险", "project_name": "可选"}
+id 缺省时取创意内容的哈希；project_name 缺省时为 batch_<id>。
+
+输出每行一个 JSON 对象：
+    {"id": ..., "project_name": ..., "status": "completed" | "partial" | "failed", "seconds": ..., "result": [...], "error": ...}
+completed 表示每一格都有图片且流程没有出错；partial 表示只生成了部分画面（如截止时间已到），
+result 中缺图的格 url 为空；failed 表示没有生成任何画面。
+
+使用方法:
+    python main.py --batch prompts.jsonl
+    python main.py --batch prompts.jsonl --output results.jsonl --concurrency 8 --llm-concurrency 6 --image-concurrency 10
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+from accounting import DEFAULT_TENANT
+from config import get_config
+from deadline import Deadline
+from jobs import get_job_registry
+from logger import get_logger
+from memory import sanitize_project_name
+from tracing import start_span
+
+
+logger = get_logger("batch")
+
+# 日志中的状态名称
+_STATUS_LABELS = {"completed": "已完成", "partial": "部分完成", "failed": "生成失败"}
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """样本分位数（最近秩法），没有样本时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, math.ceil(q * len(ordered)) - 1)
+    return ordered[index]
+
+
+def outcome(result: List[Dict[str, Any]], error_message: str = "") -> Dict[str, Any]:
+    """
+    由每一格的图片地址和流程错误判定一本绘本的状态
+
+    Args:
+        result: StoryCreationAgent.run 的结果 [{"word": ..., "url": ...}, ...]
+        error_message: 流程中记录的错误（StoryCreationAgent.error_message）
+
+    Returns:
+        {"status": "completed" | "partial" | "failed", "result": [...], "error": ...}
+    """
+    missing = [index for index, item in enumerate(result, 1) if not item.get("url")]
+    if result and not missing and not error_message:
+        return {"status": "completed", "result": result}
+    if not result or len(missing) == len(result):
+        return {"status": "failed", "result": result, "error": error_message or "未生成任何画面"}
+    return {
+        "status": "partial",
+        "result": result,
+        "error": error_message or f"第 {', '.join(map(str, missing))} 格未生成图片"
+    }
+
+
+def read_items(path: str) -> List[Dict[str, Any]]:
+    """
+    读取输入 JSONL（跳过空行；无法解析或缺少 prompt 的行记录警告后跳过；重复的 id 只保留第一条）
+
+    Returns:
+        [{"id": ..., "prompt": ..., "project_name": ...}, ...]
+    """
+    items = []
+    seen: Set[str] = set()
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning("第 %d 行不是合法的 JSON，跳过: %s", line_no, e)
+                continue
+            prompt = record.get("prompt") if isinstance(record, dict) else None
+            if not isinstance(prompt, str) or not prompt.strip():
+                logger.warning("第 %d 行缺少 prompt，跳过", line_no)
+                continue
+
+            item_id = str(record.get("id") or hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16])
+            if item_id in seen:
+                logger.warning("第 %d 行的 id 重复，跳过: %s", line_no, item_id)
+                continue
+            seen.add(item_id)
+            project_name = record.get("project_name") or f"batch_{item_id}"
+            items.append({"id": item_id, "prompt": prompt, "project_name": sanitize_project_name(project_name)})
+    return items
+
+
+def completed_ids(path: str) -> Set[str]:
+    """输出文件中已成功完成的 id（文件不存在时为空；同一 id 以最后一行为准）"""
+    status: Dict[str, str] = {}
+    output = Path(path)
+    if not output.exists():
+        return set()
+    with open(output, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                status[str(record["id"])] = record.get("status", "")
+            except (json.JSONDecodeError, KeyError, TypeError):
+                # 进程被强制结束时最后一行可能不完整
+                continue
+    return {item_id for item_id, item_status in status.items() if item_status == "completed"}
+
+
+class BatchRunner:
+    """并发运行多条绘本生成流程，结果逐条追加到输出 JSONL"""
+
+    def __init__(
+        self,
+        output_path: str,
+        concurrency: int = 4,
+        timeout: Optional[float] = None,
+        tenant: str = DEFAULT_TENANT
+    ):
+        """
+        Args:
+            output_path: 输出 JSONL 路径（追加写入）
+            concurrency: 同时运行的绘本数
+            timeout: 每本绘本的预算时间（秒），默认取 REQUEST_DEADLINE，0 表示不限时
+            tenant: 用量计入的租户
+        """
+        self.output_path = output_path
+        self.concurrency = max(1, concurrency)
+        self.timeout = get_config().request_deadline if timeout is None else timeout
+        self.tenant = tenant
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._running: Set[str] = set()
+        self.durations: List[float] = []
+        self.counts = {"completed": 0, "partial": 0, "failed": 0, "cancelled": 0}
+
+    def run_one(self, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        生成一本绘本
+
+        Returns:
+            输出记录；批量任务被中断而放弃时返回 None（不写出，续跑时重新生成）
+        """
+        from agent_core import StoryCreationAgent
+        from memory import MemorySystem
+
+        if self._stopping.is_set():
+            return None
+
+        # 以 id 作为任务 ID 和检查点 thread ID：中断后续跑时从最后完成的节点继续
+        job_id = f"batch:{item['id']}"
+        registry = get_job_registry()
+        job = registry.create(job_id)
+        with self._lock:
+            self._running.add(job_id)
+        started = time.perf_counter()
+        record = {"id": item["id"], "project_name": item["project_name"]}
+
+        with start_span("batch.item", new_trace=True, item_id=item["id"], job_id=job_id) as span:
+            try:
+                memory = MemorySystem(item["project_name"])
+                memory.profile.update_settings({
+                    "project_type": "comic",
+                    "comic_style": "manga"
+                })
+                agent = StoryCreationAgent(memory)
+                result = agent.run(
+                    item["project_name"],
+                    item["prompt"],
+                    deadline=Deadline.after(self.timeout),
+                    job_id=job_id,
+                    thread_id=job_id,
+                    tenant=self.tenant
+                )
+                if agent.resumed:
+                    span.set_attribute("resumed", True)
+
+                if job.token.cancelled:
+                    span.set_attribute("status", "cancelled")
+                    return None
+                record.update(outcome(result, agent.error_message))
+            except Exception as e:
+                if job.token.cancelled:
+                    span.set_attribute("status", "cancelled")
+                    return None
+                logger.error("绘本生成失败: %s", e, extra={"item_id": item["id"]})
+                record.update({"status": "failed", "error": str(e)})
+            finally:
+                registry.finish(job_id)
+                with self._lock:
+                    self._running.discard(job_id)
+
+            record["seconds"] = round(time.perf_counter() - started, 3)
+            span.set_attribute("status", record["status"])
+        return record
+
+    def write(self, record: Dict[str, Any]):
+        """追加一条结果并立即刷新到磁盘"""
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            with open(self.output_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+
+    def stop(self, reason: str = "批量任务已中断"):
+        """不再开始新的绘本，并取消进行中的绘本（已完成节点保存在检查点中）"""
+        self._stopping.set()
+        with self._lock:
+            job_ids = list(self._running)
+        for job_id in job_ids:
+            get_job_registry().cancel(job_id, reason)
+
+    def collect(self, future, item: Dict[str, Any], progress: str = ""):
+        """写出一本绘本的结果并计数（被放弃的绘本只计数，不写出）"""
+        try:
+            record = future.result()
+        except Exception as e:
+            # 例如同一 id 的任务已在运行（JobExists）
+            record = {"id": item["id"], "project_name": item["project_name"], "status": "failed", "error": str(e)}
+        if record is None:
+            self.counts["cancelled"] += 1
+            return
+
+        self.write(record)
+        self.counts[record["status"]] += 1
+        if "seconds" in record:
+            self.durations.append(record["seconds"])
+        logger.info(
+            "绘本%s %s",
+            _STATUS_LABELS[record["status"]],
+            progress,
+            extra={"item_id": record["id"], "seconds": record.get("seconds")}
+        )
+
+    def run(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        并发生成全部绘本，每完成一本写出一行
+
+        Returns:
+            吞吐量汇总
+        """
+        Path(self.output_path).parent.mkdir(parents=True, exist_ok=True)
+        started = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch")
+        futures = {executor.submit(self.run_one, item): item for item in items}
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.collect(future, futures[future], f"（{len(futures) - len(pending)}/{len(futures)}）")
+        except KeyboardInterrupt:
+            logger.warning("收到中断，取消进行中的绘本（已完成的结果已写出，重新运行即可续跑）")
+            self.stop()
+            for future in pending:
+                future.cancel()
+            # 等待进行中的流程在取消信号下退出，期间完成的结果照常写出
+            for future in pending:
+                if future.cancelled():
+                    self.counts["cancelled"] += 1
+                else:
+                    self.collect(future, futures[future])
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        return self.summary(time.perf_counter() - started)
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        """吞吐量汇总"""
+        finished = self.counts["completed"] + self.counts["partial"] + self.counts["failed"]
+        return {
+            **self.counts,
+            "elapsed": round(elapsed, 2),
+            "throughput_per_min": round(finished / elapsed * 60, 2) if elapsed > 0 else 0.0,
+            "latency": {
+                "p50": percentile(self.durations, 0.50),
+                "p95": percentile(self.durations, 0.95),
+                "max": max(self.durations) if self.durations else None
+            }
+        }
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.2f}"
+
+
+def print_summary(summary: Dict[str, Any], skipped: int, output_path: str):
+    """打印吞吐量汇总"""
+    config = get_config()
+    latency = summary["latency"]
+    print("\n" + "=" * 70)
+    print("📦 批量生成完成")
+    print("=" * 70)
+    print(f"完成: {summary['completed']}   部分完成: {summary['partial']}   失败: {summary['failed']}   "
+          f"中断: {summary['cancelled']}   已跳过（此前已完成）: {skipped}")
+    print(f"耗时: {summary['elapsed']}s   吞吐量: {summary['throughput_per_min']} 本/分钟")
+    print(f"单本耗时（秒） p50={_fmt(latency['p50'])} p95={_fmt(latency['p95'])} max={_fmt(latency['max'])}")
+    print(f"并发上限: LLM {config.max_concurrent_requests}   文生图 {config.max_concurrent_images}")
+    print(f"💾 结果已写入: {output_path}")
+    print("=" * 70)
+
+
+def run_batch(argv: List[str]) -> int:
+    """
+    批量模式入口（python main.py --batch input.jsonl ...）
+
+    Returns:
+        退出码：全部成功为 0，有部分完成、失败或中断为 1
+    """
+    parser = argparse.ArgumentParser(prog="main.py --batch", description="StoryBook 批量生成绘本")
+    parser.add_argument("input", help="输入 JSONL（每行 {\"id\", \"prompt\"}）")
+    parser.add_argument("--output", default=None, help="输出 JSONL（默认 output/<输入文件名>.results.jsonl），已存在时追加并跳过已完成的 id")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时运行的绘本数")
+    parser.add_argument("--llm-concurrency", type=int, default=None, help="所有绘本共享的 LLM 并发上限（默认取 MAX_CONCURRENT_REQUESTS）")
+    parser.add_argument("--image-concurrency", type=int, default=None, help="所有绘本共享的文生图并发上限（默认取 MAX_CONCURRENT_IMAGES）")
+    parser.add_argument("--timeout", type=float, default=None, help="每本绘本的预算时间（秒，默认取 REQUEST_DEADLINE，0 表示不限时）")
+    parser.add_argument("--tenant", default=DEFAULT_TENANT, help="用量计入的租户")
+    args = parser.parse_args(argv)
+
+    # 并发上限需在创建 LLM / 文生图客户端之前设定
+    config = get_config()
+    if args.llm_concurrency:
+        config.max_concurrent_requests = args.llm_concurrency
+    if args.image_concurrency:
+        config.max_concurrent_images = args.image_concurrency
+
+    output_path = args.output or str(Path("output") / f"{Path(args.input).stem}.results.jsonl")
+    items = read_items(args.input)
+    done = completed_ids(output_path)
+    todo = [item for item in items if item["id"] not in done]
+    skipped = len(items) - len(todo)
+
+    print(f"📥 共 {len(items)} 条，已完成 {skipped} 条，本次生成 {len(todo)} 条（同时 {args.concurrency} 本）")
+    runner = BatchRunner(output_path, concurrency=args.concurrency, timeout=args.timeout, tenant=args.tenant)
+    summary = runner.run(todo)
+    print_summary(summary, skipped, output_path)
+    return 0 if summary["completed"] == len(todo) else 1
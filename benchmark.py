@@ -0,0 +1,438 @@
+"""
+CPU 热路径微基准
+不调用任何外部 API（模拟模式 + 零延迟的假客户端），只测量流水线自身的 CPU 开销：
+- 状态图编译
+- generate_frames_from_llm 对 9 帧结果的转换
+- StoryCreationAgent._format_result
+- MemorySystem.save_to_disk / load_from_disk（1 / 100 / 10000 条事件）
+- LLM 返回内容的清洗与 JSON 解析（design_characters）
+- generate_images_from_prompts 的调度开销（零延迟文生图）
+- 启动耗时：在子进程中导入各入口（main.py --help、CLI、tools、API），
+  并检查入口导入后没有加载 LAZY_MODULES 中的重型依赖
+
+结果写入 JSON，可与之前提交的结果对比，发现性能回退。
+
+使用方法:
+    python benchmark.py                                     # 运行全部，写入 benchmark_result.json
+    python benchmark.py --output baseline.json              # 保存为基线
+    python benchmark.py --compare baseline.json             # 与基线对比（中位数变慢超过 20% 视为回退）
+    python benchmark.py --filter memory --repeat 10
+"""
+
+import os
+
+# 必须在导入项目模块之前设置：不访问外部服务，不导出追踪，不写检查点
+os.environ.setdefault("USE_MOCK_MODE", "true")
+os.environ.setdefault("TRACE_EXPORTER", "none")
+os.environ.setdefault("CHECKPOINT_ENABLED", "false")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import argparse
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+
+# 基准注册表：名称 -> 准备函数（返回被计时的无参函数，准备工作不计入耗时）
+BENCHMARKS: Dict[str, Callable[[], Callable[[], Any]]] = {}
+
+# 临时目录（Memory 读写基准使用），运行结束后删除
+_temp_dirs: List[str] = []
+
+# 启动基准：名称 -> 在新解释器中执行的代码
+STARTUP_CASES = {
+    "startup.main_help": "import sys, runpy; sys.argv = ['main.py', '--help']; runpy.run_path('main.py', run_name='__main__')",
+    "startup.import_cli": "import cli",
+    "startup.import_tools": "import tools",
+    "startup.import_api": "import APIController",
+}
+
+# 入口导入后不应加载的重型依赖（首次使用时才导入）
+LAZY_MODULES = ("openai", "langgraph", "PIL")
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def benchmark(name: str):
+    """注册一个基准"""
+    def register(setup: Callable[[], Callable[[], Any]]):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def _temp_dir() -> str:
+    path = tempfile.mkdtemp(prefix="storybook_bench_")
+    _temp_dirs.append(path)
+    return path
+
+
+def _story_payload() -> Dict[str, Any]:
+    """LLM_conversion 返回的 9 帧故事数据"""
+    return {
+        "main_story": "一家五口三代同堂，在大平层房子里度过温馨的一天。" * 4,
+        "character_settings": "爷爷：白发，中山装；奶奶：银发，红毛衣；爸爸：短发，衬衫；妈妈：长发，围裙；小明：十岁，蓝T恤",
+        "frames": [
+            {
+                "frame_index": index,
+                "scene_description": f"第{index}帧：清晨的阳光洒进客厅，一家人围坐在餐桌旁吃早餐，有说有笑。" * 2,
+                "visual_prompt": f"storybook illustration, warm morning light, family of five at breakfast table, scene {index}, "
+                                 "soft watercolor, high detail, cozy atmosphere"
+            }
+            for index in range(1, 10)
+        ]
+    }
+
+
+def _final_state() -> Dict[str, Any]:
+    """9 格全部生成且已转存的最终状态"""
+    import tools
+
+    original = tools.generate_story_data
+    tools.generate_story_data = lambda *args, **kwargs: _story_payload()
+    try:
+        frames = tools.generate_frames_from_llm("bench", {})
+    finally:
+        tools.generate_story_data = original
+
+    return {
+        "story_segments": frames["segments"],
+        "images": [
+            {"panel_id": p["panel_id"], "image_url": f"https://example.com/{p['panel_id']}.png", "status": "generated"}
+            for p in frames["prompts"]
+        ],
+        "assets": {
+            p["panel_id"]: {"url": f"/assets/{p['panel_id']:02d}.png", "hash": f"{p['panel_id']:064x}"}
+            for p in frames["prompts"]
+        }
+    }
+
+
+# ================= 基准 =================
+
+@benchmark("graph.compile")
+def bench_graph_compile():
+    from agent_core import StoryCreationAgent
+    from memory import MemorySystem
+
+    memory = MemorySystem("bench")
+    memory.storage_path = __import__("pathlib").Path(_temp_dir())
+    agent = StoryCreationAgent(memory)
+    return lambda: (agent._build_graph(), agent._build_regenerate_graph())
+
+
+@benchmark("tools.generate_frames_from_llm")
+def bench_generate_frames():
+    import tools
+
+    payload = _story_payload()
+    tools.generate_story_data = lambda *args, **kwargs: payload
+    return lambda: tools.generate_frames_from_llm("一家五口三代同堂的温馨一天", {"project_name": "bench"})
+
+
+@benchmark("agent.format_result")
+def bench_format_result():
+    from agent_core import StoryCreationAgent
+    from memory import MemorySystem
+
+    memory = MemorySystem("bench")
+    memory.storage_path = __import__("pathlib").Path(_temp_dir())
+    agent = StoryCreationAgent(memory)
+    state = _final_state()
+    return lambda: agent._format_result(state)
+
+
+def _memory_with_episodes(count: int):
+    from pathlib import Path
+    from memory import MemorySystem
+
+    memory = MemorySystem("bench")
+    memory.storage_path = Path(_temp_dir())
+    state = _final_state()
+    memory.semantic.update_knowledge("story_segments", state["story_segments"])
+    memory.semantic.update_knowledge("images", state["images"])
+    memory.semantic.update_knowledge("assets", state["assets"])
+    for index in range(count):
+        image = state["images"][index % len(state["images"])]
+        memory.episodic.add_episode("image_generated", image, {"panel_id": image["panel_id"]})
+    return memory
+
+
+for _count in (1, 100, 10000):
+    def _register(count: int):
+        @benchmark(f"memory.save_to_disk[{count}]")
+        def bench_save():
+            memory = _memory_with_episodes(count)
+            return lambda: memory.save_to_disk("bench.json")
+
+        @benchmark(f"memory.load_from_disk[{count}]")
+        def bench_load():
+            memory = _memory_with_episodes(count)
+            memory.save_to_disk("bench.json")
+            return lambda: memory.load_from_disk("bench.json")
+
+    _register(_count)
+
+
+@benchmark("tools.design_characters.parse")
+def bench_parse_characters():
+    import tools
+
+    characters = [
+        {
+            "name": f"角色{index}",
+            "role": "主角" if index == 0 else "配角",
+            "appearance": "short black hair, blue t-shirt, round glasses, friendly smile " * 3,
+            "personality": "好奇、善良、勇敢",
+            "visual_tags": ["boy", "blue_shirt", "glasses"]
+        }
+        for index in range(5)
+    ]
+    from json_utils import parse_llm_json
+
+    # LLM 常见的返回形式：带 ```json 围栏的 JSON（模拟不支持结构化输出的服务，测量提取 + 校验开销）
+    response = "```json\n" + json.dumps(characters, ensure_ascii=False, indent=2) + "\n```"
+    tools.call_llm = lambda *args, schema=None, **kwargs: parse_llm_json(response, schema)
+    outline = {"title": "bench", "theme": "温馨", "plot_outline": "一家人的一天", "character_settings": "五口之家"}
+    return lambda: tools.design_characters(outline, {"project_name": "bench"})
+
+
+# LLM 输出中常见的 JSON 形式（用于 json_utils 的提取基准）
+JSON_CORPUS = [
+    '{"panel_id": 1, "text": "纯 JSON"}',
+    '```json\n{"panel_id": 2, "text": "代码块"}\n```',
+    '好的，以下是结果：\n{"panel_id": 3, "text": "前后有说明"}\n希望对你有帮助！',
+    '{"panel_id": 4, "style_tags": ["manga", "high_quality",], "text": "末尾逗号",}',
+    '{"panel_id": 5, "text": "字符串里的括号 {} [] 和 \\"引号\\""}',
+    '```\n{"characters": [{"name": "林晨"}, {"name": "祖父"}]}\n```',
+    '示例 {不是 JSON} 之后才是 {"panel_id": 7, "nested": {"a": [1, {"b": 2}]}, "text": "嵌套"}',
+]
+
+
+def _fuzz_json_round_trip(rounds: int = 500):
+    """随机对象加上说明文字、代码块和末尾逗号后应能原样提取，否则抛出 RuntimeError"""
+    import random
+
+    from json_utils import extract_json
+
+    rng = random.Random(42)
+    alphabet = "abc 中文{}[],:\"\\\n"
+
+    def value(depth: int):
+        kind = rng.randrange(6 if depth < 3 else 4)
+        if kind == 0:
+            return rng.randint(-1000, 1000)
+        if kind == 1:
+            return "".join(rng.choice(alphabet) for _ in range(rng.randrange(12)))
+        if kind == 2:
+            return rng.choice([True, False, None, 1.5])
+        if kind == 3:
+            return rng.random()
+        if kind == 4:
+            return [value(depth + 1) for _ in range(rng.randrange(4))]
+        return {f"k{index}": value(depth + 1) for index in range(rng.randrange(4))}
+
+    for _ in range(rounds):
+        obj = {f"key{index}": value(0) for index in range(1, rng.randrange(2, 6))}
+        text = json.dumps(obj, ensure_ascii=rng.random() < 0.5, indent=rng.choice([None, 2]))
+        if rng.random() < 0.5:
+            # 最外层对象末尾加多余的逗号（字符串内的括号不能动，只改结构位置）
+            text = text[:-1].rstrip() + ",\n}"
+        if rng.random() < 0.5:
+            text = "```json\n" + text + "\n```"
+        if rng.random() < 0.5:
+            text = "以下是结果：\n" + text + "\n以上。"
+        if extract_json(text, dict) != obj:
+            raise RuntimeError(f"JSON 提取结果与原对象不一致: {text!r}")
+
+
+@benchmark("json.extract[corpus]")
+def bench_json_extract():
+    from json_utils import extract_json
+
+    _fuzz_json_round_trip()
+    return lambda: [extract_json(text) for text in JSON_CORPUS]
+
+
+class _InstantImageClient:
+    """零延迟的文生图客户端：只测量调度开销"""
+
+    provider = "bench"
+    image_config = {"timeout": 60}
+
+    def supports_async_tasks(self) -> bool:
+        return False
+
+    def group_prompts(self, prompts):
+        return [[prompt_data] for prompt_data in prompts]
+
+    def generate_group(self, group, deadline=None, cancel_token=None):
+        return {p["panel_id"]: {"url": f"https://example.com/{p['panel_id']}.png"} for p in group}
+
+
+@benchmark("tools.generate_images_from_prompts.scheduling")
+def bench_image_scheduling():
+    import tools
+    from config import get_config
+
+    client = _InstantImageClient()
+    tools.get_image_client = lambda: client
+    # 走真实模式的线程池调度路径（客户端本身零延迟）
+    get_config().use_mock_mode = False
+    prompts = _final_state()["images"]
+    prompts = [{"panel_id": p["panel_id"], "positive_prompt": f"scene {p['panel_id']}"} for p in prompts]
+    return lambda: tools.generate_images_from_prompts(prompts, {"project_name": "bench"})
+
+
+def _register_startup(name: str, code: str):
+    @benchmark(name)
+    def bench_startup():
+        check = (
+            f"{code}\nimport sys\n"
+            f"loaded = [m for m in {LAZY_MODULES!r} if m in sys.modules]\n"
+            "print('LOADED=' + ','.join(loaded))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", check], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        )
+        loaded = result.stdout.rsplit("LOADED=", 1)[-1].strip()
+        if loaded:
+            raise RuntimeError(f"{name}: 启动时加载了应延迟导入的模块: {loaded}")
+
+        command = [sys.executable, "-c", code]
+        return lambda: subprocess.run(command, cwd=ROOT_DIR, stdout=subprocess.DEVNULL, check=True)
+
+
+for _name, _code in STARTUP_CASES.items():
+    _register_startup(_name, _code)
+
+
+# ================= 运行与对比 =================
+
+def measure(fn: Callable[[], Any], repeat: int, min_time: float) -> Dict[str, Any]:
+    """
+    计时：先校准循环次数使单轮不少于 min_time 秒，再重复 repeat 轮
+
+    Returns:
+        每次调用的耗时统计（秒）
+    """
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time or loops >= 1_000_000:
+            break
+        loops *= 10 if elapsed < min_time / 10 else 2
+
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        samples.append((time.perf_counter() - started) / loops)
+
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "loops": loops,
+        "repeat": repeat
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, timeout=5, cwd=ROOT_DIR
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+def _fmt_time(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:9.1f} µs"
+    if seconds < 1:
+        return f"{seconds * 1e3:9.3f} ms"
+    return f"{seconds:9.3f} s "
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """与基线对比中位数，返回回退的基准名称"""
+    regressions = []
+    print(f"\n与基线对比（{baseline.get('meta', {}).get('commit') or '未知提交'}）:")
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            print(f"  {name:<48} 新增")
+            continue
+        ratio = current["median"] / previous["median"] if previous["median"] else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  ⚠️ 回退"
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = "  ✓ 提升"
+        print(f"  {name:<48} {_fmt_time(previous['median'])} → {_fmt_time(current['median'])}  ×{ratio:5.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="StoryBook CPU 热路径微基准")
+    parser.add_argument("--filter", default="", help="只运行名称包含该字符串的基准")
+    parser.add_argument("--repeat", type=int, default=5, help="每个基准重复的轮数")
+    parser.add_argument("--min-time", type=float, default=0.2, help="每轮最少运行时间（秒）")
+    parser.add_argument("--output", default="benchmark_result.json", help="结果 JSON 路径")
+    parser.add_argument("--compare", default=None, help="对比的基线 JSON 路径")
+    parser.add_argument("--threshold", type=float, default=0.2, help="中位数变慢超过该比例视为回退")
+    parser.add_argument("--fail-on-regression", action="store_true", help="有回退时以非零状态退出")
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if args.filter in name]
+    results: Dict[str, Any] = {}
+    try:
+        for name in names:
+            fn = BENCHMARKS[name]()
+            results[name] = measure(fn, args.repeat, args.min_time)
+            stats = results[name]
+            print(f"{name:<48} median {_fmt_time(stats['median'])}  min {_fmt_time(stats['min'])}  "
+                  f"±{_fmt_time(stats['stdev']).strip()}  ({stats['loops']} loops × {stats['repeat']})")
+    finally:
+        for path in _temp_dirs:
+            shutil.rmtree(path, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "created_at": datetime.now().isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform()
+        },
+        "results": results
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 结果已保存到: {args.output}")
+
+    regressions: List[str] = []
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+流程检查点模块
+为 LangGraph 状态图提供本地 SQLite 检查点：每个节点完成后状态即持久化，
+进程崩溃或重新部署后，同一 thread_id 的运行可以从最后完成的节点继续，
+已完成的 LLM 输出和已生成的图片不会被重复付费。
+调用方从不续跑的 thread 会留在数据库中，超过 CHECKPOINT_TTL 后被定期清理。
+"""
+
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from config import get_config
+from logger import get_logger
+
+
+logger = get_logger("checkpointer")
+
+# 全局检查点实例
+_checkpointer = None
+_checkpointer_lock = threading.Lock()
+
+# 清理过期 thread 的间隔（秒）
+PURGE_INTERVAL = 3600
+_last_purge = 0.0
+
+
+def get_checkpointer():
+    """
+    获取全局 SQLite 检查点实例（单例模式）
+
+    打开时及之后每隔 PURGE_INTERVAL 清理一次超过 CHECKPOINT_TTL 未更新的 thread。
+
+    Returns:
+        SqliteSaver；未启用或未安装 langgraph-checkpoint-sqlite 时返回 None
+    """
+    global _checkpointer, _last_purge
+
+    config = get_config()
+    if not config.checkpoint_enabled:
+        return None
+
+    with _checkpointer_lock:
+        if _checkpointer is None:
+            try:
+                from langgraph.checkpoint.sqlite import SqliteSaver
+            except ImportError:
+                logger.warning("未安装 langgraph-checkpoint-sqlite，流程检查点已禁用")
+                return None
+
+            path = Path(config.checkpoint_path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+
+            # API 在线程池中并发运行多个流程，共享同一连接（SqliteSaver 内部加锁）
+            conn = sqlite3.connect(str(path), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            _checkpointer = SqliteSaver(conn)
+            _checkpointer.setup()
+
+        checkpointer = _checkpointer
+        purge_due = config.checkpoint_ttl > 0 and time.monotonic() - _last_purge >= PURGE_INTERVAL
+        if purge_due:
+            _last_purge = time.monotonic()
+
+    if purge_due:
+        purge_expired_threads(checkpointer, config.checkpoint_ttl)
+    return checkpointer
+
+
+def close_checkpointer():
+    """关闭当前进程的检查点连接（多进程部署时在 fork 前调用，子进程首次使用时重新打开）"""
+    global _checkpointer, _last_purge
+
+    with _checkpointer_lock:
+        checkpointer = _checkpointer
+        _checkpointer = None
+        _last_purge = 0.0
+    if checkpointer is not None:
+        checkpointer.conn.close()
+
+
+def has_pending_thread(checkpointer, thread_id: str) -> bool:
+    """该 thread 是否留有检查点（流程正常结束后会被删除，留下的都是未完成的运行）"""
+    return checkpointer.get_tuple({"configurable": {"thread_id": thread_id}}) is not None
+
+
+def purge_expired_threads(checkpointer, ttl: float) -> int:
+    """
+    删除最后一个检查点早于 ttl 秒之前的 thread
+
+    崩溃后调用方没有用同一个续跑键重新提交时，这些 thread 不会再被使用。
+
+    Args:
+        checkpointer: SqliteSaver 实例
+        ttl: 过期时间（秒）
+
+    Returns:
+        删除的 thread 数量
+    """
+    cutoff = datetime.now(timezone.utc).timestamp() - ttl
+    purged = 0
+    try:
+        with checkpointer.lock:
+            thread_ids = [row[0] for row in checkpointer.conn.execute("SELECT DISTINCT thread_id FROM checkpoints")]
+
+        for thread_id in thread_ids:
+            latest = checkpointer.get_tuple({"configurable": {"thread_id": thread_id}})
+            if latest is None or datetime.fromisoformat(latest.checkpoint["ts"]).timestamp() >= cutoff:
+                continue
+            _delete_thread(checkpointer, thread_id)
+            purged += 1
+    except Exception as e:
+        logger.warning("清理过期检查点失败: %s", e)
+
+    if purged:
+        logger.info("已清理 %d 个过期检查点 thread", purged, extra={"ttl": ttl})
+    return purged
+
+
+def _delete_thread(checkpointer, thread_id: str):
+    """删除一个 thread 的全部检查点"""
+    try:
+        checkpointer.delete_thread(thread_id)
+    except NotImplementedError:
+        # langgraph-checkpoint-sqlite 2.0.x 尚未实现 delete_thread，直接删除两张表中的记录
+        with checkpointer.lock, checkpointer.conn:
+            checkpointer.conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+            checkpointer.conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+
+
+def delete_thread(thread_id: Optional[str]):
+    """流程结束后删除该 thread 的检查点，避免数据库无限增长"""
+    checkpointer = get_checkpointer()
+    if checkpointer is None or not thread_id:
+        return
+
+    try:
+        _delete_thread(checkpointer, thread_id)
+    except Exception as e:
+        logger.warning("删除检查点失败: %s", e, extra={"thread_id": thread_id})
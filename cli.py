@@ -5,7 +5,7 @@ CLI 交互模块
 
 import sys
 from typing import Optional
-from memory import MemorySystem
+from memory import MemorySystem, is_safe_project_name
 from agent_core import StoryCreationAgent
 
 
@@ -54,6 +54,9 @@ class StoryBookCLI:
         if not project_name:
             print("✗ 项目名称不能为空")
             return
+        if not is_safe_project_name(project_name):
+            print('✗ 项目名称不能包含空白、路径分隔符或 \\ / : * ? " < > |，也不能只由 . 组成')
+            return
 
         story_idea = input("请输入故事创意（可以是主题、设定或简单描述）: ").strip()
         if not story_idea:
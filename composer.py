@@ -0,0 +1,271 @@
+"""
+绘本合成模块
+在服务端把 9 格画面和 story_segments 文本合成为：
+- 3×3 拼版大图（sheet）
+- 分页 PDF（每页一格画面 + 对应文字）
+
+缩放、排版和编码都是 CPU 密集型操作，在进程池中执行，不与 API 进程争抢 GIL。
+每一格的排版结果（tile）按「图片内容哈希 + 文本 + 尺寸」缓存，
+单格重新生成后再次合成时只需重新排版这一格，其余格直接复用缓存。
+"""
+
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from config import get_config
+from tracing import start_span
+
+
+# 拼版列数（3×3）
+SHEET_COLUMNS = 3
+
+# 画面与文字区域的比例（文字区高度 = tile 宽度 × CAPTION_RATIO）
+CAPTION_RATIO = 0.28
+
+# 常见的中文字体路径（未配置 COMPOSER_FONT_PATH 时依次尝试）
+DEFAULT_FONT_PATHS = [
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+    "/System/Library/Fonts/PingFang.ttc",
+    "C:/Windows/Fonts/msyh.ttc",
+]
+
+
+def _load_font(font_path: str, size: int):
+    """加载字体；找不到可用字体时退回 Pillow 默认字体（可能无法显示中文）"""
+    from PIL import ImageFont
+
+    for path in [font_path] + DEFAULT_FONT_PATHS:
+        if path and os.path.exists(path):
+            try:
+                return ImageFont.truetype(path, size)
+            except OSError:
+                continue
+
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def _wrap_text(text: str, font, max_width: int) -> List[str]:
+    """按字符宽度折行（中文没有空格分词，逐字测量）"""
+    lines: List[str] = []
+    for paragraph in (text or "").splitlines() or [""]:
+        line = ""
+        for char in paragraph:
+            if line and font.getlength(line + char) > max_width:
+                lines.append(line)
+                line = char
+            else:
+                line += char
+        lines.append(line)
+    return lines
+
+
+def tile_key(source_hash: str, text: str, tile_size: int, font_path: str) -> str:
+    """单格排版结果的缓存键"""
+    raw = f"{source_hash}|{text}|{tile_size}|{font_path}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def render_tile(source_path: Optional[str], text: str, tile_size: int, font_path: str, output_path: str) -> str:
+    """
+    排版单格：画面居中缩放到 tile_size × tile_size，下方绘制文字
+
+    Args:
+        source_path: 画面图片路径（为空表示该格没有图片，绘制占位底色）
+        text: 该格的故事文本
+        tile_size: 画面边长（像素）
+        font_path: 字体路径
+        output_path: 排版结果保存路径
+
+    Returns:
+        output_path
+    """
+    from PIL import Image, ImageDraw
+
+    caption_height = int(tile_size * CAPTION_RATIO)
+    tile = Image.new("RGB", (tile_size, tile_size + caption_height), "white")
+
+    if source_path and os.path.exists(source_path):
+        with Image.open(source_path) as img:
+            img = img.convert("RGB")
+            img.thumbnail((tile_size, tile_size), Image.LANCZOS)
+            offset = ((tile_size - img.width) // 2, (tile_size - img.height) // 2)
+            tile.paste(img, offset)
+    else:
+        ImageDraw.Draw(tile).rectangle([0, 0, tile_size, tile_size], fill="#e5e5e5")
+
+    padding = max(4, tile_size // 32)
+    font_size = max(12, tile_size // 20)
+    font = _load_font(font_path, font_size)
+    draw = ImageDraw.Draw(tile)
+
+    y = tile_size + padding
+    line_height = int(font_size * 1.3)
+    for line in _wrap_text(text, font, tile_size - 2 * padding):
+        if y + line_height > tile.height - padding:
+            break
+        draw.text((padding, y), line, fill="black", font=font)
+        y += line_height
+
+    tile.save(output_path, "PNG")
+    return output_path
+
+
+def compose_storybook(
+    panels: List[Dict[str, Any]],
+    tile_dir: str,
+    sheet_path: str,
+    pdf_path: str,
+    tile_size: int,
+    font_path: str = ""
+) -> Dict[str, Any]:
+    """
+    合成拼版大图和分页 PDF（在进程池中运行）
+
+    Args:
+        panels: 按顺序排列的画面 [{"path", "hash", "text"}, ...]
+        tile_dir: 单格排版缓存目录
+        sheet_path: 拼版大图保存路径
+        pdf_path: PDF 保存路径
+        tile_size: 单格画面边长
+        font_path: 字体路径
+
+    Returns:
+        {"sheet": sheet_path, "pdf": pdf_path, "rendered_tiles": 本次新排版的格数}
+    """
+    from PIL import Image
+
+    Path(tile_dir).mkdir(parents=True, exist_ok=True)
+
+    # 1. 单格排版（命中缓存则跳过）
+    tile_paths = []
+    rendered = 0
+    for panel in panels:
+        key = tile_key(panel.get("hash") or "", panel.get("text", ""), tile_size, font_path)
+        tile_path = os.path.join(tile_dir, f"{key}.png")
+        if not os.path.exists(tile_path):
+            fd, temp_path = tempfile.mkstemp(dir=tile_dir, suffix=".png")
+            os.close(fd)
+            render_tile(panel.get("path"), panel.get("text", ""), tile_size, font_path, temp_path)
+            os.replace(temp_path, tile_path)
+            rendered += 1
+        tile_paths.append(tile_path)
+
+    tiles = [Image.open(path).convert("RGB") for path in tile_paths]
+    try:
+        # 2. 拼版大图
+        tile_width, tile_height = tiles[0].size
+        gap = max(4, tile_size // 64)
+        rows = (len(tiles) + SHEET_COLUMNS - 1) // SHEET_COLUMNS
+        sheet = Image.new(
+            "RGB",
+            (SHEET_COLUMNS * tile_width + (SHEET_COLUMNS + 1) * gap, rows * tile_height + (rows + 1) * gap),
+            "white"
+        )
+        for index, tile in enumerate(tiles):
+            row, column = divmod(index, SHEET_COLUMNS)
+            sheet.paste(tile, (gap + column * (tile_width + gap), gap + row * (tile_height + gap)))
+        sheet.save(sheet_path, "JPEG", quality=88, optimize=True)
+
+        # 3. 分页 PDF（每页一格）
+        tiles[0].save(pdf_path, "PDF", save_all=True, append_images=tiles[1:], resolution=150)
+    finally:
+        for tile in tiles:
+            tile.close()
+
+    return {"sheet": sheet_path, "pdf": pdf_path, "rendered_tiles": rendered}
+
+
+class StorybookComposer:
+    """
+    绘本合成器：从已转存的画面生成拼版大图和 PDF
+
+    合成结果同样放入内容寻址存储，得到不可变的访问地址。
+    """
+
+    def __init__(self, pipeline=None):
+        from asset_store import get_asset_pipeline
+
+        config = get_config()
+        self.pipeline = pipeline or get_asset_pipeline()
+        self.store = self.pipeline.store
+        self.tile_size = config.composer_tile_size
+        self.font_path = config.composer_font_path
+        self.tile_dir = self.store.root / "tiles"
+
+    def _collect_panels(self, segments: List[Dict[str, Any]], assets: Dict[Any, Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """按 story_segments 顺序整理每一格的图片和文字（Memory 中的键可能是字符串）"""
+        panels = []
+        for segment in segments:
+            panel_id = segment.get("panel_id")
+            asset = assets.get(panel_id) or assets.get(str(panel_id)) or {}
+            panels.append({
+                "path": asset.get("path"),
+                "hash": asset.get("hash"),
+                "text": segment.get("text", "")
+            })
+        return panels
+
+    def compose(self, segments: List[Dict[str, Any]], assets: Dict[Any, Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        合成拼版大图和 PDF
+
+        Args:
+            segments: story_segments 列表
+            assets: {panel_id: asset}（AssetPipeline 的转存结果）
+
+        Returns:
+            {"sheet": url, "pdf": url, "sheet_hash", "pdf_hash", "rendered_tiles"}；没有可用画面时返回空字典
+        """
+        panels = self._collect_panels(segments, assets)
+        if not panels or not any(panel["path"] for panel in panels):
+            return {}
+
+        fd, sheet_path = tempfile.mkstemp(dir=self.store.root, suffix=".jpg")
+        os.close(fd)
+        fd, pdf_path = tempfile.mkstemp(dir=self.store.root, suffix=".pdf")
+        os.close(fd)
+
+        try:
+            args = (panels, str(self.tile_dir), sheet_path, pdf_path, self.tile_size, self.font_path)
+            pool = self.pipeline.get_process_pool()
+            with start_span("storybook.compose", panels=len(panels)) as span:
+                if pool is None:
+                    result = compose_storybook(*args)
+                else:
+                    result = pool.submit(compose_storybook, *args).result()
+                span.set_attribute("rendered_tiles", result["rendered_tiles"])
+
+            sheet = self.store.store_file(result["sheet"])
+            pdf = self.store.store_file(result["pdf"])
+        finally:
+            for path in (sheet_path, pdf_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        return {
+            "sheet": sheet["url"],
+            "pdf": pdf["url"],
+            "sheet_hash": sheet["hash"],
+            "pdf_hash": pdf["hash"],
+            "rendered_tiles": result["rendered_tiles"]
+        }
+
+
+# 全局绘本合成器实例
+_storybook_composer: Optional[StorybookComposer] = None
+
+
+def get_storybook_composer() -> StorybookComposer:
+    """获取全局绘本合成器实例（单例模式）"""
+    global _storybook_composer
+    if _storybook_composer is None:
+        _storybook_composer = StorybookComposer()
+    return _storybook_composer
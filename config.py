@@ -1,26 +1,41 @@
 """
 配置管理模块
 从环境变量和配置文件中加载配置
+
+.env 在首次调用 get_config() 时才加载，导入本模块没有副作用（不读文件、不打印）。
 """
 
 import os
 from pathlib import Path
 from typing import Optional, Dict, Any
-from dotenv import load_dotenv
 
-# 加载 .env 文件
+
+# .env 文件路径
 env_path = Path(__file__).parent / ".env"
-if env_path.exists():
+
+
+def load_env_file() -> Optional[Path]:
+    """
+    加载 .env 文件（已存在的环境变量优先）
+
+    Returns:
+        加载的文件路径，文件不存在时返回 None
+    """
+    if not env_path.exists():
+        return None
+
+    from dotenv import load_dotenv
+
     load_dotenv(env_path)
-    print(f"✓ 已加载配置文件: {env_path}")
-else:
-    print(f"⚠ 未找到 .env 文件，使用默认配置（模拟模式）")
+    return env_path
 
 
 class Config:
     """统一配置管理类"""
 
-    def __init__(self):
+    def __init__(self, env_file: Optional[Path] = None):
+        self.env_file = env_file
+        self.mock_mode_auto = False
         self._load_config()
 
     def _load_config(self):
@@ -47,6 +62,18 @@ class Config:
         self.llm_temperature = float(os.getenv("LLM_TEMPERATURE", "0.7"))
         self.llm_max_tokens = int(os.getenv("LLM_MAX_TOKENS", "2048"))
         self.llm_top_p = float(os.getenv("LLM_TOP_P", "1.0"))
+        # 结构化输出方式：schema（按 JSON Schema 约束）、json（只要求合法 JSON）、off（不使用，解析文本）
+        structured_output = os.getenv("LLM_STRUCTURED_OUTPUT", "schema").lower()
+        self.llm_structured_output = "" if structured_output in ("off", "false", "none") else structured_output
+        # 提示词缓存：在系统提示词和可复用的上下文上标记 cache_control（Anthropic / 通义千问显式缓存）
+        self.llm_prompt_cache = os.getenv("LLM_PROMPT_CACHE", "true").lower() == "true"
+        # 分段文本和图片提示词是否批量生成：每个阶段一次请求生成所有格子（缺失或无效的格子再逐格补齐）
+        self.llm_panel_batch = os.getenv("LLM_PANEL_BATCH", "false").lower() == "true"
+        # 结构化输出（JSON）无法解析或不符合格式时，是否请模型修复一次（否则直接使用默认结构）
+        self.llm_json_repair = os.getenv("LLM_JSON_REPAIR", "true").lower() == "true"
+        # 一次性生成 9 帧故事数据（LLM_conversion）的最大生成长度和单次超时：输出远长于其他调用
+        self.story_max_tokens = int(os.getenv("STORY_MAX_TOKENS", "4096"))
+        self.story_timeout = int(os.getenv("STORY_TIMEOUT", "120"))
 
         # ===== 文生图配置 =====
         self.image_provider = os.getenv("IMAGE_PROVIDER", "dalle").lower()
@@ -71,17 +98,91 @@ class Config:
         self.dashscope_image_api_key = os.getenv("DASHSCOPE_IMAGE_API_KEY", "")
         self.dashscope_image_base_url = os.getenv("DASHSCOPE_IMAGE_BASE_URL", "https://dashscope.aliyuncs.com/api/v1")
         self.dashscope_image_model = os.getenv("DASHSCOPE_IMAGE_MODEL", "wanx-v1")
+        # 异步任务模式（X-DashScope-Async）：先提交全部任务，再统一轮询结果
+        self.dashscope_image_async = os.getenv("DASHSCOPE_IMAGE_ASYNC", "true").lower() == "true"
+        self.dashscope_poll_interval = float(os.getenv("DASHSCOPE_POLL_INTERVAL", "1.0"))
+        self.dashscope_poll_max_interval = float(os.getenv("DASHSCOPE_POLL_MAX_INTERVAL", "8.0"))
+        # 同一任务连续查询失败达到该次数时放弃该任务（不依赖截止时间，REQUEST_DEADLINE=0 时也会结束）
+        self.dashscope_poll_max_failures = int(os.getenv("DASHSCOPE_POLL_MAX_FAILURES", "5"))
 
         # Image 参数
         self.image_num_samples = int(os.getenv("IMAGE_NUM_SAMPLES", "1"))
         self.image_steps = int(os.getenv("IMAGE_STEPS", "50"))
+        # 单次请求最多合并的画面数（0 表示按提供商上限）
+        self.image_max_batch_size = int(os.getenv("IMAGE_MAX_BATCH_SIZE", "0"))
+        # 图片已保存到本地时，结果中是否仍保留 base64 字符串
+        self.image_keep_base64 = os.getenv("IMAGE_KEEP_BASE64", "true").lower() == "true"
+        # 未指定保存路径时，Stability 等以 base64 返回的图片解码写入的目录
+        self.image_save_dir = os.getenv("IMAGE_SAVE_DIR", "output/images")
+        # 失败画面的重试轮数和首次退避时间（秒，之后每轮翻倍）
+        self.image_retry_attempts = int(os.getenv("IMAGE_RETRY_ATTEMPTS", "2"))
+        self.image_retry_backoff = float(os.getenv("IMAGE_RETRY_BACKOFF", "2.0"))
 
         # ===== 应用配置 =====
         self.use_mock_mode = os.getenv("USE_MOCK_MODE", "false").lower() == "true"
         self.log_level = os.getenv("LOG_LEVEL", "INFO")
+        self.log_format = os.getenv("LOG_FORMAT", "text").lower()  # text / json
         self.memory_storage_path = os.getenv("MEMORY_STORAGE_PATH", "memory_storage")
         self.api_timeout = int(os.getenv("API_TIMEOUT", "60"))
+        self.request_deadline = float(os.getenv("REQUEST_DEADLINE", "300"))  # 单个请求的总预算（秒），0 表示不限时
+        # 同一进程内同时进行的 LLM 请求上限（分段文本、提示词等逐格调用并发执行时共享）
         self.max_concurrent_requests = int(os.getenv("MAX_CONCURRENT_REQUESTS", "3"))
+        # 同一进程内同时进行的同步文生图请求上限（多个请求 / 批量生成的多本绘本共享）
+        self.max_concurrent_images = int(os.getenv("MAX_CONCURRENT_IMAGES", "5"))
+
+        # ===== 链路追踪配置 =====
+        self.trace_exporter = os.getenv("TRACE_EXPORTER", "file").lower()  # file / otlp / none
+        self.trace_file = os.getenv("TRACE_FILE", "traces/spans.jsonl")
+        self.trace_otlp_endpoint = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+        self.trace_service_name = os.getenv("TRACE_SERVICE_NAME", "storybook")
+
+        # ===== 流程检查点配置（崩溃后从最后完成的节点恢复）=====
+        self.checkpoint_enabled = os.getenv("CHECKPOINT_ENABLED", "true").lower() == "true"
+        self.checkpoint_path = os.getenv("CHECKPOINT_PATH", "checkpoints/storybook.sqlite")
+        # 未完成的 thread 超过该时间（秒）未更新即清理，0 表示不清理
+        self.checkpoint_ttl = float(os.getenv("CHECKPOINT_TTL", "86400"))
+
+        # ===== 用量与成本核算配置 =====
+        # LLM 价格按每百万 token 计，文生图价格按每张图片计（单位与预算一致，如人民币）
+        self.llm_price_input = float(os.getenv("LLM_PRICE_INPUT", "0"))
+        self.llm_price_output = float(os.getenv("LLM_PRICE_OUTPUT", "0"))
+        self.llm_price_cached_input = float(os.getenv("LLM_PRICE_CACHED_INPUT", "0"))
+        self.image_price = float(os.getenv("IMAGE_PRICE", "0"))
+        self.accounting_path = os.getenv("ACCOUNTING_PATH", "usage/usage.json")
+        # 租户预算：TENANT_BUDGET 为默认预算（0 表示不限），TENANT_BUDGETS 单独指定，如 "team-a=50,team-b=100"
+        self.tenant_budget = float(os.getenv("TENANT_BUDGET", "0"))
+        self.tenant_budgets = {
+            name.strip(): float(value)
+            for name, _, value in (
+                item.partition("=") for item in os.getenv("TENANT_BUDGETS", "").split(",") if "=" in item
+            )
+        }
+
+        # ===== 多进程部署与共享状态配置（server.py）=====
+        self.api_workers = int(os.getenv("API_WORKERS", "0"))  # worker 进程数，0 表示 CPU 核数
+        self.shared_store_path = os.getenv("SHARED_STORE_PATH", "shared_state/storybook.sqlite")
+        # 任务状态是否跨进程共享（server.py 多 worker 时自动开启）
+        self.shared_jobs_enabled = os.getenv("SHARED_JOBS_ENABLED", "false").lower() == "true"
+        # 结果缓存：相同输入的 LLM / 文生图结果直接复用（各 worker 共享）
+        self.result_cache_enabled = os.getenv("RESULT_CACHE_ENABLED", "false").lower() == "true"
+        self.llm_cache_ttl = float(os.getenv("LLM_CACHE_TTL", "86400"))
+        self.image_cache_ttl = float(os.getenv("IMAGE_CACHE_TTL", "3600"))  # 提供商图片 URL 通常 1~24 小时过期
+
+        # ===== 本地资源存储配置 =====
+        self.asset_store_enabled = os.getenv("ASSET_STORE_ENABLED", "true").lower() == "true"
+        self.asset_store_blocking = os.getenv("ASSET_STORE_BLOCKING", "false").lower() == "true"  # true: 等待转存完成再返回
+        self.asset_storage_path = os.getenv("ASSET_STORAGE_PATH", "asset_storage")
+        self.asset_public_base_url = os.getenv("ASSET_PUBLIC_BASE_URL", "/assets")  # 可改为 CDN 域名
+        self.asset_download_workers = int(os.getenv("ASSET_DOWNLOAD_WORKERS", "9"))
+        self.asset_variant_processes = int(os.getenv("ASSET_VARIANT_PROCESSES", "2"))  # 0 表示在当前进程生成
+        self.asset_thumbnail_sizes = [
+            int(size) for size in os.getenv("ASSET_THUMBNAIL_SIZES", "256,512").split(",") if size.strip()
+        ]
+
+        # ===== 绘本合成配置（3×3 拼版大图 + PDF）=====
+        self.composer_enabled = os.getenv("COMPOSER_ENABLED", "true").lower() == "true"
+        self.composer_tile_size = int(os.getenv("COMPOSER_TILE_SIZE", "512"))  # 单格画面边长（像素）
+        self.composer_font_path = os.getenv("COMPOSER_FONT_PATH", "")  # 中文字体路径，留空自动查找
 
         # ===== 漫画生成配置 =====
         self.comic_panels = int(os.getenv("COMIC_PANELS", "6"))  # 默认生成6格漫画
@@ -90,7 +191,7 @@ class Config:
         # 自动检测模拟模式
         if self._should_use_mock_mode():
             self.use_mock_mode = True
-            print("ℹ️  未检测到有效的 API Key，自动启用模拟模式")
+            self.mock_mode_auto = True
 
     def _should_use_mock_mode(self) -> bool:
         """判断是否应该使用模拟模式"""
@@ -147,6 +248,8 @@ class Config:
             "provider": self.image_provider,
             "num_samples": self.image_num_samples,
             "steps": self.image_steps,
+            "max_batch_size": self.image_max_batch_size,
+            "keep_base64": self.image_keep_base64,
             "timeout": self.api_timeout,
         }
 
@@ -174,6 +277,10 @@ class Config:
                 "api_key": self.dashscope_image_api_key,
                 "base_url": self.dashscope_image_base_url,
                 "model": self.dashscope_image_model,
+                "async_mode": self.dashscope_image_async,
+                "poll_interval": self.dashscope_poll_interval,
+                "poll_max_interval": self.dashscope_poll_max_interval,
+                "poll_max_failures": self.dashscope_poll_max_failures,
             })
 
         return config
@@ -214,7 +321,10 @@ class Config:
         print("\n" + "=" * 60)
         print("📋 当前配置摘要")
         print("=" * 60)
+        print(f"配置文件: {self.env_file or '未找到 .env，使用默认配置'}")
         print(f"模式: {'🔧 模拟模式' if self.use_mock_mode else '🚀 真实 API 模式'}")
+        if self.mock_mode_auto:
+            print("ℹ️  未检测到有效的 API Key，自动启用模拟模式")
         print(f"\nLLM 配置:")
         print(f"  - 提供商: {self.llm_provider}")
         if self.llm_provider == "anthropic":
@@ -241,17 +351,27 @@ class Config:
         print(f"\n其他配置:")
         print(f"  - Memory 路径: {self.memory_storage_path}")
         print(f"  - API 超时: {self.api_timeout}秒")
+        print(f"  - 请求总预算: {self.request_deadline}秒")
         print(f"  - 日志级别: {self.log_level}")
         print("=" * 60 + "\n")
 
 
 # 全局配置实例
-config = Config()
+_config: Optional[Config] = None
 
 
 def get_config() -> Config:
-    """获取全局配置实例"""
-    return config
+    """获取全局配置实例（首次调用时加载 .env 和环境变量）"""
+    global _config
+    if _config is None:
+        _config = Config(load_env_file())
+    return _config
+
+
+def reset_config():
+    """丢弃全局配置实例，下次 get_config() 时重新读取环境变量（用于测试）"""
+    global _config
+    _config = None
 
 
 if __name__ == "__main__":
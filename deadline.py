@@ -0,0 +1,87 @@
+"""
+请求截止时间（Deadline）模块
+在 API 入口设定一次总预算，沿着 Agent 流程向下传递：
+- 每一跳（LLM 调用、文生图调用）只使用剩余预算作为超时
+- 预算耗尽时提前放弃尚未开始的工作，而不是算完再丢弃
+"""
+
+import time
+from typing import Optional
+
+
+class DeadlineExceeded(Exception):
+    """请求截止时间已到"""
+    pass
+
+
+class Deadline:
+    """
+    请求截止时间
+
+    使用绝对时间戳（time.time()）保存，便于放入 AgentState 中序列化传递。
+    expires_at 为 None 表示不限时。
+    """
+
+    def __init__(self, expires_at: Optional[float] = None):
+        self.expires_at = expires_at
+
+    @classmethod
+    def after(cls, seconds: Optional[float]) -> "Deadline":
+        """创建从现在起 seconds 秒后到期的截止时间（seconds 为空或 <= 0 表示不限时）"""
+        if not seconds or seconds <= 0:
+            return cls(None)
+        return cls(time.time() + seconds)
+
+    @classmethod
+    def from_state(cls, state: dict) -> "Deadline":
+        """从 AgentState 中恢复截止时间（0 表示不限时）"""
+        expires_at = state.get("deadline") or None
+        return cls(expires_at)
+
+    def to_state(self) -> float:
+        """转换为可写入 AgentState 的值（0 表示不限时）"""
+        return self.expires_at or 0.0
+
+    def remaining(self) -> Optional[float]:
+        """剩余秒数；不限时返回 None"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.time())
+
+    def expired(self) -> bool:
+        """是否已到期"""
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def check(self, stage: str = ""):
+        """已到期则抛出 DeadlineExceeded"""
+        if self.expired():
+            raise DeadlineExceeded(f"请求截止时间已到，放弃: {stage}" if stage else "请求截止时间已到")
+
+    def timeout(self, default: float, stage: str = "") -> float:
+        """
+        计算本次调用可用的超时时间
+
+        Args:
+            default: 单次调用的默认超时（如 API_TIMEOUT）
+            stage: 阶段名称（用于错误信息）
+
+        Returns:
+            min(default, 剩余预算)
+        """
+        self.check(stage)
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        return min(default, remaining)
+
+    def __repr__(self) -> str:
+        remaining = self.remaining()
+        if remaining is None:
+            return "Deadline(unlimited)"
+        return f"Deadline(remaining={remaining:.1f}s)"
+
+
+def as_deadline(deadline: Optional[Deadline]) -> Deadline:
+    """将可选的 Deadline 规范化为 Deadline 实例（None 表示不限时）"""
+    return deadline if deadline is not None else Deadline(None)
@@ -0,0 +1,511 @@
+"""
+本地假提供商服务（压测用）
+在本机模拟 LLM 与文生图提供商的 HTTP 接口，不消耗真实 API 额度：
+- OpenAI 兼容: POST .../chat/completions（也用于 DashScope compatible-mode）
+- Anthropic:   POST .../v1/messages
+- DALL-E:      POST .../images/generations
+- Stability:   POST .../generation/<engine>/text-to-image
+- 通义万相:    POST .../services/aigc/text2image/image-synthesis（支持 X-DashScope-Async）、
+               GET .../tasks/<task_id>、POST .../tasks/<task_id>/cancel
+- 图片文件:    GET /images/<name>.png
+- 统计:        GET /_stats
+
+延迟按分布随机抽样，可配置错误率和限流（超出速率返回 429）。
+LLM 接口模拟显式提示词缓存：标记了 cache_control 的前缀第二次出现时，按命中返回缓存 token 数
+（Anthropic: cache_read_input_tokens；OpenAI 兼容: prompt_tokens_details.cached_tokens）。
+
+使用方法:
+    python fake_provider.py --port 9100 --llm-latency lognormal:1.5,0.4 --image-latency uniform:3,8 \\
+        --error-rate 0.02 --rate-limit 20
+
+然后让服务指向假提供商（见 TESTING.md「压测」一节）。
+"""
+
+import argparse
+import base64
+import json
+import math
+import os
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+# 默认延迟分布（秒）
+DEFAULT_LLM_LATENCY = "lognormal:1.5,0.4"
+DEFAULT_IMAGE_LATENCY = "uniform:3,8"
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """
+    解析延迟分布
+
+    Args:
+        spec: 分布描述，支持：
+              fixed:秒 / uniform:最小,最大 / normal:均值,标准差 /
+              lognormal:中位数,sigma / exp:均值
+
+    Returns:
+        每次调用返回一个延迟样本（秒，不小于 0）的函数
+
+    Raises:
+        ValueError: 无法解析的分布
+    """
+    kind, _, raw = spec.partition(":")
+    try:
+        params = [float(value) for value in raw.split(",") if value.strip()]
+    except ValueError:
+        raise ValueError(f"无法解析的延迟分布: {spec}")
+
+    if kind == "fixed" and len(params) == 1:
+        return lambda: params[0]
+    if kind == "uniform" and len(params) == 2:
+        return lambda: random.uniform(params[0], params[1])
+    if kind == "normal" and len(params) == 2:
+        return lambda: max(0.0, random.gauss(params[0], params[1]))
+    if kind == "lognormal" and len(params) == 2:
+        mu = math.log(params[0]) if params[0] > 0 else 0.0
+        return lambda: random.lognormvariate(mu, params[1]) if params[0] > 0 else 0.0
+    if kind == "exp" and len(params) == 1:
+        return lambda: random.expovariate(1.0 / params[0]) if params[0] > 0 else 0.0
+    raise ValueError(f"无法解析的延迟分布: {spec}")
+
+
+def solid_png(size: int = 256, seed: int = 0) -> bytes:
+    """生成一张纯色 PNG（不依赖 Pillow）"""
+    rng = random.Random(seed)
+    pixel = bytes(rng.randrange(256) for _ in range(3))
+    raw = b"".join(b"\x00" + pixel * size for _ in range(size))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+
+
+def story_payload(prompt: str) -> Dict[str, Any]:
+    """LLM_conversion 需要的 9 帧故事 JSON"""
+    return {
+        "main_story": f"（假提供商）{prompt[:40]}",
+        "character_settings": "小明：十岁男孩，短发，蓝色T恤；奶奶：白发，红色外套",
+        "frames": [
+            {
+                "frame_index": index,
+                "scene_description": f"第{index}帧：一家人在客厅里的温馨时刻",
+                "visual_prompt": f"storybook illustration, warm family living room, scene {index}"
+            }
+            for index in range(1, 10)
+        ]
+    }
+
+
+def characters_payload() -> list:
+    """design_characters 需要的角色 JSON 数组"""
+    return [
+        {
+            "name": "小明",
+            "role": "主角",
+            "appearance": "ten-year-old boy, short black hair, blue t-shirt",
+            "personality": "好奇、善良",
+            "visual_tags": ["boy", "blue_shirt"]
+        },
+        {
+            "name": "奶奶",
+            "role": "配角",
+            "appearance": "elderly woman, white hair, red coat",
+            "personality": "慈祥",
+            "visual_tags": ["grandma", "red_coat"]
+        }
+    ]
+
+
+class TokenBucket:
+    """令牌桶限流"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        """取一个令牌，没有令牌时返回 False"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class FakeProvider:
+    """假提供商的行为配置与运行统计"""
+
+    def __init__(
+        self,
+        llm_latency: str = DEFAULT_LLM_LATENCY,
+        image_latency: str = DEFAULT_IMAGE_LATENCY,
+        llm_error_rate: float = 0.0,
+        image_error_rate: float = 0.0,
+        rate_limit: float = 0.0,
+        image_size: int = 256
+    ):
+        self.llm_latency = parse_latency(llm_latency)
+        self.image_latency = parse_latency(image_latency)
+        self.llm_error_rate = llm_error_rate
+        self.image_error_rate = image_error_rate
+        self.limiter = TokenBucket(rate_limit) if rate_limit > 0 else None
+        self.image_size = image_size
+        self.tasks: Dict[str, Dict[str, Any]] = {}
+        self.stats: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._images: Dict[str, bytes] = {}
+        self._prompt_cache: Dict[str, None] = {}  # 有序集合，超过上限时淘汰最早的前缀
+
+    def prompt_cache(self, prefixes: List[str]) -> Tuple[int, int]:
+        """
+        模拟显式提示词缓存
+
+        Args:
+            prefixes: 各缓存断点之前的完整前缀（由短到长）
+
+        Returns:
+            (命中的 token 数, 写入的 token 数)，按 2 个字符 1 个 token 估算
+        """
+        cached = written = 0
+        with self._lock:
+            for prefix in prefixes:
+                if prefix in self._prompt_cache:
+                    cached = len(prefix) // 2
+                else:
+                    self._prompt_cache[prefix] = None
+                    written = len(prefix) // 2 - cached
+                    if len(self._prompt_cache) > 4096:
+                        self._prompt_cache.pop(next(iter(self._prompt_cache)))
+        if cached or written:
+            self.count("llm.cache_hit" if cached else "llm.cache_miss")
+        return cached, max(0, written)
+
+    def count(self, key: str):
+        """累加统计计数"""
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def image_bytes(self, name: str) -> bytes:
+        """按名称生成（并缓存）图片内容，同名图片内容相同"""
+        with self._lock:
+            data = self._images.get(name)
+            if data is None:
+                data = self._images[name] = solid_png(self.image_size, zlib.crc32(name.encode("utf-8")))
+                if len(self._images) > 1024:
+                    self._images.pop(next(iter(self._images)))
+            return data
+
+    def new_task(self, n: int) -> str:
+        """创建异步文生图任务：到达 ready_at 后完成（按错误率决定成功或失败）"""
+        task_id = uuid.uuid4().hex
+        with self._lock:
+            self.tasks[task_id] = {
+                "ready_at": time.monotonic() + self.image_latency(),
+                "n": n,
+                "failed": random.random() < self.image_error_rate,
+                "cancelled": False
+            }
+        return task_id
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    """按路径后缀分发到各提供商格式"""
+
+    server_version = "FakeProvider/1.0"
+    provider: FakeProvider = None  # 由 make_server 注入
+
+    def log_message(self, format, *args):
+        # 压测时请求量大，不输出访问日志
+        pass
+
+    # ---------- 通用 ----------
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(body or b"{}")
+        except ValueError:
+            return {}
+
+    def _send_json(self, status: int, payload: Any, headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _admit(self, kind: str, error_rate: float, latency: Optional[Callable[[], float]]) -> bool:
+        """限流、模拟延迟和随机错误；返回 False 表示已回复错误"""
+        self.provider.count(f"{kind}_requests")
+        if self.provider.limiter and not self.provider.limiter.acquire():
+            self.provider.count(f"{kind}_rate_limited")
+            self._send_json(429, {"error": {"message": "rate limit exceeded"}}, {"Retry-After": "1"})
+            return False
+        if latency:
+            time.sleep(latency())
+        if random.random() < error_rate:
+            self.provider.count(f"{kind}_errors")
+            self._send_json(500, {"error": {"message": "fake provider error"}})
+            return False
+        return True
+
+    def _image_url(self) -> str:
+        host = self.headers.get("Host") or f"{self.server.server_address[0]}:{self.server.server_address[1]}"
+        return f"http://{host}/images/{uuid.uuid4().hex}.png"
+
+    # ---------- 路由 ----------
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path.startswith("/images/"):
+            data = self.provider.image_bytes(path.rsplit("/", 1)[-1])
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif path == "/_stats":
+            with self.provider._lock:
+                stats = dict(self.provider.stats, pending_tasks=len(self.provider.tasks))
+            self._send_json(200, stats)
+        elif re.search(r"/tasks/[^/]+$", path):
+            self._task_status(path.rsplit("/", 1)[-1])
+        else:
+            self._send_json(404, {"error": {"message": f"unknown path: {path}"}})
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        body = self._read_json()
+        if path.endswith("/chat/completions"):
+            self._chat_completions(body)
+        elif path.endswith("/messages"):
+            self._anthropic_messages(body)
+        elif path.endswith("/images/generations"):
+            self._dalle(body)
+        elif path.endswith("/text-to-image"):
+            self._stability(body)
+        elif path.endswith("/image-synthesis"):
+            self._dashscope_image(body)
+        elif re.search(r"/tasks/[^/]+/cancel$", path):
+            self._cancel_task(path.rsplit("/", 2)[-2])
+        else:
+            self._send_json(404, {"error": {"message": f"unknown path: {path}"}})
+
+    # ---------- LLM ----------
+
+    def _llm_text(self, text: str, json_mode: bool) -> str:
+        if "frame_index" in text:
+            return json.dumps(story_payload(text), ensure_ascii=False)
+        if "角色" in text and "JSON" in text:
+            return json.dumps(characters_payload(), ensure_ascii=False)
+        if json_mode:
+            return json.dumps({"result": "ok"})
+        return "这是假提供商返回的文本。"
+
+    @staticmethod
+    def _flatten(parts: List[Any]) -> Tuple[str, List[str]]:
+        """
+        把消息内容（字符串或内容块列表）拼成文本
+
+        Returns:
+            (完整文本, 各 cache_control 断点之前的前缀)
+        """
+        text = ""
+        prefixes = []
+        for part in parts:
+            blocks = part if isinstance(part, list) else [{"text": str(part or "")}]
+            for block in blocks:
+                text += block.get("text", "") + "\n"
+                if block.get("cache_control"):
+                    prefixes.append(text)
+        return text, prefixes
+
+    def _chat_completions(self, body: Dict[str, Any]):
+        if not self._admit("llm", self.provider.llm_error_rate, self.provider.llm_latency):
+            return
+        text, prefixes = self._flatten([message.get("content", "") for message in body.get("messages", [])])
+        cached_tokens, _ = self.provider.prompt_cache(prefixes)
+        json_mode = (body.get("response_format") or {}).get("type") in ("json_object", "json_schema")
+        content = self._llm_text(text, json_mode)
+        prompt_tokens = max(1, len(text) // 2)
+        completion_tokens = max(1, len(content) // 2)
+        self._send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": min(cached_tokens, prompt_tokens)}
+            }
+        })
+
+    def _anthropic_messages(self, body: Dict[str, Any]):
+        if not self._admit("llm", self.provider.llm_error_rate, self.provider.llm_latency):
+            return
+        text, prefixes = self._flatten(
+            [body.get("system") or ""] + [message.get("content", "") for message in body.get("messages", [])]
+        )
+        cached_tokens, written_tokens = self.provider.prompt_cache(prefixes)
+        tool_choice = body.get("tool_choice") or {}
+        content = self._llm_text(text, bool(tool_choice))
+        block = {"type": "text", "text": content}
+        if tool_choice.get("type") == "tool":
+            # 结构化输出：强制调用工具，参数为对象（数组放在 items 中）
+            value = json.loads(content)
+            block = {
+                "type": "tool_use",
+                "id": f"toolu_{uuid.uuid4().hex}",
+                "name": tool_choice["name"],
+                "input": value if isinstance(value, dict) else {"items": value}
+            }
+        self._send_json(200, {
+            "id": f"msg_{uuid.uuid4().hex}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "fake"),
+            "content": [block],
+            "stop_reason": "tool_use" if block["type"] == "tool_use" else "end_turn",
+            # input_tokens 不含缓存读写部分（与 Anthropic 一致）
+            "usage": {
+                "input_tokens": max(1, len(text) // 2 - cached_tokens - written_tokens),
+                "cache_read_input_tokens": cached_tokens,
+                "cache_creation_input_tokens": written_tokens,
+                "output_tokens": max(1, len(content) // 2)
+            }
+        })
+
+    # ---------- 文生图 ----------
+
+    def _dalle(self, body: Dict[str, Any]):
+        if not self._admit("image", self.provider.image_error_rate, self.provider.image_latency):
+            return
+        n = int(body.get("n") or 1)
+        self._send_json(200, {"created": int(time.time()), "data": [{"url": self._image_url()} for _ in range(n)]})
+
+    def _stability(self, body: Dict[str, Any]):
+        if not self._admit("image", self.provider.image_error_rate, self.provider.image_latency):
+            return
+        n = int(body.get("samples") or 1)
+        artifacts = [
+            {"base64": base64.b64encode(self.provider.image_bytes(uuid.uuid4().hex)).decode("ascii"), "finishReason": "SUCCESS"}
+            for _ in range(n)
+        ]
+        self._send_json(200, {"artifacts": artifacts})
+
+    def _dashscope_image(self, body: Dict[str, Any]):
+        n = int((body.get("parameters") or {}).get("n") or 1)
+        if self.headers.get("X-DashScope-Async") == "enable":
+            # 异步提交只做限流和错误注入，出图延迟体现在任务完成时间上
+            if not self._admit("image_submit", self.provider.image_error_rate, None):
+                return
+            task_id = self.provider.new_task(n)
+            self._send_json(200, {"output": {"task_id": task_id, "task_status": "PENDING"}, "request_id": uuid.uuid4().hex})
+            return
+
+        if not self._admit("image", self.provider.image_error_rate, self.provider.image_latency):
+            return
+        self._send_json(200, {
+            "output": {"task_status": "SUCCEEDED", "results": [{"url": self._image_url()} for _ in range(n)]},
+            "usage": {"image_count": n}
+        })
+
+    def _task_status(self, task_id: str):
+        self.provider.count("task_polls")
+        with self.provider._lock:
+            task = self.provider.tasks.get(task_id)
+        if task is None:
+            self._send_json(200, {"output": {"task_id": task_id, "task_status": "UNKNOWN"}})
+            return
+
+        if task["cancelled"]:
+            status = "CANCELED"
+        elif time.monotonic() < task["ready_at"]:
+            status = "RUNNING"
+        else:
+            status = "FAILED" if task["failed"] else "SUCCEEDED"
+
+        output: Dict[str, Any] = {"task_id": task_id, "task_status": status}
+        if status == "SUCCEEDED":
+            output["results"] = [{"url": self._image_url()} for _ in range(task["n"])]
+        elif status == "FAILED":
+            output["message"] = "fake provider task failed"
+
+        if status != "RUNNING":
+            with self.provider._lock:
+                self.provider.tasks.pop(task_id, None)
+        self._send_json(200, {"output": output})
+
+    def _cancel_task(self, task_id: str):
+        with self.provider._lock:
+            task = self.provider.tasks.get(task_id)
+            if task:
+                task["cancelled"] = True
+        self._send_json(200, {"output": {"task_id": task_id, "task_status": "CANCELED" if task else "UNKNOWN"}})
+
+
+def make_server(host: str, port: int, provider: FakeProvider) -> ThreadingHTTPServer:
+    """创建假提供商 HTTP 服务（每个请求一个线程）"""
+    handler = type("BoundFakeProviderHandler", (FakeProviderHandler,), {"provider": provider})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地假 LLM / 文生图提供商（压测用）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("FAKE_PROVIDER_PORT", "9100")))
+    parser.add_argument("--llm-latency", default=DEFAULT_LLM_LATENCY, help="LLM 延迟分布，如 lognormal:1.5,0.4")
+    parser.add_argument("--image-latency", default=DEFAULT_IMAGE_LATENCY, help="文生图延迟分布，如 uniform:3,8")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的概率（LLM 与文生图共用）")
+    parser.add_argument("--llm-error-rate", type=float, default=None, help="单独指定 LLM 错误率")
+    parser.add_argument("--image-error-rate", type=float, default=None, help="单独指定文生图错误率")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="每秒允许的请求数，超出返回 429（0 表示不限）")
+    parser.add_argument("--image-size", type=int, default=256, help="返回图片的边长（像素）")
+    args = parser.parse_args()
+
+    provider = FakeProvider(
+        llm_latency=args.llm_latency,
+        image_latency=args.image_latency,
+        llm_error_rate=args.error_rate if args.llm_error_rate is None else args.llm_error_rate,
+        image_error_rate=args.error_rate if args.image_error_rate is None else args.image_error_rate,
+        rate_limit=args.rate_limit,
+        image_size=args.image_size
+    )
+    server = make_server(args.host, args.port, provider)
+    print(f"🧪 假提供商已启动: http://{args.host}:{args.port}")
+    print(f"   LLM 延迟: {args.llm_latency}，文生图延迟: {args.image_latency}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
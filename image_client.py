@@ -4,12 +4,141 @@
 只需配置 URL + API Key + Model
 """
 
+import os
+import threading
 import time
+import uuid
 import base64
 import requests
-from typing import Optional, Dict, Any
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Hashable, List, Iterable, BinaryIO, Callable
 from pathlib import Path
 from config import get_config
+from deadline import Deadline, DeadlineExceeded, as_deadline
+from jobs import CancelToken, JobCancelled, http_get, http_post
+from metrics import IMAGE_CALL_DURATION, timed
+from accounting import record_image_call
+from shared_store import cache_get, cache_set, result_cache_key
+from logger import get_logger
+
+
+logger = get_logger("image_client")
+
+# 流式下载 / 解码的块大小（字节）
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class Base64StreamDecoder:
+    """
+    增量 base64 解码器
+
+    按 4 字节对齐分块解码并直接写入目标（文件或 BytesIO），
+    内存中只保留不足 4 字节的尾部，不需要先拼出完整字符串。
+    """
+
+    def __init__(self, sink: BinaryIO):
+        self.sink = sink
+        self._pending = b""
+        self.bytes_written = 0
+
+    def feed(self, data: bytes):
+        """写入一段 base64 文本（JSON 中的 \\/ 转义会被去除）"""
+        if b"\\" in data:
+            data = data.replace(b"\\", b"")
+        if self._pending:
+            data = self._pending + data
+
+        aligned = len(data) - len(data) % 4
+        if aligned:
+            decoded = base64.b64decode(memoryview(data)[:aligned])
+            self.sink.write(decoded)
+            self.bytes_written += len(decoded)
+        self._pending = data[aligned:]
+
+    def close(self):
+        """写入剩余数据（补齐 padding）"""
+        if self._pending:
+            padded = self._pending + b"=" * (-len(self._pending) % 4)
+            decoded = base64.b64decode(padded)
+            self.sink.write(decoded)
+            self.bytes_written += len(decoded)
+            self._pending = b""
+
+
+def stream_base64_fields(
+    chunks: Iterable[bytes],
+    open_sink: Callable[[int], BinaryIO],
+    field: str = "base64",
+    keep_text: bool = False
+) -> List[Optional[str]]:
+    """
+    从流式 JSON 响应中逐个提取指定字段的 base64 字符串，边读边解码写入 sink
+
+    只做字段级扫描，不构建完整的 JSON 对象，适用于 Stability 等把图片
+    以 base64 字段内嵌在 JSON 中返回的接口。
+
+    Args:
+        chunks: 响应体分块（如 response.iter_content()）
+        open_sink: 根据字段序号（0, 1, ...）打开写入目标，由本函数负责关闭
+        field: 字段名
+        keep_text: 是否同时保留原始 base64 文本
+
+    Returns:
+        每个字段的 base64 文本（keep_text=False 时为 None）
+    """
+    marker = f'"{field}"'.encode()
+    results: List[Optional[str]] = []
+    buffer = b""
+    state = "seek"
+    decoder = None
+    sink = None
+    text_parts: List[bytes] = []
+
+    try:
+        for chunk in chunks:
+            buffer = buffer + chunk if buffer else chunk
+            while buffer:
+                if state == "seek":
+                    pos = buffer.find(marker)
+                    if pos < 0:
+                        # 保留可能被分块截断的字段名前缀
+                        buffer = buffer[-(len(marker) - 1):]
+                        break
+                    buffer = buffer[pos + len(marker):]
+                    state = "colon"
+
+                if state == "colon":
+                    pos = buffer.find(b'"')
+                    if pos < 0:
+                        buffer = b""
+                        break
+                    buffer = buffer[pos + 1:]
+                    sink = open_sink(len(results))
+                    decoder = Base64StreamDecoder(sink)
+                    text_parts = []
+                    state = "value"
+
+                if state == "value":
+                    pos = buffer.find(b'"')
+                    value = buffer if pos < 0 else buffer[:pos]
+                    decoder.feed(value)
+                    if keep_text:
+                        text_parts.append(value)
+                    if pos < 0:
+                        buffer = b""
+                        break
+
+                    decoder.close()
+                    sink.close()
+                    sink = None
+                    results.append(b"".join(text_parts).replace(b"\\", b"").decode("ascii") if keep_text else None)
+                    buffer = buffer[pos + 1:]
+                    state = "seek"
+    finally:
+        if sink is not None:
+            sink.close()
+
+    return results
 
 
 class ImageClient:
@@ -19,23 +148,29 @@ class ImageClient:
         self.config = get_config()
         self.image_config = self.config.get_image_config()
         self.provider = self.image_config["provider"]
+        # 全局并发上限：同一进程内同时进行的同步文生图请求不超过 MAX_CONCURRENT_IMAGES
+        self._slots = threading.BoundedSemaphore(max(1, self.config.max_concurrent_images))
 
         if not self.config.use_mock_mode:
             self._initialize()
 
     def _initialize(self):
         """初始化客户端"""
-        print(f"✓ {self.provider.upper()} 图像客户端初始化成功")
-        print(f"  - URL: {self.image_config.get('base_url')}")
-        if "model" in self.image_config:
-            print(f"  - Model: {self.image_config['model']}")
+        logger.info(
+            "%s 图像客户端初始化成功",
+            self.provider.upper(),
+            extra={"url": self.image_config.get("base_url"), "model": self.image_config.get("model", "")}
+        )
 
     def generate(
         self,
         prompt: str,
         negative_prompt: Optional[str] = None,
         style: Optional[str] = None,
-        save_path: Optional[str] = None
+        save_path: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        cancel_token: Optional[CancelToken] = None,
+        use_cache: bool = True
     ) -> Dict[str, Any]:
         """
         生成图像
@@ -45,30 +180,255 @@ class ImageClient:
             negative_prompt: 负面提示词（不想要的元素）
             style: 风格（如：anime, realistic, cartoon）
             save_path: 保存路径（可选）
+            deadline: 请求截止时间（可选），本次调用只使用剩余预算
+            cancel_token: 取消信号（可选），取消时中断进行中的 HTTP 请求
+            use_cache: 是否读取结果缓存；重绘、重试需要新图片时传 False（新结果仍写入缓存）
 
         Returns:
             包含图像信息的字典
+
+        Raises:
+            DeadlineExceeded: 调用前（或等待并发名额时）截止时间已到
+            JobCancelled: 任务已被取消
         """
+        as_deadline(deadline).check("文生图调用")
+        if cancel_token:
+            cancel_token.check("文生图调用")
+
         if self.config.use_mock_mode:
-            return self._mock_generate(prompt, save_path)
+            with timed(IMAGE_CALL_DURATION, provider="mock"):
+                result = self._mock_generate(prompt, save_path)
+            record_image_call("mock", "mock", 1)
+            return result
+
+        # 结果缓存（各 worker 共享）：只缓存提供商返回的 URL，不缓存本地文件和 base64 图片
+        cache_key = result_cache_key(
+            self.provider, self.image_config.get("model", ""), self.image_config.get("size", ""),
+            prompt, negative_prompt, style
+        )
+        if use_cache and save_path is None:
+            cached = cache_get("image", cache_key)
+            if cached is not None:
+                return cached
 
         try:
-            if self.provider == "dalle":
-                return self._generate_dalle_http(prompt, save_path)
-            elif self.provider == "stability":
-                return self._generate_stability_http(prompt, negative_prompt, save_path)
+            with self._slot(deadline), timed(IMAGE_CALL_DURATION, provider=self.provider):
+                # 取得并发名额后再计算超时，排队时间不占用本次调用的超时
+                timeout = as_deadline(deadline).timeout(self.image_config["timeout"], "文生图调用")
+                if self.provider == "dalle":
+                    result = self._generate_dalle_http(prompt, save_path, timeout, cancel_token)
+                elif self.provider == "stability":
+                    result = self._generate_stability_http(prompt, negative_prompt, save_path, timeout, cancel_token)
+                elif self.provider == "dashscope":
+                    result = self._generate_dashscope_http(prompt, negative_prompt, save_path, timeout, cancel_token)
+                else:
+                    # 默认尝试类似 DALL-E 的格式
+                    result = self._generate_dalle_http(prompt, save_path, timeout, cancel_token)
+            record_image_call(self.provider, self.image_config.get("model", ""), self._image_count(result))
+            if result.get("url") and not result.get("local_path") and not result.get("base64"):
+                cache_set("image", cache_key, result, self.config.image_cache_ttl)
+            return result
+        except (DeadlineExceeded, JobCancelled):
+            raise
+        except Exception as e:
+            logger.error("图像生成失败，切换到模拟模式: %s", e, extra={"provider": self.provider})
+            # 带上错误信息，调用方据此把该画面标记为 failed（可重试），占位图仅作兜底展示
+            result = self._mock_generate(prompt, save_path)
+            result["error"] = str(e)
+            return result
+
+    def max_batch_size(self) -> int:
+        """
+        单次请求最多可合并的画面数量
+
+        DALL-E 3 每次只能出 1 张图；DALL-E 2、Stability（samples）最多 10 张；
+        通义万相（n）最多 4 张。可通过 IMAGE_MAX_BATCH_SIZE 进一步限制。
+        """
+        if self.config.use_mock_mode:
+            return 1
+
+        if self.provider == "dalle":
+            limit = 1 if str(self.image_config.get("model", "")).startswith("dall-e-3") else 10
+        elif self.provider == "stability":
+            limit = 10
+        elif self.provider == "dashscope":
+            limit = 4
+        else:
+            limit = 1
+
+        configured = self.image_config.get("max_batch_size", 0)
+        return max(1, min(limit, configured)) if configured > 0 else limit
+
+    def group_prompts(self, prompts: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """
+        将可以合并到同一次请求的画面分组
+
+        各提供商的多图输出（n / samples）只支持同一组提示词，因此正向与负向提示词
+        完全相同的画面归为一组，每组不超过 max_batch_size()；其余画面各自成组。
+
+        Args:
+            prompts: 图片提示词列表（包含 panel_id, positive_prompt, negative_prompt）
+
+        Returns:
+            分组后的提示词列表（保持原有顺序）
+        """
+        limit = self.max_batch_size()
+        open_groups: Dict[tuple, List[Dict[str, Any]]] = {}
+        groups: List[List[Dict[str, Any]]] = []
+
+        for prompt_data in prompts:
+            key = (prompt_data.get("positive_prompt", ""), prompt_data.get("negative_prompt", ""))
+            group = open_groups.get(key)
+            if group is None or len(group) >= limit:
+                group = []
+                open_groups[key] = group
+                groups.append(group)
+            group.append(prompt_data)
+
+        return groups
+
+    def generate_group(
+        self,
+        group: List[Dict[str, Any]],
+        deadline: Optional[Deadline] = None,
+        cancel_token: Optional[CancelToken] = None,
+        use_cache: bool = True
+    ) -> Dict[Any, Dict[str, Any]]:
+        """
+        用一次请求生成同一组画面，并按 panel_id 拆分结果
+
+        合并请求失败或返回的图片数量不足时，缺少的画面退回逐个调用 generate()。
+
+        Args:
+            group: group_prompts() 返回的一组提示词
+            deadline: 请求截止时间（可选）
+            cancel_token: 取消信号（可选）
+            use_cache: 逐个生成时是否读取结果缓存（见 generate()）
+
+        Returns:
+            {panel_id: generate() 格式的结果字典}
+        """
+        results: Dict[Any, Dict[str, Any]] = {}
+        first = group[0]
+
+        if len(group) > 1:
+            as_deadline(deadline).check("文生图调用")
+            if cancel_token:
+                cancel_token.check("文生图调用")
+
+            try:
+                with self._slot(deadline):
+                    output = self._generate_provider(
+                        first.get("positive_prompt", ""),
+                        first.get("negative_prompt", ""),
+                        as_deadline(deadline).timeout(self.image_config["timeout"], "文生图调用"),
+                        cancel_token,
+                        n=len(group)
+                    )
+                urls = output.get("urls", [])
+                local_paths = output.get("local_paths", [])
+                for index, prompt_data in enumerate(group):
+                    if index < len(urls):
+                        item = {"url": urls[index]}
+                    elif index < len(local_paths):
+                        item = {"local_path": local_paths[index]}
+                    else:
+                        break
+                    item.update({"provider": output["provider"], "prompt": output["prompt"]})
+                    results[prompt_data.get("panel_id")] = item
+            except (DeadlineExceeded, JobCancelled):
+                raise
+            except Exception as e:
+                logger.warning("合并请求失败，逐个生成: %s", e)
+
+        # 单个画面或合并请求未覆盖的画面：逐个生成
+        for prompt_data in group:
+            panel_id = prompt_data.get("panel_id")
+            if panel_id in results:
+                continue
+            results[panel_id] = self.generate(
+                prompt=prompt_data.get("positive_prompt", ""),
+                negative_prompt=prompt_data.get("negative_prompt", ""),
+                deadline=deadline,
+                cancel_token=cancel_token,
+                use_cache=use_cache
+            )
+
+        return results
+
+    def generate_batch(
+        self,
+        prompts: List[Dict[str, Any]],
+        deadline: Optional[Deadline] = None,
+        cancel_token: Optional[CancelToken] = None
+    ) -> Dict[Any, Dict[str, Any]]:
+        """
+        批量生成图像：合并可合并的画面以减少请求次数，结果按 panel_id 返回
+
+        Args:
+            prompts: 图片提示词列表（包含 panel_id, positive_prompt, negative_prompt）
+            deadline: 请求截止时间（可选）
+            cancel_token: 取消信号（可选）
+
+        Returns:
+            {panel_id: generate() 格式的结果字典}
+        """
+        results: Dict[Any, Dict[str, Any]] = {}
+        for group in self.group_prompts(prompts):
+            results.update(self.generate_group(group, deadline, cancel_token))
+        return results
+
+    @contextmanager
+    def _slot(self, deadline: Optional[Deadline]):
+        """
+        占用一个并发名额，最多等待到截止时间
+
+        Raises:
+            DeadlineExceeded: 等待名额时截止时间已到
+        """
+        if not self._slots.acquire(timeout=as_deadline(deadline).remaining()):
+            raise DeadlineExceeded("请求截止时间已到，放弃: 等待文生图并发名额")
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def _generate_provider(
+        self,
+        prompt: str,
+        negative_prompt: Optional[str],
+        timeout: Optional[float],
+        cancel_token: Optional[CancelToken],
+        n: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """按提供商分发真实 API 请求（不做模拟降级）"""
+        with timed(IMAGE_CALL_DURATION, provider=self.provider):
+            if self.provider == "stability":
+                result = self._generate_stability_http(prompt, negative_prompt, None, timeout, cancel_token, n)
             elif self.provider == "dashscope":
-                return self._generate_dashscope_http(prompt, negative_prompt, save_path)
+                result = self._generate_dashscope_http(prompt, negative_prompt, None, timeout, cancel_token, n)
             else:
-                # 默认尝试类似 DALL-E 的格式
-                return self._generate_dalle_http(prompt, save_path)
-        except Exception as e:
-            print(f"✗ 图像生成失败: {e}")
-            print(f"  切换到模拟模式")
-            return self._mock_generate(prompt, save_path)
+                # DALL-E 及默认的类 DALL-E 格式
+                result = self._generate_dalle_http(prompt, None, timeout, cancel_token, n)
+        record_image_call(self.provider, self.image_config.get("model", ""), self._image_count(result))
+        return result
 
-    def _generate_dalle_http(self, prompt: str, save_path: Optional[str] = None) -> Dict[str, Any]:
-        """使用 HTTP 调用 DALL-E API"""
+    @staticmethod
+    def _image_count(result: Dict[str, Any]) -> int:
+        """一次调用实际返回的图片数（用于成本核算；异步任务的图片已在轮询时计入）"""
+        if result.get("task_id"):
+            return 0
+        return max(len(result.get("urls") or []), len(result.get("local_paths") or []), len(result.get("images_base64") or []), 1)
+
+    def _generate_dalle_http(
+        self,
+        prompt: str,
+        save_path: Optional[str] = None,
+        timeout: Optional[float] = None,
+        cancel_token: Optional[CancelToken] = None,
+        n: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """使用 HTTP 调用 DALL-E API（n 为本次请求的出图数量，默认取配置）"""
         url = f"{self.image_config['base_url']}/v1/images/generations"
 
         headers = {
@@ -79,30 +439,33 @@ class ImageClient:
         data = {
             "model": self.image_config["model"],
             "prompt": prompt,
-            "n": self.image_config["num_samples"],
+            "n": n or self.image_config["num_samples"],
             "size": self.image_config["size"],
             "quality": self.image_config["quality"]
         }
 
-        response = requests.post(
+        response = http_post(
+            cancel_token,
             url,
             headers=headers,
             json=data,
-            timeout=self.image_config["timeout"]
+            timeout=timeout or self.image_config["timeout"]
         )
         response.raise_for_status()
 
         result = response.json()
-        image_url = result["data"][0]["url"]
+        image_urls = [item["url"] for item in result["data"]]
+        image_url = image_urls[0]
 
         output = {
             "url": image_url,
+            "urls": image_urls,
             "provider": "dalle",
             "prompt": prompt,
         }
 
         if save_path:
-            self._download_image(image_url, save_path)
+            self._download_image(image_url, save_path, timeout, cancel_token)
             output["local_path"] = save_path
 
         return output
@@ -111,9 +474,16 @@ class ImageClient:
         self,
         prompt: str,
         negative_prompt: Optional[str] = None,
-        save_path: Optional[str] = None
+        save_path: Optional[str] = None,
+        timeout: Optional[float] = None,
+        cancel_token: Optional[CancelToken] = None,
+        n: Optional[int] = None
     ) -> Dict[str, Any]:
-        """使用 HTTP 调用 Stability AI API"""
+        """
+        使用 HTTP 调用 Stability AI API（n 为本次请求的出图数量，默认取配置）
+
+        响应总是流式解码写入磁盘；未指定 save_path 时写入 IMAGE_SAVE_DIR 下的新文件。
+        """
         engine_id = self.image_config["model"]
         url = f"{self.image_config['base_url']}/generation/{engine_id}/text-to-image"
 
@@ -133,50 +503,90 @@ class ImageClient:
             "height": 1024,
             "width": 1024,
             "steps": self.image_config["steps"],
-            "samples": self.image_config["num_samples"]
+            "samples": n or self.image_config["num_samples"]
         }
 
-        response = requests.post(
+        if not save_path:
+            save_path = str(Path(self.config.image_save_dir) / f"stability_{uuid.uuid4().hex}.png")
+
+        # base64 边读边解码写入磁盘，不在内存中保留完整响应
+        return self._stream_stability_response(
+            url, headers, data, prompt, save_path, timeout, cancel_token
+        )
+
+    def _stream_stability_response(
+        self,
+        url: str,
+        headers: Dict[str, str],
+        data: Dict[str, Any],
+        prompt: str,
+        save_path: str,
+        timeout: Optional[float] = None,
+        cancel_token: Optional[CancelToken] = None
+    ) -> Dict[str, Any]:
+        """
+        流式处理 Stability 响应：逐块扫描 artifacts[].base64 并增量解码到文件
+
+        第一张图写入 save_path，其余写入 save_path 同目录的 <stem>_<序号><后缀>。
+        是否在结果中保留 base64 由 IMAGE_KEEP_BASE64 控制。
+        """
+        keep_base64 = self.image_config.get("keep_base64", True)
+        target = Path(save_path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        local_paths: List[str] = []
+
+        def open_sink(index: int) -> BinaryIO:
+            path = target if index == 0 else target.with_name(f"{target.stem}_{index}{target.suffix}")
+            local_paths.append(str(path))
+            return open(path, "wb")
+
+        response = http_post(
+            cancel_token,
             url,
             headers=headers,
             json=data,
-            timeout=self.image_config["timeout"]
+            timeout=timeout or self.image_config["timeout"],
+            stream=True
         )
-        response.raise_for_status()
+        with response:
+            response.raise_for_status()
+            images_base64 = stream_base64_fields(
+                response.iter_content(chunk_size=STREAM_CHUNK_SIZE),
+                open_sink,
+                keep_text=keep_base64
+            )
 
-        result = response.json()
-        image_base64 = result["artifacts"][0]["base64"]
+        if not local_paths:
+            raise ValueError("Stability 响应中没有图片数据")
 
         output = {
-            "base64": image_base64,
             "provider": "stability",
             "prompt": prompt,
+            "local_path": local_paths[0],
+            "local_paths": local_paths,
         }
+        if keep_base64:
+            output["base64"] = images_base64[0]
+            output["images_base64"] = images_base64
 
-        if save_path:
-            image_data = base64.b64decode(image_base64)
-            Path(save_path).parent.mkdir(parents=True, exist_ok=True)
-            with open(save_path, "wb") as f:
-                f.write(image_data)
-            output["local_path"] = save_path
-            print(f"✓ 图像已保存到: {save_path}")
-
+        logger.debug("图像已保存", extra={"path": save_path})
         return output
 
-    def _generate_dashscope_http(
+    def supports_async_tasks(self) -> bool:
+        """当前提供商是否使用异步任务模式（提交后统一轮询）"""
+        return (
+            not self.config.use_mock_mode
+            and self.provider == "dashscope"
+            and self.image_config.get("async_mode", False)
+        )
+
+    def _dashscope_request_data(
         self,
         prompt: str,
         negative_prompt: Optional[str] = None,
-        save_path: Optional[str] = None
+        n: Optional[int] = None
     ) -> Dict[str, Any]:
-        """使用 HTTP 调用阿里云通义万相 API"""
-        url = f"{self.image_config['base_url']}/services/aigc/text2image/image-synthesis"
-
-        headers = {
-            "Authorization": f"Bearer {self.image_config['api_key']}",
-            "Content-Type": "application/json"
-        }
-
+        """构建通义万相请求体"""
         data = {
             "model": self.image_config.get("model", "wanx-v1"),
             "input": {
@@ -184,51 +594,267 @@ class ImageClient:
             },
             "parameters": {
                 "size": "1024*1024",
-                "n": self.image_config["num_samples"]
+                "n": n or self.image_config["num_samples"]
             }
         }
 
         if negative_prompt:
             data["input"]["negative_prompt"] = negative_prompt
 
-        response = requests.post(
-            url,
-            headers=headers,
-            json=data,
-            timeout=self.image_config["timeout"]
-        )
-        response.raise_for_status()
+        return data
 
-        result = response.json()
-        image_url = result["output"]["results"][0]["url"]
+    def _generate_dashscope_http(
+        self,
+        prompt: str,
+        negative_prompt: Optional[str] = None,
+        save_path: Optional[str] = None,
+        timeout: Optional[float] = None,
+        cancel_token: Optional[CancelToken] = None,
+        n: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """使用 HTTP 调用阿里云通义万相 API（n 为本次请求的出图数量，默认取配置）"""
+        if self.image_config.get("async_mode", False):
+            # 异步任务模式：提交单个任务并轮询到完成
+            task_id = self.submit_dashscope_task(prompt, negative_prompt, timeout, cancel_token, n)
+            task_result = self.poll_dashscope_tasks(
+                {0: task_id},
+                deadline=Deadline.after(timeout or self.image_config["timeout"]),
+                cancel_token=cancel_token
+            )[0]
+            if "error" in task_result:
+                raise RuntimeError(task_result["error"])
+            image_urls = task_result["urls"]
+        else:
+            url = f"{self.image_config['base_url']}/services/aigc/text2image/image-synthesis"
+
+            headers = {
+                "Authorization": f"Bearer {self.image_config['api_key']}",
+                "Content-Type": "application/json"
+            }
+
+            response = http_post(
+                cancel_token,
+                url,
+                headers=headers,
+                json=self._dashscope_request_data(prompt, negative_prompt, n),
+                timeout=timeout or self.image_config["timeout"]
+            )
+            response.raise_for_status()
+
+            result = response.json()
+            image_urls = [item["url"] for item in result["output"]["results"] if item.get("url")]
+
+        image_url = image_urls[0]
 
         output = {
             "url": image_url,
+            "urls": image_urls,
             "provider": "dashscope",
             "prompt": prompt,
         }
+        if self.image_config.get("async_mode", False):
+            output["task_id"] = task_id
 
         if save_path:
-            self._download_image(image_url, save_path)
+            self._download_image(image_url, save_path, timeout, cancel_token)
             output["local_path"] = save_path
 
         return output
 
-    def _download_image(self, url: str, save_path: str):
-        """下载图像到本地"""
-        response = requests.get(url, timeout=self.config.api_timeout)
+    def submit_dashscope_task(
+        self,
+        prompt: str,
+        negative_prompt: Optional[str] = None,
+        timeout: Optional[float] = None,
+        cancel_token: Optional[CancelToken] = None,
+        n: Optional[int] = None
+    ) -> str:
+        """
+        提交通义万相异步任务（X-DashScope-Async），立即返回任务 ID
+
+        Args:
+            prompt: 图像描述提示词
+            negative_prompt: 负面提示词
+            timeout: 提交请求的超时时间
+            cancel_token: 取消信号（可选）
+            n: 本任务的出图数量（默认取配置）
+
+        Returns:
+            task_id
+        """
+        url = f"{self.image_config['base_url']}/services/aigc/text2image/image-synthesis"
+
+        headers = {
+            "Authorization": f"Bearer {self.image_config['api_key']}",
+            "Content-Type": "application/json",
+            "X-DashScope-Async": "enable"
+        }
+
+        response = http_post(
+            cancel_token,
+            url,
+            headers=headers,
+            json=self._dashscope_request_data(prompt, negative_prompt, n),
+            timeout=timeout or self.image_config["timeout"]
+        )
         response.raise_for_status()
 
+        return response.json()["output"]["task_id"]
+
+    def poll_dashscope_tasks(
+        self,
+        tasks: Dict[Hashable, str],
+        deadline: Optional[Deadline] = None,
+        cancel_token: Optional[CancelToken] = None
+    ) -> Dict[Hashable, Dict[str, Any]]:
+        """
+        在单个协调循环中批量轮询多个异步任务
+
+        每一轮查询所有未完成的任务；本轮没有任务完成时按 1.5 倍退避，
+        有任务完成时恢复到初始间隔。截止时间到达或任务被取消时，
+        尝试在服务端取消剩余任务，避免继续消耗额度。
+        同一任务连续查询失败 DASHSCOPE_POLL_MAX_FAILURES 次后放弃并标记为失败。
+
+        Args:
+            tasks: {key: task_id}，key 通常为 panel_id
+            deadline: 截止时间（可选）
+            cancel_token: 取消信号（可选）
+
+        Returns:
+            {key: {"url": ..., "urls": [...], "task_id": ...}}；失败的任务为 {"error": ..., "task_id": ...}
+        """
+        deadline = as_deadline(deadline)
+        headers = {"Authorization": f"Bearer {self.image_config['api_key']}"}
+        base_interval = self.image_config.get("poll_interval", 1.0)
+        max_interval = self.image_config.get("poll_max_interval", 8.0)
+        max_failures = max(1, self.image_config.get("poll_max_failures", 5))
+
+        results: Dict[Hashable, Dict[str, Any]] = {}
+        pending = dict(tasks)
+        failures: Dict[Hashable, int] = {}
+        interval = base_interval
+        started = time.perf_counter()
+
+        while pending:
+            finished_this_round = 0
+
+            for key, task_id in list(pending.items()):
+                try:
+                    response = http_get(
+                        cancel_token,
+                        f"{self.image_config['base_url']}/tasks/{task_id}",
+                        headers=headers,
+                        timeout=deadline.timeout(self.image_config["timeout"], "轮询文生图任务")
+                    )
+                    response.raise_for_status()
+                    output = response.json().get("output", {})
+                except (DeadlineExceeded, JobCancelled):
+                    break
+                except Exception as e:
+                    # 单次查询失败不影响其他任务，下一轮重试；连续失败过多时放弃该任务
+                    failures[key] = failures.get(key, 0) + 1
+                    logger.warning("查询任务失败: %s", e, extra={"task_id": task_id, "failures": failures[key]})
+                    if failures[key] < max_failures:
+                        continue
+                    self._cancel_dashscope_task(task_id)
+                    output = {"task_status": "UNKNOWN", "message": f"连续 {failures[key]} 次查询任务状态失败: {e}"}
+                else:
+                    failures.pop(key, None)
+
+                status = output.get("task_status", "UNKNOWN")
+                if status == "SUCCEEDED":
+                    task_results = output.get("results") or [{}]
+                    image_urls = [item["url"] for item in task_results if item.get("url")]
+                    if image_urls:
+                        results[key] = {"url": image_urls[0], "urls": image_urls, "task_id": task_id}
+                        record_image_call(self.provider, self.image_config.get("model", ""), len(image_urls))
+                    else:
+                        results[key] = {"error": task_results[0].get("message", "任务成功但未返回图片"), "task_id": task_id}
+                elif status in ("FAILED", "CANCELED", "UNKNOWN"):
+                    results[key] = {"error": output.get("message", f"任务状态: {status}"), "task_id": task_id}
+                else:
+                    # PENDING / RUNNING
+                    continue
+
+                del pending[key]
+                finished_this_round += 1
+                IMAGE_CALL_DURATION.observe(
+                    time.perf_counter() - started,
+                    provider="dashscope_async",
+                    status="error" if "error" in results[key] else "ok"
+                )
+
+            if not pending:
+                break
+
+            stop_reason = None
+            if cancel_token and cancel_token.cancelled:
+                stop_reason = cancel_token.reason
+            elif deadline.expired():
+                stop_reason = "请求截止时间已到"
+
+            if stop_reason is None:
+                interval = base_interval if finished_this_round else min(interval * 1.5, max_interval)
+                remaining = deadline.remaining()
+                wait_time = interval if remaining is None else min(interval, remaining)
+                if cancel_token:
+                    cancel_token.wait(wait_time)
+                else:
+                    time.sleep(wait_time)
+                continue
+
+            # 放弃剩余任务，并尽量在服务端取消排队中的任务
+            for key, task_id in pending.items():
+                self._cancel_dashscope_task(task_id)
+                results[key] = {"error": stop_reason, "task_id": task_id, "cancelled": True}
+            break
+
+        return results
+
+    def _cancel_dashscope_task(self, task_id: str):
+        """尽力取消服务端排队中（PENDING）的任务"""
+        try:
+            requests.post(
+                f"{self.image_config['base_url']}/tasks/{task_id}/cancel",
+                headers={"Authorization": f"Bearer {self.image_config['api_key']}"},
+                timeout=5
+            )
+        except Exception:
+            pass
+
+    def _download_image(
+        self,
+        url: str,
+        save_path: str,
+        timeout: Optional[float] = None,
+        cancel_token: Optional[CancelToken] = None
+    ):
+        """下载图像到本地（流式写入临时文件，完成后原子替换）"""
+        if cancel_token:
+            cancel_token.check("下载图像")
+
         Path(save_path).parent.mkdir(parents=True, exist_ok=True)
-        with open(save_path, 'wb') as f:
-            f.write(response.content)
+        temp_path = f"{save_path}.part"
 
-        print(f"✓ 图像已保存到: {save_path}")
+        try:
+            with requests.get(url, timeout=timeout or self.config.api_timeout, stream=True) as response:
+                response.raise_for_status()
+                with open(temp_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                        if cancel_token:
+                            cancel_token.check("下载图像")
+                        f.write(chunk)
+            os.replace(temp_path, save_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        logger.debug("图像已保存", extra={"path": save_path})
 
     def _mock_generate(self, prompt: str, save_path: Optional[str] = None) -> Dict[str, Any]:
         """模拟图像生成"""
-        print(f"[模拟图像生成] Provider: {self.provider}")
-        print(f"[提示词] {prompt}")
+        logger.debug("模拟图像生成，提示词: %s", prompt, extra={"provider": self.provider})
         time.sleep(1.0)  # 模拟生成时间
 
         result = {
@@ -278,11 +904,10 @@ class ImageClient:
             # 保存
             Path(save_path).parent.mkdir(parents=True, exist_ok=True)
             img.save(save_path)
-            print(f"✓ 占位图像已创建: {save_path}")
+            logger.debug("占位图像已创建", extra={"path": save_path})
 
         except ImportError:
-            print("⚠️  PIL 未安装，无法创建占位图像")
-            print("   可以安装: pip install Pillow")
+            logger.warning("PIL 未安装，无法创建占位图像（可以安装: pip install Pillow）")
 
 
 # 全局图像客户端实例
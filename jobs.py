@@ -0,0 +1,248 @@
+"""
+任务（Job）与协作式取消模块
+- CancelToken: 取消信号，在 Agent 各节点、LLM 调用和文生图调用之间传递
+- Job: 一次生成请求（对应一次 StoryCreationAgent.run）
+- JobRegistry: 任务注册表，供 API 按 job_id 取消任务；多进程部署时通过共享存储
+  保证 job_id 在各 worker 中唯一，并把落在其他 worker 上的取消请求转交给持有任务的 worker
+
+取消是协作式的：已取消的任务不再调度新的工作，尚未开始的图片任务会被取消，
+并关闭该任务专用的 HTTP 会话以尽量中断进行中的请求。
+"""
+
+import threading
+import uuid
+from datetime import datetime
+from typing import Dict, Optional, Set
+
+import requests
+
+
+class JobCancelled(Exception):
+    """任务已被取消"""
+    pass
+
+
+class JobExists(Exception):
+    """job_id 已被运行中的任务占用"""
+    pass
+
+
+class CancelToken:
+    """协作式取消信号"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._sessions: Set[requests.Session] = set()
+        self.reason = ""
+
+    @property
+    def cancelled(self) -> bool:
+        """是否已取消"""
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "任务已取消"):
+        """发出取消信号，并关闭所有登记的 HTTP 会话"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            sessions = list(self._sessions)
+            self._sessions.clear()
+
+        for session in sessions:
+            try:
+                session.close()
+            except Exception:
+                pass
+
+    def check(self, stage: str = ""):
+        """已取消则抛出 JobCancelled"""
+        if self._event.is_set():
+            raise JobCancelled(f"{self.reason}，放弃: {stage}" if stage else self.reason)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待取消信号（用于可被取消的退避等待），返回是否已取消"""
+        return self._event.wait(timeout)
+
+    def session(self) -> requests.Session:
+        """
+        创建一个随取消而关闭的 HTTP 会话
+
+        Raises:
+            JobCancelled: 任务已取消
+        """
+        session = requests.Session()
+        with self._lock:
+            if self._event.is_set():
+                session.close()
+                raise JobCancelled(self.reason)
+            self._sessions.add(session)
+        return session
+
+    def release(self, session: requests.Session):
+        """HTTP 请求结束后释放会话"""
+        with self._lock:
+            self._sessions.discard(session)
+        session.close()
+
+
+def http_request(cancel_token: Optional[CancelToken], method: str, url: str, **kwargs) -> requests.Response:
+    """
+    发送 HTTP 请求；提供 cancel_token 时使用可随取消而关闭的会话
+
+    Raises:
+        JobCancelled: 请求前或请求过程中任务被取消
+    """
+    if cancel_token is None:
+        return requests.request(method, url, **kwargs)
+
+    session = cancel_token.session()
+    try:
+        response = session.request(method, url, **kwargs)
+    except Exception:
+        # 会话被取消关闭导致的异常统一转换为 JobCancelled
+        cancel_token.check("HTTP 请求")
+        raise
+    finally:
+        cancel_token.release(session)
+
+    cancel_token.check("HTTP 请求")
+    return response
+
+
+def http_post(cancel_token: Optional[CancelToken], url: str, **kwargs) -> requests.Response:
+    """发送可取消的 POST 请求"""
+    return http_request(cancel_token, "POST", url, **kwargs)
+
+
+def http_get(cancel_token: Optional[CancelToken], url: str, **kwargs) -> requests.Response:
+    """发送可取消的 GET 请求"""
+    return http_request(cancel_token, "GET", url, **kwargs)
+
+
+class Job:
+    """一次生成任务"""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.token = CancelToken()
+        self.status = "running"
+        self.created_at = datetime.now().isoformat()
+
+    def cancel(self, reason: str = "任务已取消"):
+        """取消任务"""
+        if self.status == "running":
+            self.status = "cancelled"
+        self.token.cancel(reason)
+
+    def to_dict(self) -> Dict[str, str]:
+        """转换为字典"""
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "reason": self.token.reason
+        }
+
+
+class JobRegistry:
+    """任务注册表（任务对象在本进程内，shared=True 时 job_id 和取消请求通过共享存储跨进程共享）"""
+
+    def __init__(self, shared: bool = False):
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self.shared = shared
+
+    @property
+    def store(self):
+        """共享存储（每次获取当前进程的连接；未共享时为 None）"""
+        if not self.shared:
+            return None
+        from shared_store import get_shared_store
+
+        return get_shared_store()
+
+    def create(self, job_id: Optional[str] = None) -> Job:
+        """
+        创建并登记任务（未指定 job_id 时自动生成）
+
+        Raises:
+            JobExists: job_id 已被运行中的任务占用
+        """
+        job = Job(job_id or uuid.uuid4().hex)
+        store = self.store
+        with self._lock:
+            if job.job_id in self._jobs:
+                raise JobExists(f"任务已存在: {job.job_id}")
+            if store is not None and not store.job_register(job.job_id):
+                raise JobExists(f"任务已存在: {job.job_id}")
+            self._jobs[job.job_id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """获取任务"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def token_for(self, job_id: Optional[str]) -> Optional[CancelToken]:
+        """获取任务的取消信号（任务不存在时返回 None）"""
+        if not job_id:
+            return None
+        job = self.get(job_id)
+        return job.token if job else None
+
+    def cancel(self, job_id: str, reason: str = "任务已取消") -> Optional[Dict[str, str]]:
+        """
+        取消任务：本进程的任务直接取消，其他 worker 上的任务通过共享存储转交
+
+        Returns:
+            任务状态；任务不存在或已结束时返回 None
+        """
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel(reason)
+            return job.to_dict()
+        store = self.store
+        if store is not None:
+            return store.job_request_cancel(job_id, reason)
+        return None
+
+    def poll_cancel(self, job: Job) -> bool:
+        """检查其他 worker 转交的取消请求，有则取消本地任务，返回是否已取消"""
+        store = self.store
+        if store is None or job.token.cancelled:
+            return job.token.cancelled
+        reason = store.job_cancel_reason(job.job_id)
+        if reason:
+            job.cancel(reason)
+            return True
+        return False
+
+    def finish(self, job_id: str, status: str = "completed"):
+        """任务结束，从注册表中移除"""
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job and job.status == "running":
+            job.status = status
+        if job and self.shared:
+            try:
+                self.store.job_finish(job_id, job.status)
+            except Exception:
+                # 共享存储不可用时不影响请求结束；该记录会因进程退出或下次登记而失效
+                pass
+
+
+# 全局任务注册表
+_job_registry: Optional[JobRegistry] = None
+
+
+def get_job_registry() -> JobRegistry:
+    """获取全局任务注册表（单例模式）"""
+    global _job_registry
+    if _job_registry is None:
+        from config import get_config
+
+        _job_registry = JobRegistry(shared=get_config().shared_jobs_enabled)
+    return _job_registry
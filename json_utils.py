@@ -0,0 +1,267 @@
+"""
+LLM 输出的 JSON 提取与校验
+- extract_json: 一次扫描找出最外层的 JSON 对象 / 数组，容忍代码块标记（```json）、前后说明文字和多余的末尾逗号
+- parse_llm_json: 提取后按 schemas.py 中的 pydantic 模型校验；仍然失败且提供了 repair 时，
+  请模型修复一次（只发送出错的输出和目标 JSON Schema，不重跑原任务）
+- response_json_schema: 提供商结构化输出（JSON 模式 / tool use）使用的 JSON Schema
+"""
+
+import json
+import re
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Callable, List, Optional
+
+from logger import get_logger
+
+if TYPE_CHECKING:
+    from pydantic import TypeAdapter
+
+
+logger = get_logger("json_utils")
+
+# 修复请求中附带的原始输出的最大长度（字符）
+REPAIR_MAX_CHARS = 8000
+
+REPAIR_SYSTEM_PROMPT = "你是一个 JSON 修复工具。只输出修复后的 JSON，不要输出任何其他文字。"
+
+# 候选 JSON 的起点
+_OPEN = re.compile(r"[{\[]")
+# 候选内部的结构性记号：完整的字符串（含转义）或括号、逗号，其余字符（数字、true、空白等）一次跳过
+_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|[{}\[\],]')
+_CLOSE_TO_OPEN = {"}": "{", "]": "["}
+
+
+class JSONExtractionError(ValueError):
+    """LLM 输出中没有符合要求的 JSON（text 为模型的原始输出，供调用方构建默认结构）"""
+
+    def __init__(self, message: str, text: str = ""):
+        super().__init__(message)
+        self.text = text
+
+
+def _balanced_spans(text: str):
+    """
+    依次产生平衡的最外层 {...} / [...] 片段
+
+    Yields:
+        (开始位置, 结束位置, 需要删除的末尾逗号位置列表)
+    """
+    pos = 0
+    while True:
+        opener = _OPEN.search(text, pos)
+        if opener is None:
+            return
+
+        start = opener.start()
+        stack: List[str] = []
+        trailing_commas: List[int] = []
+        last_comma: Optional[int] = None
+        end: Optional[int] = None
+
+        for match in _TOKEN.finditer(text, start):
+            token = match.group()
+            if token == ",":
+                last_comma = match.start()
+                continue
+            if token == "}" or token == "]":
+                # 逗号和右括号之间只有空白：多余的末尾逗号
+                if last_comma is not None and not text[last_comma + 1:match.start()].strip():
+                    trailing_commas.append(last_comma)
+                if not stack or stack[-1] != _CLOSE_TO_OPEN[token]:
+                    break
+                stack.pop()
+                if not stack:
+                    end = match.end()
+                    break
+            elif token == "{" or token == "[":
+                stack.append(token)
+            last_comma = None
+
+        if end is None:
+            # 括号不匹配或未闭合：从下一个字符继续找
+            pos = start + 1
+            continue
+
+        yield start, end, trailing_commas
+        pos = end
+
+
+def _remove_positions(text: str, start: int, end: int, positions: List[int]) -> str:
+    """取出 text[start:end] 并删除指定位置的字符"""
+    parts = []
+    cursor = start
+    for position in positions:
+        parts.append(text[cursor:position])
+        cursor = position + 1
+    parts.append(text[cursor:end])
+    return "".join(parts)
+
+
+def extract_json(text: str, expect: Optional[type] = None) -> Any:
+    """
+    从 LLM 输出中提取 JSON
+
+    Args:
+        text: LLM 返回的文本
+        expect: 期望的类型（dict 或 list），为 None 时接受任意对象 / 数组；
+            期望 list 而模型返回了只包含一个数组字段的对象（如 {"characters": [...]}）时取出该数组
+
+    Returns:
+        解析后的 Python 对象
+
+    Raises:
+        JSONExtractionError: 没有找到可解析且类型符合的 JSON
+    """
+    if not text:
+        raise JSONExtractionError("LLM 输出为空")
+
+    # 快速路径：整段就是 JSON（JSON 模式的输出）
+    stripped = text.strip()
+    if stripped[:1] in ("{", "["):
+        try:
+            value = json.loads(stripped)
+            matched = _match_expect(value, expect)
+            if matched is not None:
+                return matched
+        except json.JSONDecodeError:
+            pass
+
+    last_error = "未找到 JSON 对象或数组"
+    for start, end, trailing_commas in _balanced_spans(text):
+        raw = _remove_positions(text, start, end, trailing_commas) if trailing_commas else text[start:end]
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError as e:
+            last_error = f"JSON 解析失败: {e}"
+            continue
+        matched = _match_expect(value, expect)
+        if matched is not None:
+            return matched
+        last_error = f"期望 {expect.__name__}，得到 {type(value).__name__}"
+
+    raise JSONExtractionError(last_error)
+
+
+def _match_expect(value: Any, expect: Optional[type]) -> Any:
+    """类型符合时返回值（必要时取出对象中唯一的数组字段），否则返回 None"""
+    if expect is None or isinstance(value, expect):
+        return value
+    if expect is list and isinstance(value, dict):
+        lists = [item for item in value.values() if isinstance(item, list)]
+        if len(lists) == 1:
+            return lists[0]
+    return None
+
+
+@lru_cache(maxsize=None)
+def _adapter(schema: Any) -> "TypeAdapter":
+    # pydantic 在首次校验时才导入（导入 tools / llm_client 时不加载）
+    from pydantic import TypeAdapter
+
+    return TypeAdapter(schema)
+
+
+def _expected_type(schema: Any) -> type:
+    """schema 对应的顶层 JSON 类型（List[...] 为数组，其余为对象）"""
+    return list if getattr(schema, "__origin__", None) is list else dict
+
+
+def validate_json(value: Any, schema: Any) -> Any:
+    """
+    按 schema 校验已解析的数据，返回校验后的普通 Python 数据（模型转为字典，保留额外字段）
+
+    Raises:
+        JSONExtractionError: 不符合 schema
+    """
+    from pydantic import ValidationError
+
+    adapter = _adapter(schema)
+    try:
+        return adapter.dump_python(adapter.validate_python(value))
+    except ValidationError as e:
+        raise JSONExtractionError(f"JSON 不符合格式: {e.error_count()} 处错误，{e.errors()[0]['loc']}: {e.errors()[0]['msg']}")
+
+
+def json_schema(schema: Any) -> dict:
+    """schema 对应的 JSON Schema（用于修复请求和提供商的结构化输出）"""
+    return _adapter(schema).json_schema()
+
+
+def schema_name(schema: Any) -> str:
+    """schema 的名称（List[Character] 为 CharacterList），用作结构化输出的 schema / tool 名"""
+    if _expected_type(schema) is list:
+        return f"{schema.__args__[0].__name__}List"
+    return schema.__name__
+
+
+def _inline_refs(node: Any, defs: dict) -> Any:
+    """展开 $ref（部分兼容 OpenAI 格式的服务不支持 $defs）"""
+    if isinstance(node, dict):
+        if "$ref" in node:
+            return _inline_refs(defs[node["$ref"].rsplit("/", 1)[-1]], defs)
+        return {key: _inline_refs(value, defs) for key, value in node.items() if key != "$defs"}
+    if isinstance(node, list):
+        return [_inline_refs(item, defs) for item in node]
+    return node
+
+
+@lru_cache(maxsize=None)
+def _response_json_schema(schema: Any) -> str:
+    raw = json_schema(schema)
+    resolved = _inline_refs(raw, raw.get("$defs", {}))
+    if _expected_type(schema) is list:
+        # 结构化输出要求顶层为对象：数组放在 items 字段中（extract_json 期望 list 时会取出）
+        resolved = {"type": "object", "properties": {"items": resolved}, "required": ["items"]}
+    return json.dumps(resolved, ensure_ascii=False)
+
+
+def response_json_schema(schema: Any) -> dict:
+    """
+    提供商结构化输出使用的 JSON Schema：顶层为对象、不含 $ref
+
+    Args:
+        schema: pydantic 模型或 List[模型]
+
+    Returns:
+        JSON Schema（每次返回新的字典，调用方可以修改）
+    """
+    return json.loads(_response_json_schema(schema))
+
+
+def build_repair_prompt(text: str, error: str, schema: Any) -> str:
+    """构建修复请求：出错的输出 + 错误原因 + 目标 JSON Schema"""
+    return (
+        f"下面的内容应当是符合 JSON Schema 的 JSON，但无法使用（{error}）。\n"
+        "请修复为合法的 JSON 并只输出 JSON，不要改动其中的内容。\n\n"
+        f"【JSON Schema】\n{json.dumps(json_schema(schema), ensure_ascii=False)}\n\n"
+        f"【原始输出】\n{text[:REPAIR_MAX_CHARS]}"
+    )
+
+
+def parse_llm_json(text: str, schema: Any, repair: Optional[Callable[[str], str]] = None) -> Any:
+    """
+    提取并校验 LLM 输出的 JSON
+
+    Args:
+        text: LLM 返回的文本
+        schema: pydantic 模型或 List[模型]
+        repair: 修复调用（可选），参数为修复请求的提示词，返回模型的新输出；只在首次解析失败时调用一次
+
+    Returns:
+        校验后的数据（字典或字典列表）
+
+    Raises:
+        JSONExtractionError: 无法得到符合 schema 的 JSON（包括修复之后）
+    """
+    try:
+        try:
+            return validate_json(extract_json(text, _expected_type(schema)), schema)
+        except JSONExtractionError as e:
+            if repair is None:
+                raise
+            logger.info("LLM 输出无法使用，请求修复: %s", e)
+            repaired = repair(build_repair_prompt(text, str(e), schema))
+            return validate_json(extract_json(repaired, _expected_type(schema)), schema)
+    except JSONExtractionError as e:
+        e.text = text
+        raise
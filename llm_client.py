@@ -2,12 +2,43 @@
 语言模型客户端
 使用 HTTP 请求，无需安装厂商 SDK
 只需配置 URL + API Key + Model
+
+generate() 传入 schema（schemas.py 中的 pydantic 模型）时使用提供商的结构化输出：
+- OpenAI / 兼容服务：response_format=json_schema（LLM_STRUCTURED_OUTPUT=json 时为 json_object）
+- 通义千问：response_format=json_object
+- Anthropic：强制调用一个以该 schema 为参数的工具（tool use），取工具参数作为结果
+返回校验后的数据，不再需要调用方解析文本。
+
+提示词缓存（LLM_PROMPT_CACHE）：系统提示词和 cache_prefix（多次调用间相同的上下文，如大纲、角色信息）
+放在动态内容之前发送。Anthropic 与通义千问在这些内容上标记 cache_control（显式缓存）；
+OpenAI 对相同前缀自动缓存，无需标记。缓存命中的 token 数记录在指标、成本核算和追踪 span 中。
 """
 
+import json
+import re
+import threading
 import time
 import requests
-from typing import Optional, Dict, Any
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Union
 from config import get_config
+from deadline import Deadline, DeadlineExceeded, as_deadline
+from jobs import CancelToken, JobCancelled, http_post
+from json_utils import REPAIR_SYSTEM_PROMPT, parse_llm_json, response_json_schema, schema_name
+from metrics import LLM_CALL_DURATION, record_llm_usage, timed
+from accounting import record_llm_call
+from shared_store import cache_get, cache_set, result_cache_key
+from tracing import current_span, start_span
+from logger import get_logger
+
+
+logger = get_logger("llm_client")
+
+# 显式缓存标记（Anthropic / 通义千问）：缓存到该内容块为止的全部前缀
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# 模拟结构化输出时从提示词中取格子 ID（逐格提示词为「格子ID: 3」，批量提示词为「格子ID 3」）
+_PANEL_ID = re.compile(r"格子ID[:：]?\s*(\d+)")
 
 
 class LLMClient:
@@ -17,47 +48,210 @@ class LLMClient:
         self.config = get_config()
         self.llm_config = self.config.get_llm_config()
         self.provider = self.llm_config["provider"]
+        # 全局并发上限：同一进程内同时发往提供商的请求不超过 MAX_CONCURRENT_REQUESTS（各格并发调用共享）
+        self._slots = threading.BoundedSemaphore(max(1, self.config.max_concurrent_requests))
 
         if not self.config.use_mock_mode:
             self._initialize()
 
     def _initialize(self):
         """初始化客户端"""
-        print(f"✓ {self.provider.upper()} 客户端初始化成功")
-        print(f"  - URL: {self.llm_config.get('base_url')}")
-        print(f"  - Model: {self.llm_config['model']}")
+        logger.info(
+            "%s 客户端初始化成功",
+            self.provider.upper(),
+            extra={"url": self.llm_config.get("base_url"), "model": self.llm_config["model"]}
+        )
 
-    def generate(self, prompt: str, system_prompt: Optional[str] = None) -> str:
+    def generate(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        cancel_token: Optional[CancelToken] = None,
+        schema: Any = None,
+        cache_prefix: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        timeout: Optional[float] = None
+    ) -> Any:
         """
-        生成文本
+        生成文本或结构化数据
 
         Args:
             prompt: 用户提示词
             system_prompt: 系统提示词（可选）
+            deadline: 请求截止时间（可选），本次调用只使用剩余预算
+            cancel_token: 取消信号（可选），取消时中断进行中的 HTTP 请求
+            schema: 输出格式（可选），pydantic 模型或 List[模型]；指定时使用提供商的结构化输出
+            cache_prefix: 可缓存的用户消息前缀（可选），多次调用间完全相同的上下文，发送在 prompt 之前
+            max_tokens: 本次调用的最大生成长度（可选），默认取 LLM_MAX_TOKENS
+            timeout: 本次调用的超时（秒，可选），默认取 API_TIMEOUT；均不超过剩余预算
 
         Returns:
-            生成的文本
+            未指定 schema 时为生成的文本；指定时为校验后的数据（字典或字典列表）
+
+        Raises:
+            DeadlineExceeded: 调用前截止时间已到
+            JobCancelled: 任务已被取消
+            JSONExtractionError: 指定了 schema，但输出（包括修复之后）不符合格式
+            Exception: 提供商调用失败（超时、5xx、鉴权等），非模拟模式下原样抛出
         """
+        as_deadline(deadline).check("LLM 调用")
+        if cancel_token:
+            cancel_token.check("LLM 调用")
+
         if self.config.use_mock_mode:
-            return self._mock_generate(prompt)
+            with self._slot(deadline), timed(LLM_CALL_DURATION, provider="mock"):
+                text = self._mock_generate(_join_prefix(cache_prefix, prompt), schema)
+            record_llm_call("mock", "mock", 0, 0)
+            return text if schema is None else parse_llm_json(text, schema)
+
+        # 结果缓存（各 worker 共享）：相同提供商、模型、参数和提示词直接复用，不计费
+        cache_key = result_cache_key(
+            self.provider, self.llm_config["model"], self.llm_config["temperature"],
+            self.llm_config["top_p"], max_tokens or self.llm_config["max_tokens"], system_prompt, cache_prefix, prompt,
+            schema_name(schema) if schema is not None else None
+        )
+        cached = cache_get("llm", cache_key)
+        if cached is not None:
+            return cached
 
         try:
+            text = self._call_provider(
+                prompt, system_prompt, deadline, cancel_token, schema, cache_prefix, max_tokens, timeout
+            )
+        except (DeadlineExceeded, JobCancelled):
+            raise
+        except Exception as e:
+            # 不回退到模拟数据：与用户输入无关的模拟故事会被当作真实结果继续生成（并付费渲染）图片，
+            # 由调用方走各自的失败处理（占位内容或「模型调用失败」）
+            logger.error("LLM 调用失败: %s", e, extra={"provider": self.provider})
+            raise
+
+        result = text
+        if schema is not None:
+            repair = self._json_repair(schema, deadline, cancel_token, max_tokens, timeout)
+            result = parse_llm_json(text, schema, repair=repair)
+        cache_set("llm", cache_key, result, self.config.llm_cache_ttl)
+        return result
+
+    def _call_provider(
+        self,
+        prompt: str,
+        system_prompt: Optional[str],
+        deadline: Optional[Deadline],
+        cancel_token: Optional[CancelToken],
+        schema: Any = None,
+        cache_prefix: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        timeout: Optional[float] = None
+    ) -> str:
+        """按提供商发起一次调用，返回模型输出的文本（结构化输出时为 JSON 文本）"""
+        if not self.config.llm_structured_output:
+            schema = None
+
+        with self._slot(deadline), \
+                start_span("llm.call", provider=self.provider, model=self.llm_config["model"]), \
+                timed(LLM_CALL_DURATION, provider=self.provider):
+            # 取得并发名额后再计算超时，排队时间不占用本次调用的超时
+            timeout = as_deadline(deadline).timeout(timeout or self.llm_config["timeout"], "LLM 调用")
+            if cancel_token:
+                cancel_token.check("LLM 调用")
+
+            args = (prompt, system_prompt, timeout, cancel_token, schema, cache_prefix, max_tokens)
             if self.provider == "anthropic":
-                return self._generate_anthropic_http(prompt, system_prompt)
+                return self._generate_anthropic_http(*args)
             elif self.provider == "openai":
-                return self._generate_openai_http(prompt, system_prompt)
+                return self._generate_openai_http(*args)
             elif self.provider == "dashscope":
-                return self._generate_dashscope_http(prompt, system_prompt)
+                return self._generate_dashscope_http(*args)
             else:
                 # 默认尝试 OpenAI 兼容格式
-                return self._generate_openai_http(prompt, system_prompt)
-        except Exception as e:
-            print(f"✗ LLM 调用失败: {e}")
-            print(f"  切换到模拟模式")
-            return self._mock_generate(prompt)
+                return self._generate_openai_http(*args)
+
+    def _json_repair(
+        self,
+        schema: Any,
+        deadline: Optional[Deadline],
+        cancel_token: Optional[CancelToken],
+        max_tokens: Optional[int] = None,
+        timeout: Optional[float] = None
+    ):
+        """
+        构建 JSON 修复调用（传给 parse_llm_json），修复后的输出与原输出等长，沿用原调用的长度和超时
+
+        Returns:
+            修复调用；未启用修复（LLM_JSON_REPAIR=false）时返回 None
+        """
+        if not self.config.llm_json_repair:
+            return None
 
-    def _generate_anthropic_http(self, prompt: str, system_prompt: Optional[str] = None) -> str:
-        """使用 HTTP 调用 Anthropic API"""
+        def repair(repair_prompt: str) -> str:
+            return self._call_provider(
+                repair_prompt, REPAIR_SYSTEM_PROMPT, deadline, cancel_token, schema,
+                max_tokens=max_tokens, timeout=timeout
+            )
+
+        return repair
+
+    @contextmanager
+    def _slot(self, deadline: Optional[Deadline]):
+        """
+        占用一个并发名额，最多等待到截止时间
+
+        Raises:
+            DeadlineExceeded: 等待名额时截止时间已到
+        """
+        if not self._slots.acquire(timeout=as_deadline(deadline).remaining()):
+            raise DeadlineExceeded("请求截止时间已到，放弃: 等待 LLM 并发名额")
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def _user_content(
+        self,
+        prompt: str,
+        cache_prefix: Optional[str],
+        mark_cache: bool
+    ) -> Union[str, List[Dict[str, Any]]]:
+        """
+        构建用户消息内容：cache_prefix 在前，动态内容在后
+
+        Args:
+            mark_cache: 是否拆成内容块并在 cache_prefix 上标记 cache_control（显式缓存）
+        """
+        if not cache_prefix:
+            return prompt
+        if not mark_cache:
+            return _join_prefix(cache_prefix, prompt)
+        return [
+            {"type": "text", "text": cache_prefix, "cache_control": CACHE_CONTROL},
+            {"type": "text", "text": prompt}
+        ]
+
+    def _openai_response_format(self, schema: Any) -> Dict[str, Any]:
+        """OpenAI 格式的 response_format：默认 json_schema，LLM_STRUCTURED_OUTPUT=json 时为 json_object"""
+        if self.config.llm_structured_output == "json":
+            return {"type": "json_object"}
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": schema_name(schema), "schema": response_json_schema(schema)}
+        }
+
+    def _generate_anthropic_http(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        timeout: Optional[float] = None,
+        cancel_token: Optional[CancelToken] = None,
+        schema: Any = None,
+        cache_prefix: Optional[str] = None,
+        max_tokens: Optional[int] = None
+    ) -> str:
+        """
+        使用 HTTP 调用 Anthropic API（指定 schema 时强制调用同名工具，返回工具参数的 JSON）
+        启用提示词缓存时在系统提示词和 cache_prefix 上各标记一个缓存断点
+        """
         url = f"{self.llm_config['base_url']}/v1/messages"
 
         headers = {
@@ -66,31 +260,60 @@ class LLMClient:
             "content-type": "application/json"
         }
 
-        messages = [{"role": "user", "content": prompt}]
+        prompt_cache = self.config.llm_prompt_cache
+        messages = [{"role": "user", "content": self._user_content(prompt, cache_prefix, prompt_cache)}]
 
         data = {
             "model": self.llm_config["model"],
-            "max_tokens": self.llm_config["max_tokens"],
+            "max_tokens": max_tokens or self.llm_config["max_tokens"],
             "temperature": self.llm_config["temperature"],
             "messages": messages
         }
 
         if system_prompt:
             data["system"] = system_prompt
-
-        response = requests.post(
+            if prompt_cache:
+                data["system"] = [{"type": "text", "text": system_prompt, "cache_control": CACHE_CONTROL}]
+
+        if schema is not None:
+            tool_name = schema_name(schema)
+            data["tools"] = [{
+                "name": tool_name,
+                "description": "按指定格式提交结果",
+                "input_schema": response_json_schema(schema)
+            }]
+            data["tool_choice"] = {"type": "tool", "name": tool_name}
+
+        response = http_post(
+            cancel_token,
             url,
             headers=headers,
             json=data,
-            timeout=self.llm_config["timeout"]
+            timeout=timeout or self.llm_config["timeout"]
         )
         response.raise_for_status()
 
         result = response.json()
+        self._record_usage(result)
+        for block in result["content"]:
+            if block.get("type") == "tool_use":
+                return json.dumps(block["input"], ensure_ascii=False)
         return result["content"][0]["text"]
 
-    def _generate_openai_http(self, prompt: str, system_prompt: Optional[str] = None) -> str:
-        """使用 HTTP 调用 OpenAI API（也兼容其他 OpenAI 格式的服务）"""
+    def _generate_openai_http(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        timeout: Optional[float] = None,
+        cancel_token: Optional[CancelToken] = None,
+        schema: Any = None,
+        cache_prefix: Optional[str] = None,
+        max_tokens: Optional[int] = None
+    ) -> str:
+        """
+        使用 HTTP 调用 OpenAI API（也兼容其他 OpenAI 格式的服务）
+        OpenAI 对相同的消息前缀自动缓存，cache_prefix 直接拼在用户消息开头
+        """
         url = f"{self.llm_config['base_url']}/chat/completions"
 
         headers = {
@@ -101,29 +324,46 @@ class LLMClient:
         messages = []
         if system_prompt:
             messages.append({"role": "system", "content": system_prompt})
-        messages.append({"role": "user", "content": prompt})
+        messages.append({"role": "user", "content": self._user_content(prompt, cache_prefix, False)})
 
         data = {
             "model": self.llm_config["model"],
             "messages": messages,
-            "max_tokens": self.llm_config["max_tokens"],
+            "max_tokens": max_tokens or self.llm_config["max_tokens"],
             "temperature": self.llm_config["temperature"],
             "top_p": self.llm_config["top_p"]
         }
 
-        response = requests.post(
+        if schema is not None:
+            data["response_format"] = self._openai_response_format(schema)
+
+        response = http_post(
+            cancel_token,
             url,
             headers=headers,
             json=data,
-            timeout=self.llm_config["timeout"]
+            timeout=timeout or self.llm_config["timeout"]
         )
         response.raise_for_status()
 
         result = response.json()
+        self._record_usage(result)
         return result["choices"][0]["message"]["content"]
 
-    def _generate_dashscope_http(self, prompt: str, system_prompt: Optional[str] = None) -> str:
-        """使用 HTTP 调用阿里云通义千问 API"""
+    def _generate_dashscope_http(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        timeout: Optional[float] = None,
+        cancel_token: Optional[CancelToken] = None,
+        schema: Any = None,
+        cache_prefix: Optional[str] = None,
+        max_tokens: Optional[int] = None
+    ) -> str:
+        """
+        使用 HTTP 调用阿里云通义千问 API（指定 schema 时使用 JSON 模式）
+        启用提示词缓存时在最后一段静态内容（cache_prefix，没有时为系统提示词）上标记显式缓存
+        """
         url = f"{self.llm_config['base_url']}/v1/chat/completions"
 
         headers = {
@@ -131,38 +371,87 @@ class LLMClient:
             "Content-Type": "application/json"
         }
 
+        prompt_cache = self.config.llm_prompt_cache
         messages = []
         if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        messages.append({"role": "user", "content": prompt})
+            system_content = system_prompt
+            if prompt_cache and not cache_prefix:
+                system_content = [{"type": "text", "text": system_prompt, "cache_control": CACHE_CONTROL}]
+            messages.append({"role": "system", "content": system_content})
+        messages.append({"role": "user", "content": self._user_content(prompt, cache_prefix, prompt_cache)})
 
         data = {
             "model": self.llm_config["model"],
             "messages": messages,
             "parameters": {
-                "max_tokens": self.llm_config["max_tokens"],
+                "max_tokens": max_tokens or self.llm_config["max_tokens"],
                 "temperature": self.llm_config["temperature"],
                 "top_p": self.llm_config["top_p"]
             }
         }
 
-        response = requests.post(
+        if schema is not None:
+            # 通义千问兼容接口的 JSON 模式（提示词中需包含 "JSON" 字样，tools.py 的提示词均已包含）
+            data["response_format"] = {"type": "json_object"}
+
+        response = http_post(
+            cancel_token,
             url,
             headers=headers,
             json=data,
-            timeout=self.llm_config["timeout"]
+            timeout=timeout or self.llm_config["timeout"]
         )
         response.raise_for_status()
 
         result = response.json()
         # 你的 API 返回的是 OpenAI 兼容格式
+        self._record_usage(result)
         return result["choices"][0]["message"]["content"]
 
-    def _mock_generate(self, prompt: str) -> str:
-        """模拟生成（用于测试）"""
-        print(f"[模拟 LLM 调用] Provider: {self.provider}")
+    def _record_usage(self, result: Dict[str, Any]):
+        """
+        记录提供商返回的 token 用量（指标 + 成本核算）
+
+        Anthropic 的 input_tokens 不含缓存读写部分，需加上 cache_*_input_tokens；
+        OpenAI 兼容格式的 prompt_tokens 已包含 prompt_tokens_details.cached_tokens
+        （通义千问显式缓存的写入量在 prompt_tokens_details.cache_creation_input_tokens）。
+        """
+        usage = result.get("usage") or {}
+        if "input_tokens" in usage:
+            cached_tokens = usage.get("cache_read_input_tokens") or 0
+            cache_write_tokens = usage.get("cache_creation_input_tokens") or 0
+            input_tokens = (usage.get("input_tokens") or 0) + cached_tokens + cache_write_tokens
+            output_tokens = usage.get("output_tokens")
+        else:
+            details = usage.get("prompt_tokens_details") or {}
+            cached_tokens = details.get("cached_tokens") or 0
+            cache_write_tokens = details.get("cache_creation_input_tokens") or 0
+            input_tokens = usage.get("prompt_tokens")
+            output_tokens = usage.get("completion_tokens")
+
+        record_llm_usage(self.provider, input_tokens, output_tokens, cached_tokens, cache_write_tokens)
+        record_llm_call(self.provider, self.llm_config["model"], input_tokens, output_tokens, cached_tokens)
+
+        span = current_span()
+        if span is not None:
+            span.set_attribute("prompt_tokens", input_tokens)
+            span.set_attribute("completion_tokens", output_tokens)
+            span.set_attribute("cached_tokens", cached_tokens)
+
+    def _mock_generate(self, prompt: str, schema: Any = None) -> str:
+        """
+        模拟生成（用于测试）
+
+        指定 schema 时返回符合该格式的 JSON 文本，由调用方按真实输出同样的方式解析校验
+        """
+        logger.debug("模拟 LLM 调用", extra={"provider": self.provider})
         time.sleep(0.5)  # 模拟网络延迟
 
+        if schema is not None:
+            data = self._get_mock_structured(schema_name(schema), prompt)
+            if data is not None:
+                return json.dumps(data, ensure_ascii=False)
+
         # 根据提示词关键字返回不同的模拟内容
         if "大纲" in prompt or "outline" in prompt.lower():
             return self._get_mock_outline()
@@ -175,6 +464,122 @@ class LLMClient:
         else:
             return f"[模拟内容]\n基于输入生成的响应: {prompt[:100]}..."
 
+    def _get_mock_structured(self, name: str, prompt: str) -> Optional[Any]:
+        """
+        按 schema 名称返回模拟的结构化数据（格子 ID 取自提示词）
+
+        Returns:
+            符合格式的数据；未知的 schema 返回 None（退回文本模拟）
+        """
+        panel_ids = [int(panel_id) for panel_id in _PANEL_ID.findall(prompt)] or [1]
+
+        if name == "ComicOutline":
+            return self._get_mock_outline_data()
+        if name == "CharacterList":
+            return self._get_mock_characters_data()
+        if name == "StoryData":
+            return self._get_mock_story_data()
+        if name == "StorySegment":
+            return self._get_mock_segment_data(panel_ids[0])
+        if name == "StorySegmentList":
+            return [self._get_mock_segment_data(panel_id) for panel_id in panel_ids]
+        if name == "ImagePrompt":
+            return self._get_mock_image_prompt_data(panel_ids[0])
+        if name == "ImagePromptList":
+            return [self._get_mock_image_prompt_data(panel_id) for panel_id in panel_ids]
+        return None
+
+    def _get_mock_outline_data(self) -> Dict[str, Any]:
+        """返回模拟的漫画大纲（ComicOutline，格数取 COMIC_PANELS）"""
+        plot_points = [
+            "林晨在祖父的阁楼里发现一本神秘日记",
+            "日记中画着时间机器的草图",
+            "林晨找到废弃的实验室并启动了机器",
+            "他穿越到 100 年前，遇见年轻的祖父",
+            "林晨意识到改变过去会带来灾难",
+            "他回到现代，封存了时间机器",
+        ]
+        panels = max(1, self.config.comic_panels)
+        return {
+            "title": "时光旅行者",
+            "theme": "亲情与珍惜当下",
+            "style": self.config.comic_style,
+            "total_panels": panels,
+            "plot_outline": "林晨在祖父的遗物中发现时间机器的线索，穿越到过去后选择不改变历史，回到现代珍惜当下。",
+            "panel_breakdown": [
+                {"panel_id": i, "plot_point": plot_points[(i - 1) % len(plot_points)]}
+                for i in range(1, panels + 1)
+            ]
+        }
+
+    def _get_mock_characters_data(self) -> List[Dict[str, Any]]:
+        """返回模拟的角色设计（CharacterList）"""
+        return [
+            {
+                "name": "林晨",
+                "role": "主角",
+                "appearance": "28 岁，中等身材，戴黑框眼镜，穿格子衬衫和牛仔裤",
+                "personality": "好奇心强、理性、有责任感",
+                "visual_tags": ["young man", "black-rimmed glasses", "plaid shirt"]
+            },
+            {
+                "name": "林祖父",
+                "role": "配角",
+                "appearance": "25 岁（1920 年代），英俊，眼神坚定，穿背带裤和白衬衫",
+                "personality": "理想主义、富有创造力",
+                "visual_tags": ["1920s scientist", "suspenders", "white shirt"]
+            }
+        ]
+
+    def _get_mock_segment_data(self, panel_id: int) -> Dict[str, Any]:
+        """返回模拟的一格分段文本（StorySegment）"""
+        return {
+            "panel_id": panel_id,
+            "scene_description": f"第{panel_id}格：祖父老房子的阁楼，傍晚的阳光斜射进来",
+            "characters_in_scene": ["林晨"],
+            "dialogue": "这本日记……是祖父留下的？",
+            "action": "林晨翻开皮革日记",
+            "emotion": "好奇",
+            "text": f"第{panel_id}格：林晨在阁楼里翻开了祖父的日记。"
+        }
+
+    def _get_mock_image_prompt_data(self, panel_id: int) -> Dict[str, Any]:
+        """返回模拟的一格文生图提示词（ImagePrompt）"""
+        return {
+            "panel_id": panel_id,
+            "positive_prompt": f"{self.config.comic_style} style, panel {panel_id}, young man with black-rimmed glasses "
+                               "reading an old leather diary in a sunlit attic, warm lighting",
+            "negative_prompt": "low quality, blurry, deformed",
+            "style_tags": [self.config.comic_style, "warm lighting"]
+        }
+
+    def _get_mock_story_data(self) -> Dict[str, Any]:
+        """返回模拟的 9 帧故事数据（StoryData）"""
+        character = "young man with black-rimmed glasses and plaid shirt"
+        scenes = [
+            ("林晨在祖父的阁楼里整理遗物", "opening an old wooden chest in a dusty attic"),
+            ("他发现一本皮革日记", "holding a worn leather diary, sunlight through the window"),
+            ("日记里画着时间机器的草图", "close-up of hand-drawn time machine sketches in the diary"),
+            ("林晨来到废弃的实验室", "standing in an abandoned laboratory full of old machines"),
+            ("他启动了时间机器", "pulling a lever on a glowing brass time machine"),
+            ("他穿越到 1924 年，遇见年轻的祖父", "meeting a 1920s scientist in suspenders in the same laboratory"),
+            ("两人一起修理机器，成为朋友", "repairing the time machine together with the 1920s scientist, smiling"),
+            ("林晨告别祖父，回到现代", "waving goodbye to the 1920s scientist as the time machine glows"),
+            ("他把日记放回木箱，珍惜当下", "placing the diary back into the wooden chest at sunset, peaceful"),
+        ]
+        return {
+            "character_settings": f"林晨：{character}；画风：温暖的手绘绘本风格",
+            "main_story": "林晨在祖父的遗物中发现时间机器，穿越到过去与年轻的祖父相遇，最终回到现代珍惜当下。",
+            "frames": [
+                {
+                    "frame_index": i,
+                    "scene_description": description,
+                    "visual_prompt": f"warm storybook illustration, {character}, {visual}"
+                }
+                for i, (description, visual) in enumerate(scenes, 1)
+            ]
+        }
+
     def _get_mock_outline(self) -> str:
         """返回模拟的故事大纲"""
         return """故事大纲：《时光旅行者》
@@ -278,6 +683,11 @@ class LLMClient:
 - 情绪传达：从怀疑到确信的转变"""
 
 
+def _join_prefix(cache_prefix: Optional[str], prompt: str) -> str:
+    """cache_prefix 与 prompt 拼成一条文本（不使用显式缓存时）"""
+    return f"{cache_prefix}\n\n{prompt}" if cache_prefix else prompt
+
+
 # 全局 LLM 客户端实例
 _llm_client: Optional[LLMClient] = None
 
@@ -0,0 +1,279 @@
+"""
+压测驱动
+以目标 RPS（开环，按固定间隔发出请求，不等待前一个请求完成）调用 /api/generate_storybook，
+结束后报告：
+- 吞吐量、状态码分布、端到端时延 p50/p95/p99（客户端测量）
+- 各阶段时延 p50/p95/p99：压测前后各抓取一次 /metrics，按直方图增量估算分位数
+  （LangGraph 节点、LLM 调用、文生图排队与调用）
+
+建议配合 fake_provider.py 使用，不消耗真实 API 额度。
+
+使用方法:
+    python loadtest.py --url http://127.0.0.1:8000 --rps 0.5 --duration 60
+    python loadtest.py --rps 2 --duration 120 --json loadtest_result.json
+"""
+
+import argparse
+import json
+import math
+import re
+import threading
+import time
+from collections import Counter as StatusCounter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+
+# 报告中按阶段展示的直方图及其分组标签
+STAGE_HISTOGRAMS = [
+    ("storybook_node_duration_seconds", "node"),
+    ("storybook_llm_call_duration_seconds", "provider"),
+    ("storybook_image_queue_wait_seconds", "provider"),
+    ("storybook_image_call_duration_seconds", "provider"),
+    ("storybook_request_duration_seconds", "endpoint"),
+]
+
+_SAMPLE_PATTERN = re.compile(r'^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(?P<labels>.*)\})?\s+(?P<value>\S+)$')
+_LABEL_PATTERN = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+# 直方图：{(name, 标签元组): {le: 累计计数}}
+Buckets = Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Dict[float, float]]
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """样本分位数（最近秩法），没有样本时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, math.ceil(q * len(ordered)) - 1)
+    return ordered[index]
+
+
+def parse_histograms(text: str) -> Buckets:
+    """解析 Prometheus 文本中所有 *_bucket 样本"""
+    buckets: Buckets = {}
+    for line in text.splitlines():
+        match = _SAMPLE_PATTERN.match(line.strip())
+        if not match or not match.group("name").endswith("_bucket"):
+            continue
+        labels = dict(_LABEL_PATTERN.findall(match.group("labels") or ""))
+        le = labels.pop("le", None)
+        if le is None:
+            continue
+        key = (match.group("name")[:-len("_bucket")], tuple(sorted(labels.items())))
+        buckets.setdefault(key, {})[math.inf if le == "+Inf" else float(le)] = float(match.group("value"))
+    return buckets
+
+
+def histogram_quantile(q: float, buckets: Dict[float, float]) -> Optional[float]:
+    """
+    按累计分桶估算分位数（与 Prometheus histogram_quantile 相同的桶内线性插值）
+
+    落在 +Inf 桶中时返回最大的有限上界。
+    """
+    bounds = sorted(buckets)
+    total = buckets.get(math.inf, 0.0)
+    if total <= 0:
+        return None
+
+    rank = q * total
+    previous_bound, previous_count = 0.0, 0.0
+    for bound in bounds:
+        count = buckets[bound]
+        if count >= rank:
+            if bound == math.inf:
+                return previous_bound
+            if count == previous_count:
+                return bound
+            return previous_bound + (bound - previous_bound) * (rank - previous_count) / (count - previous_count)
+        previous_bound, previous_count = bound, count
+    return previous_bound
+
+
+def stage_report(before: Buckets, after: Buckets) -> List[Dict[str, Any]]:
+    """压测期间各阶段的调用次数和时延分位数（各 status 合并，按分组标签汇总）"""
+    rows = []
+    for name, group_label in STAGE_HISTOGRAMS:
+        merged: Dict[str, Dict[float, float]] = {}
+        for (metric, labels), counts in after.items():
+            if metric != name:
+                continue
+            base = before.get((metric, labels), {})
+            group = dict(labels).get(group_label, "")
+            target = merged.setdefault(group, {})
+            for bound, count in counts.items():
+                target[bound] = target.get(bound, 0.0) + count - base.get(bound, 0.0)
+
+        for group, counts in sorted(merged.items()):
+            total = counts.get(math.inf, 0.0)
+            if total <= 0:
+                continue
+            rows.append({
+                "metric": name,
+                group_label: group,
+                "count": int(total),
+                "p50": histogram_quantile(0.50, counts),
+                "p95": histogram_quantile(0.95, counts),
+                "p99": histogram_quantile(0.99, counts)
+            })
+    return rows
+
+
+def scrape_metrics(base_url: str) -> Buckets:
+    """抓取 /metrics（失败时返回空，阶段报告为空）"""
+    try:
+        response = requests.get(f"{base_url}/metrics", timeout=10)
+        response.raise_for_status()
+        return parse_histograms(response.text)
+    except Exception as e:
+        print(f"⚠️ 抓取 /metrics 失败: {e}")
+        return {}
+
+
+class LoadTest:
+    """开环压测：按目标 RPS 发出请求，记录每个请求的状态和时延"""
+
+    def __init__(
+        self,
+        base_url: str,
+        rps: float,
+        duration: float,
+        prompt: str,
+        timeout: Optional[float] = None,
+        tenant: Optional[str] = None,
+        max_in_flight: int = 256
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.rps = rps
+        self.duration = duration
+        self.prompt = prompt
+        self.timeout = timeout
+        self.tenant = tenant
+        self.max_in_flight = max_in_flight
+        self.results: List[Dict[str, Any]] = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+
+    def _send(self, index: int):
+        payload: Dict[str, Any] = {"prompt": self.prompt, "project_name": f"loadtest_{index}"}
+        if self.timeout:
+            payload["timeout"] = self.timeout
+        headers = {"X-Tenant-Id": self.tenant} if self.tenant else {}
+
+        started = time.perf_counter()
+        try:
+            response = requests.post(
+                f"{self.base_url}/api/generate_storybook",
+                json=payload,
+                headers=headers,
+                timeout=(self.timeout or 600) + 30
+            )
+            status = str(response.status_code)
+        except Exception as e:
+            status = type(e).__name__
+        finally:
+            self._in_flight.release()
+
+        with self._lock:
+            self.results.append({"status": status, "latency": time.perf_counter() - started})
+
+    def run(self) -> Dict[str, Any]:
+        """执行压测并返回报告"""
+        before = scrape_metrics(self.base_url)
+        interval = 1.0 / self.rps
+        total = max(1, int(self.duration * self.rps))
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            for index in range(total):
+                # 开环：按计划时间发出，不因前面的请求变慢而推迟
+                delay = started + index * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                if not self._in_flight.acquire(blocking=False):
+                    # 在途请求已达上限，记为丢弃（说明服务已经跟不上目标 RPS）
+                    self.dropped += 1
+                    continue
+                executor.submit(self._send, index)
+        elapsed = time.perf_counter() - started
+
+        after = scrape_metrics(self.base_url)
+        return self._report(elapsed, stage_report(before, after))
+
+    def _report(self, elapsed: float, stages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        statuses = StatusCounter(result["status"] for result in self.results)
+        ok_latencies = [result["latency"] for result in self.results if result["status"] == "200"]
+        return {
+            "target_rps": self.rps,
+            "duration": round(elapsed, 3),
+            "sent": len(self.results),
+            "dropped": self.dropped,
+            "statuses": dict(statuses),
+            "throughput_rps": round(len(ok_latencies) / elapsed, 4) if elapsed else 0.0,
+            "latency": {
+                "p50": percentile(ok_latencies, 0.50),
+                "p95": percentile(ok_latencies, 0.95),
+                "p99": percentile(ok_latencies, 0.99),
+                "max": max(ok_latencies) if ok_latencies else None
+            },
+            "stages": stages
+        }
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:8.3f}"
+
+
+def print_report(report: Dict[str, Any]):
+    """打印压测报告"""
+    print("\n" + "=" * 70)
+    print("📈 压测结果")
+    print("=" * 70)
+    print(f"目标 RPS: {report['target_rps']}   持续: {report['duration']}s   "
+          f"发出: {report['sent']}   丢弃: {report['dropped']}")
+    print(f"状态码: {report['statuses']}")
+    print(f"吞吐量（成功）: {report['throughput_rps']} req/s")
+    latency = report["latency"]
+    print(f"端到端时延（秒） p50={_fmt(latency['p50'])} p95={_fmt(latency['p95'])} "
+          f"p99={_fmt(latency['p99'])} max={_fmt(latency['max'])}")
+
+    if report["stages"]:
+        print("\n各阶段时延（秒，由 /metrics 直方图估算）:")
+        print(f"  {'阶段':<48}{'次数':>6}{'p50':>10}{'p95':>10}{'p99':>10}")
+        for row in report["stages"]:
+            group = next(value for key, value in row.items() if key not in ("metric", "count", "p50", "p95", "p99"))
+            stage = f"{row['metric'].replace('storybook_', '').replace('_seconds', '')}[{group}]"
+            print(f"  {stage:<48}{row['count']:>6}{_fmt(row['p50']):>10}{_fmt(row['p95']):>10}{_fmt(row['p99']):>10}")
+    print("=" * 70)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="StoryBook API 压测")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="API 地址")
+    parser.add_argument("--rps", type=float, default=0.5, help="目标每秒请求数")
+    parser.add_argument("--duration", type=float, default=60, help="发压时长（秒）")
+    parser.add_argument("--prompt", default="一家五口三代同堂，在大平层房子里温馨的一天", help="漫画创意")
+    parser.add_argument("--timeout", type=float, default=None, help="单个请求的预算（秒），传给 API 的 timeout")
+    parser.add_argument("--tenant", default=None, help="X-Tenant-Id")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="最多同时在途的请求数")
+    parser.add_argument("--json", default=None, help="把报告写入 JSON 文件")
+    args = parser.parse_args()
+
+    load_test = LoadTest(
+        args.url, args.rps, args.duration, args.prompt,
+        timeout=args.timeout, tenant=args.tenant, max_in_flight=args.max_in_flight
+    )
+    report = load_test.run()
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 报告已保存到: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
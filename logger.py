@@ -0,0 +1,172 @@
+"""
+日志模块
+替代散落在各模块中的 print：
+- 分级：遵循 Config.log_level（LOG_LEVEL），提示词全文只在 DEBUG 级别输出
+- 非阻塞：业务线程只把日志记录放入队列（QueueHandler），由后台 QueueListener 线程格式化并写出
+- 惰性格式化：使用 logger.info("... %s", arg) 形式，被级别过滤掉的日志不会拼接字符串
+- 结构化：extra 中的字段和当前 trace_id 以 key=value（或 JSON）形式附加在消息后
+- 惰性初始化：导入模块和 get_logger() 不读取配置、不启动线程，第一条日志到达时才初始化
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+from typing import Optional
+
+from config import get_config
+
+
+# 所有模块的日志都挂在这个根 logger 下
+ROOT_LOGGER_NAME = "storybook"
+
+# LogRecord 自带的属性，其余属性视为 extra 中的结构化字段
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "trace_id"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+class TraceIdFilter(logging.Filter):
+    """为日志记录附加当前 trace_id（在业务线程中执行，读取当前上下文）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        from tracing import current_trace_id
+
+        record.trace_id = current_trace_id()
+        return True
+
+
+class BootstrapHandler(logging.Handler):
+    """初始化前挂在根 logger 上：第一条日志到达时初始化日志，再把这条记录交给正式的 handler"""
+
+    def emit(self, record: logging.LogRecord):
+        setup_logging()
+        root = logging.getLogger(ROOT_LOGGER_NAME)
+        if not root.isEnabledFor(record.levelno):
+            return
+        for handler in root.handlers:
+            if handler is not self:
+                handler.handle(record)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    不在业务线程中格式化：标准 QueueHandler.prepare 会先拼好消息再入队，
+    这里直接把原始记录（msg + args）交给后台线程，由 QueueListener 完成格式化
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class StructuredFormatter(logging.Formatter):
+    """文本格式：时间 级别 模块 消息 key=value ...；JSON 格式：每行一个对象"""
+
+    def __init__(self, json_output: bool = False):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s %(message)s")
+        self.json_output = json_output
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {key: value for key, value in vars(record).items() if key not in _RESERVED_ATTRS}
+        trace_id = getattr(record, "trace_id", "")
+
+        if self.json_output:
+            data = {
+                "time": self.formatTime(record),
+                "level": record.levelname,
+                "logger": record.name,
+                "message": record.getMessage(),
+                **fields
+            }
+            if trace_id:
+                data["trace_id"] = trace_id
+            if record.exc_info:
+                data["exception"] = self.formatException(record.exc_info)
+            return json.dumps(data, ensure_ascii=False, default=str)
+
+        line = super().format(record)
+        if trace_id:
+            fields["trace_id"] = trace_id
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+def setup_logging(level: Optional[str] = None):
+    """
+    初始化日志：根 logger 只挂一个 QueueHandler，后台线程负责写到 stdout
+
+    Args:
+        level: 日志级别（默认使用 Config.log_level）
+    """
+    global _listener
+
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        config = get_config()
+        root = logging.getLogger(ROOT_LOGGER_NAME)
+        root.setLevel((level or config.log_level).upper())
+        root.propagate = False
+        for handler in list(root.handlers):
+            if isinstance(handler, BootstrapHandler):
+                root.removeHandler(handler)
+
+        log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+        queue_handler = DeferredQueueHandler(log_queue)
+        queue_handler.addFilter(TraceIdFilter())
+        root.addHandler(queue_handler)
+
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(StructuredFormatter(json_output=config.log_format == "json"))
+
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """写出队列中剩余的日志并停止后台线程"""
+    global _listener
+
+    with _setup_lock:
+        listener = _listener
+        _listener = None
+    if listener is not None:
+        listener.stop()
+
+
+def reset_logging():
+    """
+    停止后台线程并恢复到未初始化状态（多进程部署时在 fork 前调用）
+
+    子进程中不存在父进程的后台线程，恢复后由第一条日志在子进程中重新初始化。
+    """
+    shutdown_logging()
+    root = logging.getLogger(ROOT_LOGGER_NAME)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(logging.DEBUG)
+    root.addHandler(BootstrapHandler())
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    获取模块 logger（不初始化日志，第一条日志到达时再初始化）
+
+    Args:
+        name: 模块名，如 "tools"，实际 logger 名为 storybook.tools
+    """
+    return logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}")
+
+
+# 初始化前不按级别过滤（级别在读取配置后才确定），由 BootstrapHandler 完成初始化
+_root = logging.getLogger(ROOT_LOGGER_NAME)
+_root.setLevel(logging.DEBUG)
+_root.propagate = False
+_root.addHandler(BootstrapHandler())
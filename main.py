@@ -4,11 +4,15 @@
 """
 
 import sys
-from cli import StoryBookCLI
 
 
-def run_demo():
-    """运行演示模式 - 自动创建漫画示例项目"""
+def run_demo(resume: bool = False):
+    """
+    运行演示模式 - 自动创建漫画示例项目
+
+    Args:
+        resume: 是否从上次未完成的检查点继续
+    """
     print("\n" + "=" * 60)
     print("🎨 演示模式：自动创建漫画示例项目")
     print("=" * 60)
@@ -36,7 +40,10 @@ def run_demo():
 
     # 运行漫画创作流程
     print("\n开始自动创作漫画...")
-    final_state = agent.run(project_name, comic_idea)
+    thread_id = StoryCreationAgent.resume_key(project_name, comic_idea) if resume else None
+    final_state = agent.run(project_name, comic_idea, thread_id=thread_id)
+    if agent.resumed:
+        print("已从上次未完成的检查点继续")
 
     # 显示摘要
     print("\n" + "=" * 60)
@@ -63,6 +70,8 @@ def run_demo():
 
 def run_interactive():
     """运行交互式 CLI 模式"""
+    from cli import StoryBookCLI
+
     cli = StoryBookCLI()
     cli.run()
 
@@ -73,6 +82,11 @@ def print_usage():
 使用方法:
     python main.py          # 启动交互式 CLI
     python main.py --demo   # 运行演示模式（自动创建示例项目）
+    python main.py --demo --resume
+                            # 演示模式，从上次未完成（崩溃或中断）的检查点继续
+    python main.py --batch prompts.jsonl [--output results.jsonl] [--concurrency 4]
+                            # 批量生成：多本绘本并发运行，结果逐条写入 JSONL，可续跑
+                            # （完整参数见 python main.py --batch --help）
     python main.py --help   # 显示此帮助信息
 
 项目结构:
@@ -80,6 +94,7 @@ def print_usage():
     memory.py       - Memory 系统（Working/Episodic/Semantic/Profile）
     tools.py        - 创作工具（大纲/角色/分段文本/提示词/文生图）
     cli.py          - CLI 交互界面
+    batch.py        - 批量生成（main.py --batch）
     main.py         - 主入口
 
 功能特性:
@@ -98,7 +113,11 @@ def main():
     if len(sys.argv) > 1:
         arg = sys.argv[1]
         if arg == "--demo":
-            run_demo()
+            run_demo(resume="--resume" in sys.argv[2:])
+        elif arg == "--batch":
+            from batch import run_batch
+
+            sys.exit(run_batch(sys.argv[2:]))
         elif arg == "--help" or arg == "-h":
             print_usage()
         else:
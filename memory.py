@@ -8,10 +8,33 @@ Memory 系统实现
 """
 
 import json
+import re
+import threading
 from typing import Dict, List, Any, Optional
 from datetime import datetime
 from pathlib import Path
 
+from tracing import start_span
+from logger import get_logger
+
+
+logger = get_logger("memory")
+
+# 项目名称用作文件名（memory_storage/<名称>.json、output/<名称>_result.json），
+# 不能包含路径分隔符、文件名中的非法字符和空白，也不能只由 . 组成（如 ..）
+UNSAFE_PROJECT_NAME = re.compile(r'[\\/:*?"<>|\s]+')
+
+
+def is_safe_project_name(name: str) -> bool:
+    """项目名称能否直接用作文件名"""
+    return bool(name) and not UNSAFE_PROJECT_NAME.search(name) and bool(name.strip("."))
+
+
+def sanitize_project_name(name: str) -> str:
+    """把项目名称中不能出现在文件名里的字符替换为 _"""
+    name = UNSAFE_PROJECT_NAME.sub("_", name)
+    return name if name.strip(".") else name.replace(".", "_")
+
 
 class WorkingMemory:
     """工作记忆 - 存储当前正在处理的临时信息"""
@@ -139,6 +162,8 @@ class MemorySystem:
         self.profile = ProfileMemory(project_name)
         self.storage_path = Path("memory_storage")
         self.storage_path.mkdir(exist_ok=True)
+        # 后台任务（如资源转存）也会更新并保存 Memory，读写时需持有此锁
+        self.lock = threading.RLock()
 
     def save_to_disk(self, filename: Optional[str] = None):
         """将所有记忆保存到磁盘"""
@@ -146,36 +171,38 @@ class MemorySystem:
             filename = f"{self.profile.get_profile('project_name')}.json"
 
         filepath = self.storage_path / filename
-        memory_data = {
-            "working": self.working.to_dict(),
-            "episodic": self.episodic.to_dict(),
-            "semantic": self.semantic.to_dict(),
-            "profile": self.profile.to_dict()
-        }
+        with start_span("memory.save", file=str(filepath)), self.lock:
+            memory_data = {
+                "working": self.working.to_dict(),
+                "episodic": self.episodic.to_dict(),
+                "semantic": self.semantic.to_dict(),
+                "profile": self.profile.to_dict()
+            }
 
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(memory_data, f, ensure_ascii=False, indent=2)
+            with open(filepath, 'w', encoding='utf-8') as f:
+                json.dump(memory_data, f, ensure_ascii=False, indent=2)
 
-        print(f"✓ Memory 已保存到: {filepath}")
+        logger.debug("Memory 已保存", extra={"path": str(filepath)})
 
     def load_from_disk(self, filename: str):
         """从磁盘加载记忆"""
         filepath = self.storage_path / filename
 
         if not filepath.exists():
-            print(f"✗ 文件不存在: {filepath}")
+            logger.warning("Memory 文件不存在", extra={"path": str(filepath)})
             return False
 
         with open(filepath, 'r', encoding='utf-8') as f:
             memory_data = json.load(f)
 
         # 恢复各个记忆模块
-        self.working.data = memory_data.get("working", {})
-        self.episodic.episodes = memory_data.get("episodic", {}).get("episodes", [])
-        self.semantic.knowledge = memory_data.get("semantic", {})
-        self.profile.profile = memory_data.get("profile", {})
+        with self.lock:
+            self.working.data = memory_data.get("working", {})
+            self.episodic.episodes = memory_data.get("episodic", {}).get("episodes", [])
+            self.semantic.knowledge = memory_data.get("semantic", {})
+            self.profile.profile = memory_data.get("profile", {})
 
-        print(f"✓ Memory 已从 {filepath} 加载")
+        logger.info("Memory 已加载", extra={"path": str(filepath)})
         return True
 
     def get_summary(self) -> str:
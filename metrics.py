@@ -0,0 +1,292 @@
+"""
+运行指标模块
+记录每个图节点、每次 LLM 调用（含 token 数）和每次文生图调用（排队等待 / 提供商耗时）的时延，
+聚合为直方图和计数器，并以 Prometheus 文本格式导出（见 APIController 的 /metrics）。
+
+不依赖 prometheus_client：指标数量很少，进程内聚合即可。
+"""
+
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from deadline import DeadlineExceeded
+from jobs import JobCancelled
+from tracing import start_span
+
+
+# 默认时延分桶（秒）：覆盖毫秒级节点到分钟级的整次生成
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    """格式化标签：{a="x",b="y"}"""
+    parts = [
+        '{}="{}"'.format(name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(labelnames, values)
+    ]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    """格式化数值（整数不带小数点）"""
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    """指标基类：按标签值分组保存样本"""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        """把标签字典转换为有序的标签值元组"""
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        """导出为 Prometheus 文本格式的行"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        """计数增加 amount"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        """当前计数"""
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Histogram(_Metric):
+    """累积分桶直方图"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每组标签：[各分桶计数..., +Inf 计数], 总和
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels):
+        """记录一次观测值"""
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-1] += 1
+            self._sums[key] += value
+
+    def count(self, **labels) -> int:
+        """观测次数"""
+        with self._lock:
+            counts = self._counts.get(self._key(labels))
+            return counts[-1] if counts else 0
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(counts), self._sums[key]) for key, counts in self._counts.items())
+
+        lines = []
+        for key, counts, total in items:
+            for bound, count in zip(self.buckets, counts):
+                le = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {count}")
+            inf = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf} {counts[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {counts[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric_class, name: str, *args, **kwargs):
+        """同名指标只创建一次"""
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """获取或创建计数器"""
+        return self._register(Counter, name, documentation, labelnames)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        """获取或创建直方图"""
+        return self._register(Histogram, name, documentation, labelnames, buckets)
+
+    def render(self) -> str:
+        """导出全部指标（Prometheus 文本格式）"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# 全局指标注册表
+_metrics_registry: Optional[MetricsRegistry] = None
+_metrics_registry_lock = threading.Lock()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """获取全局指标注册表（单例模式）"""
+    global _metrics_registry
+    with _metrics_registry_lock:
+        if _metrics_registry is None:
+            _metrics_registry = MetricsRegistry()
+        return _metrics_registry
+
+
+# ================= 流水线指标 =================
+REQUEST_DURATION = get_metrics_registry().histogram(
+    "storybook_request_duration_seconds", "API 请求总耗时", ["endpoint", "status"]
+)
+NODE_DURATION = get_metrics_registry().histogram(
+    "storybook_node_duration_seconds", "LangGraph 节点耗时", ["node", "status"]
+)
+NODE_ERRORS = get_metrics_registry().counter(
+    "storybook_node_errors_total", "节点内部捕获的错误次数", ["node"]
+)
+LLM_CALL_DURATION = get_metrics_registry().histogram(
+    "storybook_llm_call_duration_seconds", "单次 LLM 调用耗时", ["provider", "status"]
+)
+LLM_TOKENS = get_metrics_registry().counter(
+    "storybook_llm_tokens_total", "LLM 消耗的 token 数（提供商返回时记录）", ["provider", "kind"]
+)
+IMAGE_QUEUE_WAIT = get_metrics_registry().histogram(
+    "storybook_image_queue_wait_seconds", "图片任务在线程池中排队等待的时间", ["provider"]
+)
+IMAGE_CALL_DURATION = get_metrics_registry().histogram(
+    "storybook_image_call_duration_seconds", "单次文生图调用耗时（合并请求计一次）", ["provider", "status"]
+)
+
+
+def status_of(error: Optional[BaseException]) -> str:
+    """把异常归类为指标的 status 标签"""
+    if error is None:
+        return "ok"
+    if isinstance(error, JobCancelled):
+        return "cancelled"
+    if isinstance(error, DeadlineExceeded):
+        return "deadline"
+    return "error"
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels) -> Iterator[None]:
+    """计时上下文：结束时按 status（ok / error / cancelled / deadline）记录耗时"""
+    start = time.perf_counter()
+    error: Optional[BaseException] = None
+    try:
+        yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - start, status=status_of(error), **labels)
+
+
+def record_llm_usage(
+    provider: str,
+    prompt_tokens: Optional[int],
+    completion_tokens: Optional[int],
+    cached_tokens: Optional[int] = None,
+    cache_write_tokens: Optional[int] = None
+):
+    """
+    记录 LLM token 用量（提供商未返回时跳过）
+
+    kind="prompt" 为全部输入 token（含缓存部分）；kind="cached" 为其中命中提示词缓存的部分，
+    kind="cache_write" 为本次写入缓存的部分（Anthropic / 通义千问显式缓存）
+    """
+    if prompt_tokens:
+        LLM_TOKENS.inc(prompt_tokens, provider=provider, kind="prompt")
+    if completion_tokens:
+        LLM_TOKENS.inc(completion_tokens, provider=provider, kind="completion")
+    if cached_tokens:
+        LLM_TOKENS.inc(cached_tokens, provider=provider, kind="cached")
+    if cache_write_tokens:
+        LLM_TOKENS.inc(cache_write_tokens, provider=provider, kind="cache_write")
+
+
+def instrument_node(name: str, node: Callable[[dict], dict]) -> Callable[[dict], dict]:
+    """
+    包装 LangGraph 节点，记录节点耗时并为节点开启追踪 span
+
+    节点内部捕获异常并写入 error_message，因此以 error_message 是否变化判断节点是否出错。
+    """
+    @functools.wraps(node)
+    def wrapper(state: dict) -> dict:
+        before = state.get("error_message", "")
+        with start_span(f"node.{name}") as span, timed(NODE_DURATION, node=name):
+            result = node(state)
+            if result is not None and result.get("error_message", "") not in ("", before):
+                NODE_ERRORS.inc(node=name)
+                span.status = "error"
+                span.error = result["error_message"]
+        return result
+
+    return wrapper
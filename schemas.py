@@ -0,0 +1,85 @@
+"""
+LLM 输出的数据结构（pydantic）
+用于校验 LLM 返回的 JSON（json_utils.parse_llm_json）。
+非关键字段缺失时使用默认值，只有缺少关键字段（如画面 ID、提示词）的输出才判定为无法使用；
+模型多返回的字段原样保留。
+"""
+
+from typing import List, Optional
+
+from pydantic import BaseModel, ConfigDict, Field
+
+
+class LLMModel(BaseModel):
+    """LLM 输出模型的基类：保留额外字段"""
+
+    model_config = ConfigDict(extra="allow")
+
+
+class PanelPoint(LLMModel):
+    """大纲中的一格情节"""
+
+    panel_id: int
+    plot_point: str = ""
+
+
+class ComicOutline(LLMModel):
+    """漫画大纲（generate_comic_outline）"""
+
+    title: str = "未命名漫画"
+    theme: Optional[str] = ""
+    style: Optional[str] = ""
+    total_panels: int = 0
+    plot_outline: Optional[str] = ""
+    panel_breakdown: List[PanelPoint] = Field(min_length=1)
+
+
+class Character(LLMModel):
+    """角色设计（design_characters）"""
+
+    name: str
+    role: str = "配角"
+    appearance: Optional[str] = ""
+    personality: Optional[str] = ""
+    visual_tags: List[str] = []
+
+
+class StorySegment(LLMModel):
+    """一格的分段文本（generate_story_segments）"""
+
+    panel_id: int
+    scene_description: Optional[str] = ""
+    characters_in_scene: List[str] = []
+    dialogue: Optional[str] = ""
+    action: Optional[str] = ""
+    emotion: Optional[str] = ""
+    text: str
+
+
+class ImagePrompt(LLMModel):
+    """一格的文生图提示词（generate_image_prompts）"""
+
+    panel_id: int
+    positive_prompt: str = Field(min_length=1)
+    negative_prompt: Optional[str] = ""
+    style_tags: List[str] = []
+
+
+class StoryFrame(LLMModel):
+    """一帧画面（LLM_conversion）"""
+
+    frame_index: int
+    scene_description: str
+    visual_prompt: str = Field(min_length=1)
+
+
+class StoryData(LLMModel):
+    """一次性生成的 9 帧故事数据（LLM_conversion.generate_story_data）"""
+
+    character_settings: str = ""
+    main_story: str = ""
+    frames: List[StoryFrame] = Field(min_length=1)
+
+
+# 角色设计返回的是数组
+CharacterList = List[Character]
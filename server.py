@@ -0,0 +1,192 @@
+"""
+多进程 API 服务（pre-fork）
+APIController.py 直接运行时只有一个进程；生产环境使用本入口：
+
+1. 预加载：在父进程中导入 API 及其依赖、编译一次状态图、创建 LLM / 文生图客户端，
+   fork 出的 worker 共享这些只读内存页（写时复制），启动即是热的
+2. fork 前关闭父进程中的后台线程和数据库连接（日志、追踪导出、检查点、共享存储），
+   由各 worker 首次使用时重新创建
+3. 父进程创建监听 socket，所有 worker 在同一 socket 上 accept（由内核分发连接）
+4. 任务状态和结果缓存通过 shared_store（本地 SQLite）在 worker 之间共享；
+   worker 异常退出时由父进程重新拉起
+
+使用方法:
+    python server.py                          # worker 数取 API_WORKERS（0 表示 CPU 核数）
+    python server.py --workers 4 --port 8000
+
+注意：/metrics 为各 worker 进程内的指标，Prometheus 每次抓取只会看到其中一个 worker。
+"""
+
+import argparse
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict
+
+import uvicorn
+
+from config import get_config
+from logger import get_logger, reset_logging
+
+
+logger = get_logger("server")
+
+# worker 连续快速退出时的重启间隔（秒），避免启动即崩溃时空转
+RESTART_BACKOFF = 1.0
+
+
+def preload():
+    """
+    在父进程中完成 fork 前的准备：导入、编译状态图、创建提供商客户端
+
+    Returns:
+        FastAPI 应用
+    """
+    started = time.perf_counter()
+
+    from APIController import app
+    from agent_core import StoryCreationAgent
+    from memory import MemorySystem
+    from llm_client import get_llm_client
+    from image_client import get_image_client
+
+    # 编译一次状态图：导入 LangGraph 并预热其内部结构，worker 处理第一个请求时不再付出这部分开销
+    StoryCreationAgent(MemorySystem("__preload__"))
+
+    get_llm_client()
+    get_image_client()
+
+    logger.info("预加载完成", extra={"seconds": round(time.perf_counter() - started, 3)})
+    return app
+
+
+def prepare_fork():
+    """关闭父进程中不能跨 fork 使用的后台线程和连接"""
+    from checkpointer import close_checkpointer
+    from shared_store import close_shared_store
+    from tracing import get_span_exporter
+
+    get_span_exporter().shutdown()
+    close_checkpointer()
+    close_shared_store()
+    reset_logging()
+
+
+def run_worker(app, sock: socket.socket):
+    """worker 进程：在继承的 socket 上运行 uvicorn，退出时写出剩余日志和追踪数据"""
+    from logger import shutdown_logging
+    from tracing import get_span_exporter
+
+    # 恢复默认信号处理，由 uvicorn 接管 SIGINT / SIGTERM 实现平滑退出
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    exit_code = 0
+    try:
+        logger.info("worker 已启动", extra={"pid": os.getpid()})
+        server = uvicorn.Server(uvicorn.Config(app, log_level=get_config().log_level.lower()))
+        server.run(sockets=[sock])
+    except Exception as e:
+        logger.error("worker 异常退出: %s", e, exc_info=True)
+        exit_code = 1
+    finally:
+        get_span_exporter().shutdown()
+        shutdown_logging()
+        # 不执行父进程注册的 atexit 回调和上层调用栈
+        os._exit(exit_code)
+
+
+class Supervisor:
+    """父进程：fork worker、转发退出信号、重新拉起异常退出的 worker"""
+
+    def __init__(self, app, sock: socket.socket, workers: int):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.children: Dict[int, float] = {}  # pid -> 启动时间
+        self.stopping = False
+
+    def spawn(self):
+        """fork 一个 worker"""
+        prepare_fork()
+        pid = os.fork()
+        if pid == 0:
+            run_worker(self.app, self.sock)
+        self.children[pid] = time.monotonic()
+
+    def stop(self, signum, frame):
+        """收到退出信号：通知所有 worker 平滑退出"""
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        """启动全部 worker 并等待，直到收到退出信号且所有 worker 退出"""
+        for _ in range(self.workers):
+            self.spawn()
+
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        logger.info("已启动 %d 个 worker", self.workers, extra={"pids": list(self.children)})
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+
+            started = self.children.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+
+            logger.warning("worker 退出，重新启动", extra={"pid": pid, "exit_status": status})
+            if time.monotonic() - started < RESTART_BACKOFF:
+                time.sleep(RESTART_BACKOFF)
+            self.spawn()
+
+        logger.info("所有 worker 已退出")
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    """创建由所有 worker 共享的监听 socket"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def main():
+    parser = argparse.ArgumentParser(description="StoryBook API 多进程服务")
+    parser.add_argument("--host", default="0.0.0.0", help="监听地址")
+    parser.add_argument("--port", type=int, default=8000, help="监听端口")
+    parser.add_argument("--workers", type=int, default=None, help="worker 进程数（默认取 API_WORKERS，0 表示 CPU 核数）")
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        sys.exit("当前平台不支持 fork，请直接运行 python APIController.py")
+
+    config = get_config()
+    workers = args.workers if args.workers is not None else config.api_workers
+    workers = workers if workers > 0 else (os.cpu_count() or 1)
+    if workers > 1:
+        # 取消请求可能落在任意 worker 上，任务状态需要跨进程共享
+        config.shared_jobs_enabled = True
+
+    app = preload()
+    sock = bind_socket(args.host, args.port)
+    logger.info("开始监听", extra={"host": args.host, "port": args.port, "workers": workers})
+    Supervisor(app, sock, workers).run()
+
+
+if __name__ == "__main__":
+    main()
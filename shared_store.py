@@ -0,0 +1,264 @@
+"""
+进程间共享状态模块（本地 SQLite）
+多进程部署（server.py）时各 worker 通过同一个 SQLite 文件共享：
+- 结果缓存：相同输入的 LLM / 文生图结果（RESULT_CACHE_ENABLED），任一 worker 生成后其余 worker 直接命中
+- 任务状态：job_id 在所有 worker 中唯一；DELETE /api/jobs/{job_id} 落在任意 worker 都能生效，
+  由持有该任务的 worker 轮询到取消请求后取消
+
+使用 WAL 模式，读写互不阻塞。每个进程各自打开连接，fork 前需调用 close_shared_store()。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from config import get_config
+from logger import get_logger
+
+
+logger = get_logger("shared_store")
+
+# 已结束的任务记录保留时间（秒）
+JOB_RETENTION = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    reason TEXT NOT NULL DEFAULT '',
+    pid INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    finished_at REAL
+);
+"""
+
+
+def result_cache_key(*parts: Any) -> str:
+    """由调用参数计算缓存键（JSON 序列化后取 SHA-256）"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _pid_alive(pid: int) -> bool:
+    """进程是否仍在运行（worker 崩溃后其未结束的任务不再占用 job_id）"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedStore:
+    """基于 SQLite 的进程间共享存储"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = Path(path or get_config().shared_store_path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # isolation_level=None：自动提交，需要原子性的地方显式 BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        """关闭连接"""
+        with self._lock:
+            self._conn.close()
+
+    # ================= 结果缓存 =================
+
+    def cache_get(self, namespace: str, key: str) -> Optional[Any]:
+        """
+        读取缓存
+
+        Args:
+            namespace: 命名空间（如 "llm"、"story"、"image"）
+            key: 缓存键（result_cache_key() 的结果）
+
+        Returns:
+            缓存的值；不存在或已过期时返回 None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        if row is None:
+            return None
+
+        value, expires_at = row
+        if expires_at and expires_at < time.time():
+            with self._lock:
+                self._conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+            return None
+        return json.loads(value)
+
+    def cache_set(self, namespace: str, key: str, value: Any, ttl: float = 0):
+        """
+        写入缓存
+
+        Args:
+            namespace: 命名空间
+            key: 缓存键
+            value: 可 JSON 序列化的值
+            ttl: 有效期（秒），0 表示不过期
+        """
+        expires_at = time.time() + ttl if ttl > 0 else 0
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value, ensure_ascii=False), expires_at)
+            )
+
+    def purge_expired(self) -> int:
+        """删除已过期的缓存，返回删除的条数"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM cache WHERE expires_at > 0 AND expires_at < ?", (time.time(),)
+            )
+        return cursor.rowcount
+
+    # ================= 任务状态 =================
+
+    def job_register(self, job_id: str) -> bool:
+        """
+        登记由当前进程执行的任务
+
+        Returns:
+            False 表示 job_id 已被仍在运行的任务占用
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT pid FROM jobs WHERE job_id = ? AND finished_at IS NULL", (job_id,)
+                ).fetchone()
+                if row is not None and _pid_alive(row[0]):
+                    self._conn.execute("ROLLBACK")
+                    return False
+
+                self._conn.execute(
+                    "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                    (time.time() - JOB_RETENTION,)
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO jobs (job_id, status, reason, pid, created_at, finished_at) "
+                    "VALUES (?, 'running', '', ?, ?, NULL)",
+                    (job_id, os.getpid(), datetime.now().isoformat())
+                )
+                self._conn.execute("COMMIT")
+                return True
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def job_get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务状态（格式与 Job.to_dict() 相同），不存在时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id, status, created_at, reason FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"job_id": row[0], "status": row[1], "created_at": row[2], "reason": row[3]}
+
+    def job_request_cancel(self, job_id: str, reason: str) -> Optional[Dict[str, Any]]:
+        """
+        请求取消其他 worker 上运行的任务（由该 worker 轮询到后执行）
+
+        Returns:
+            任务状态；任务不存在或已结束时返回 None
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', reason = ? "
+                "WHERE job_id = ? AND status = 'running' AND finished_at IS NULL",
+                (reason, job_id)
+            )
+            if cursor.rowcount == 0:
+                row = self._conn.execute(
+                    "SELECT 1 FROM jobs WHERE job_id = ? AND finished_at IS NULL", (job_id,)
+                ).fetchone()
+                if row is None:
+                    return None
+        return self.job_get(job_id)
+
+    def job_cancel_reason(self, job_id: str) -> Optional[str]:
+        """任务被请求取消时返回原因，否则返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT reason FROM jobs WHERE job_id = ? AND status = 'cancelled'", (job_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def job_finish(self, job_id: str, status: str = "completed"):
+        """任务结束（已取消的任务保留 cancelled 状态）"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = CASE WHEN status = 'running' THEN ? ELSE status END, finished_at = ? "
+                "WHERE job_id = ? AND pid = ?",
+                (status, time.time(), job_id, os.getpid())
+            )
+
+
+# 全局共享存储实例（每个进程一个连接）
+_shared_store: Optional[SharedStore] = None
+_shared_store_lock = threading.Lock()
+
+
+def get_shared_store() -> SharedStore:
+    """获取全局共享存储（单例模式）"""
+    global _shared_store
+    with _shared_store_lock:
+        if _shared_store is None:
+            _shared_store = SharedStore()
+        return _shared_store
+
+
+def close_shared_store():
+    """关闭当前进程的连接（fork 前调用，子进程首次使用时重新打开）"""
+    global _shared_store
+    with _shared_store_lock:
+        store = _shared_store
+        _shared_store = None
+    if store is not None:
+        store.close()
+
+
+def cache_get(namespace: str, key: str) -> Optional[Any]:
+    """读取结果缓存（未启用或读取失败时返回 None，不影响生成）"""
+    if not get_config().result_cache_enabled:
+        return None
+    try:
+        value = get_shared_store().cache_get(namespace, key)
+    except Exception as e:
+        logger.warning("读取结果缓存失败: %s", e, extra={"namespace": namespace})
+        return None
+    if value is not None:
+        logger.debug("结果缓存命中", extra={"namespace": namespace, "key": key[:12]})
+    return value
+
+
+def cache_set(namespace: str, key: str, value: Any, ttl: float):
+    """写入结果缓存（未启用时忽略，写入失败只记录警告）"""
+    if not get_config().result_cache_enabled:
+        return
+    try:
+        get_shared_store().cache_set(namespace, key, value, ttl)
+    except Exception as e:
+        logger.warning("写入结果缓存失败: %s", e, extra={"namespace": namespace})
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 简单测试脚本 - 直接运行漫画生成 Agent
-用法: python3 test_agent.py "你的漫画创意"
+用法: python3 test_agent.py "你的漫画创意" [--resume]
 """
 
 import sys
@@ -9,12 +9,13 @@ from memory import MemorySystem
 from agent_core import StoryCreationAgent
 
 
-def test_agent(comic_idea: str):
+def test_agent(comic_idea: str, resume: bool = False):
     """
     测试漫画生成 Agent
 
     Args:
         comic_idea: 用户输入的漫画创意（一句话）
+        resume: 是否从同一创意上次未完成的检查点继续
     """
     print("=" * 70)
     print("🎨 测试漫画生成 Agent")
@@ -37,7 +38,10 @@ def test_agent(comic_idea: str):
 
     # 运行流程
     print("\n🚀 开始运行 Agent...\n")
-    result = agent.run(project_name, comic_idea)
+    thread_id = StoryCreationAgent.resume_key(project_name, comic_idea) if resume else None
+    result = agent.run(project_name, comic_idea, thread_id=thread_id)
+    if agent.resumed:
+        print("\n♻️  已从上次未完成的检查点继续")
 
     # 输出结果
     print("\n" + "=" * 70)
@@ -70,9 +74,11 @@ def test_agent(comic_idea: str):
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
+    args = [arg for arg in sys.argv[1:] if arg != "--resume"]
+    if not args:
         print("使用方法:")
-        print('  python3 test_agent.py "你的漫画创意"')
+        print('  python3 test_agent.py "你的漫画创意" [--resume]')
+        print("  --resume  从同一创意上次未完成（崩溃或中断）的检查点继续")
         print("\n示例:")
         print('  python3 test_agent.py "一只会魔法的小猫咪在森林里冒险"')
         print('  python3 test_agent.py "机器人学习人类情感"')
@@ -80,7 +86,7 @@ if __name__ == "__main__":
         sys.exit(1)
 
     # 获取用户输入的创意
-    comic_idea = sys.argv[1]
+    comic_idea = args[0]
 
     # 运行测试
-    test_agent(comic_idea)
+    test_agent(comic_idea, resume="--resume" in sys.argv[1:])
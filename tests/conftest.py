@@ -0,0 +1,48 @@
+"""
+测试公共配置
+在导入任何项目模块之前固定环境变量：模拟模式、关闭追踪导出 / 检查点 / 结果缓存 / 资源存储，
+运行时文件（用量、共享存储）写入临时目录，不受开发者本地 .env 和环境变量影响。
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+_RUNTIME_DIR = tempfile.mkdtemp(prefix="storybook-tests-")
+
+TEST_ENV = {
+    "USE_MOCK_MODE": "true",
+    "LOG_LEVEL": "WARNING",
+    "TRACE_EXPORTER": "none",
+    "CHECKPOINT_ENABLED": "false",
+    "RESULT_CACHE_ENABLED": "false",
+    "ASSET_STORE_ENABLED": "false",
+    "COMPOSER_ENABLED": "false",
+    "ACCOUNTING_PATH": os.path.join(_RUNTIME_DIR, "usage.json"),
+    "SHARED_STORE_PATH": os.path.join(_RUNTIME_DIR, "shared.sqlite"),
+    "CHECKPOINT_PATH": os.path.join(_RUNTIME_DIR, "checkpoints.sqlite"),
+    "TENANT_BUDGET": "0",
+    "TENANT_BUDGETS": "",
+}
+os.environ.update(TEST_ENV)
+
+
+@pytest.fixture
+def config(monkeypatch):
+    """全局配置；用 monkeypatch.setattr 修改的字段在测试结束后恢复"""
+    from config import get_config
+
+    return get_config()
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """切换到临时目录（Memory、output 等按相对路径写入的文件不落在仓库中）"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
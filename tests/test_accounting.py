@@ -0,0 +1,72 @@
+"""用量与成本核算：成本估算、租户预算和跨实例持久化"""
+
+import pytest
+
+import accounting
+from accounting import AccountingStore, BudgetExceeded, Usage, llm_cost, record_llm_call, track_usage
+
+
+@pytest.fixture
+def prices(config, monkeypatch):
+    monkeypatch.setattr(config, "llm_price_input", 1.0)
+    monkeypatch.setattr(config, "llm_price_output", 2.0)
+    monkeypatch.setattr(config, "llm_price_cached_input", 0.25)
+    return config
+
+
+@pytest.fixture
+def store(tmp_path, config, monkeypatch):
+    """使用临时文件的全局用量存储"""
+    monkeypatch.setattr(config, "tenant_budget", 0.0)
+    monkeypatch.setattr(config, "tenant_budgets", {"small": 1.0})
+    instance = AccountingStore(str(tmp_path / "usage.json"))
+    monkeypatch.setattr(accounting, "_accounting_store", instance)
+    return instance
+
+
+def test_llm_cost_prices_cached_tokens_and_reports_savings(prices):
+    cost = llm_cost("openai", 1_000_000, 1_000_000, cached_tokens=400_000)
+    assert cost["cost"] == pytest.approx(0.6 + 0.1 + 2.0)
+    assert cost["saved_cost"] == pytest.approx(0.3)
+    assert llm_cost("mock", 1_000_000, 1_000_000) == {"cost": 0.0, "saved_cost": 0.0}
+
+
+def test_track_usage_accumulates_to_tenant_and_project(prices, store):
+    with track_usage("small", "p1"):
+        record_llm_call("openai", "m", 100_000, 100_000)
+    usage = store.tenant_usage("small")
+    assert usage["llm_calls"] == 1
+    assert usage["cost"] == pytest.approx(0.3)
+    assert usage["remaining"] == pytest.approx(0.7)
+    assert store.project_usage("p1")["input_tokens"] == 100_000
+
+
+def test_budget_is_enforced_including_running_cost(prices, store):
+    store.add("small", "p1", Usage(cost=0.8))
+    store.check_budget("small")
+    with pytest.raises(BudgetExceeded, match="small"):
+        store.check_budget("small", "生成图片", pending_cost=0.2)
+    # 未配置预算的租户不受限
+    store.add("other", "p2", Usage(cost=100.0))
+    store.check_budget("other")
+
+
+def test_ledger_check_budget_stops_a_run_mid_way(prices, store):
+    store.add("small", "p1", Usage(cost=0.9))
+    with track_usage("small", "p1") as ledger:
+        record_llm_call("openai", "m", 0, 100_000)
+        with pytest.raises(BudgetExceeded):
+            ledger.check_budget("下一节点")
+
+
+def test_usage_persists_across_store_instances(store):
+    store.add("default", "p1", Usage(images=3, cost=0.42))
+    reopened = AccountingStore(str(store.path))
+    assert reopened.tenant_usage("default")["images"] == 3
+    assert reopened.project_usage("p1")["cost"] == pytest.approx(0.42)
+
+
+def test_corrupt_file_starts_from_zero(tmp_path):
+    path = tmp_path / "usage.json"
+    path.write_text("{not json", encoding="utf-8")
+    assert AccountingStore(str(path)).tenant_usage("default")["cost"] == 0
@@ -0,0 +1,103 @@
+"""API：流程中途截止时间已到、任务取消或预算用完时返回对应的错误码，不覆盖已保存的结果；拒绝不能用作文件名的项目名称"""
+
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import agent_core
+
+
+@pytest.fixture
+def client(workdir):
+    from APIController import app
+
+    return TestClient(app)
+
+
+@pytest.fixture
+def saved_result(workdir):
+    """此前一次成功运行保存的结果"""
+    path = workdir / "output" / "测试漫画_result.json"
+    path.parent.mkdir()
+    path.write_text(json.dumps([{"word": "旧结果", "url": "/assets/old.png"}], ensure_ascii=False), encoding="utf-8")
+    return path
+
+
+def test_deadline_expiring_mid_run_returns_504(client, saved_result, monkeypatch):
+    generate_frames = agent_core.generate_frames_from_llm
+    reached = []
+
+    def slow_frames(*args, deadline=None, **kwargs):
+        result = generate_frames(*args, deadline=deadline, **kwargs)
+        time.sleep(0.3)
+        return result
+
+    def images(*args, **kwargs):
+        reached.append(1)
+        return []
+
+    monkeypatch.setattr(agent_core, "generate_frames_from_llm", slow_frames)
+    monkeypatch.setattr(agent_core, "generate_images_from_prompts", images)
+
+    response = client.post("/api/generate_storybook", json={"prompt": "一只猫", "timeout": 0.2})
+
+    assert response.status_code == 504
+    assert "截止时间" in response.json()["detail"]
+    assert response.headers["X-Job-Id"]
+    assert reached == []  # 截止时间到后不再调度后续节点
+    assert json.loads(saved_result.read_text(encoding="utf-8"))[0]["word"] == "旧结果"
+
+
+def test_panels_abandoned_at_deadline_return_504(client, saved_result, monkeypatch):
+    def abandoned(prompts, *args, deadline=None, **kwargs):
+        time.sleep(max(0.0, deadline.remaining()))
+        return [{"panel_id": p["panel_id"], "image_url": "", "status": "cancelled", "error": "请求截止时间已到"} for p in prompts]
+
+    monkeypatch.setattr(agent_core, "generate_images_from_prompts", abandoned)
+
+    response = client.post("/api/generate_storybook", json={"prompt": "一只猫", "timeout": 1.5})
+
+    assert response.status_code == 504
+    assert json.loads(saved_result.read_text(encoding="utf-8"))[0]["word"] == "旧结果"
+
+
+def test_budget_exhausted_mid_run_returns_402(client, saved_result, config, monkeypatch, tmp_path):
+    import accounting
+    from accounting import AccountingStore, record_llm_call
+
+    monkeypatch.setattr(config, "llm_price_input", 1.0)
+    monkeypatch.setattr(config, "llm_price_output", 1.0)
+    monkeypatch.setattr(config, "tenant_budgets", {"small": 1.0})
+    monkeypatch.setattr(accounting, "_accounting_store", AccountingStore(str(tmp_path / "usage.json")))
+
+    generate_frames = agent_core.generate_frames_from_llm
+
+    def costly_frames(*args, **kwargs):
+        # 预算检查在运行前通过，这次调用把预算用完
+        record_llm_call("openai", "m", 1_000_000, 1_000_000)
+        return generate_frames(*args, **kwargs)
+
+    monkeypatch.setattr(agent_core, "generate_frames_from_llm", costly_frames)
+
+    response = client.post("/api/generate_storybook", json={"prompt": "一只猫"}, headers={"X-Tenant-Id": "small"})
+
+    assert response.status_code == 402
+    assert json.loads(saved_result.read_text(encoding="utf-8"))[0]["word"] == "旧结果"
+
+
+@pytest.mark.parametrize("name", ["../../x", "..", "a/b", "a\\b", "a b", "C:x"])
+def test_unsafe_project_name_is_rejected(client, name, monkeypatch):
+    ran = []
+    monkeypatch.setattr(agent_core.StoryCreationAgent, "run", lambda *a, **k: ran.append(1) or [])
+
+    response = client.post("/api/generate_storybook", json={"prompt": "一只猫", "project_name": name})
+
+    assert response.status_code == 422
+    assert ran == []
+
+
+def test_unsafe_project_name_in_path_is_rejected(client):
+    assert client.get("/api/projects/..%5Cx/assets").status_code == 400
+    assert client.post("/api/projects/a:b/panels/regenerate", json={"panel_ids": [1]}).status_code == 400
@@ -0,0 +1,106 @@
+"""
+后台转存后的稳定地址测试：结果文件改写、项目结果重建
+"""
+
+import json
+
+import pytest
+
+import agent_core
+from agent_core import StoryCreationAgent, project_result
+from memory import MemorySystem
+
+
+SEGMENTS = [{"panel_id": 1, "text": "第一格"}, {"panel_id": 2, "text": "第二格"}]
+IMAGES = [
+    {"panel_id": 1, "status": "generated", "image_url": "https://provider/1.png?expires=1"},
+    {"panel_id": 2, "status": "generated", "image_url": "https://provider/2.png?expires=1"},
+]
+ASSETS = {1: {"url": "/assets/aa.png"}, 2: {"url": "/assets/bb.png"}}
+
+
+class FakePipeline:
+    """记录后台任务，由测试决定何时完成"""
+
+    def __init__(self):
+        self.pending = []
+
+    def submit(self, images, on_complete=None):
+        self.pending.append(lambda: on_complete({img["panel_id"]: ASSETS[img["panel_id"]] for img in images}))
+
+    def finish(self):
+        for complete in self.pending:
+            complete()
+
+
+@pytest.fixture
+def pipeline(config, workdir, monkeypatch):
+    monkeypatch.setattr(config, "use_mock_mode", False)
+    monkeypatch.setattr(config, "asset_store_enabled", True)
+    monkeypatch.setattr(config, "asset_store_blocking", False)
+    monkeypatch.setattr(config, "composer_enabled", False)
+    fake = FakePipeline()
+    monkeypatch.setattr(agent_core, "get_asset_pipeline", lambda: fake)
+    return fake
+
+
+def run_store_assets(agent):
+    state = {"project_name": "转存", "story_segments": SEGMENTS, "images": IMAGES, "assets": {}, "completed_steps": []}
+    return agent._format_result(agent.store_assets_node(state))
+
+
+def read_result_file():
+    with open("output/转存_result.json", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_saved_result_is_rewritten_after_background_store(pipeline):
+    from APIController import ResultFile
+
+    result_file = ResultFile("转存")
+    agent = StoryCreationAgent(MemorySystem("转存"), on_assets_stored=result_file.assets_stored)
+
+    returned = result_file.save(run_store_assets(agent))
+    assert [item["url"] for item in returned] == [img["image_url"] for img in IMAGES]
+
+    pipeline.finish()
+    assert read_result_file() == [
+        {"word": "第一格", "url": "/assets/aa.png"},
+        {"word": "第二格", "url": "/assets/bb.png"},
+    ]
+
+
+def test_store_finishing_before_save_returns_stable_urls(pipeline):
+    from APIController import ResultFile
+
+    result_file = ResultFile("转存")
+    agent = StoryCreationAgent(MemorySystem("转存"), on_assets_stored=result_file.assets_stored)
+
+    result = run_store_assets(agent)
+    pipeline.finish()
+
+    assert [item["url"] for item in result_file.save(result)] == ["/assets/aa.png", "/assets/bb.png"]
+    assert read_result_file()[0]["url"] == "/assets/aa.png"
+
+
+def test_project_result_reports_pending_panels(pipeline):
+    memory = MemorySystem("转存")
+    agent = StoryCreationAgent(memory)
+    memory.semantic.update_knowledge("story_segments", SEGMENTS)
+    memory.semantic.update_knowledge("images", IMAGES)
+    run_store_assets(agent)
+
+    loaded = MemorySystem("转存")
+    memory.save_to_disk()
+    assert loaded.load_from_disk("转存.json")
+    assert project_result(loaded)["pending"] == [1, 2]
+
+    pipeline.finish()  # 转存结果写入 Memory 并落盘（键变成字符串）
+    assert loaded.load_from_disk("转存.json")
+    assert project_result(loaded) == {
+        "result": [
+            {"word": "第一格", "url": "/assets/aa.png"},
+            {"word": "第二格", "url": "/assets/bb.png"},
+        ],
+        "pending": [],
+    }
@@ -0,0 +1,117 @@
+"""
+批量生成测试：状态判定（completed / partial / failed）与续跑
+"""
+
+import json
+
+import agent_core
+from batch import BatchRunner, completed_ids, outcome, read_items, run_batch
+
+
+def write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def read_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+ITEM = {"id": "cat", "prompt": "一只会魔法的小猫咪在森林里冒险", "project_name": "batch_cat"}
+
+
+def test_outcome():
+    full = [{"word": "a", "url": "u1"}, {"word": "b", "url": "u2"}]
+    half = [{"word": "a", "url": "u1"}, {"word": "b", "url": ""}]
+    empty = [{"word": "a", "url": ""}, {"word": "b", "url": ""}]
+
+    assert outcome(full)["status"] == "completed"
+    assert outcome(full, "生成图片失败: 截止时间已到")["status"] == "partial"
+    assert outcome(half) == {"status": "partial", "result": half, "error": "第 2 格未生成图片"}
+    assert outcome(empty, "截止时间已到")["status"] == "failed"
+    assert outcome([]) == {"status": "failed", "result": [], "error": "未生成任何画面"}
+
+
+def test_failed_images_are_not_completed(config, workdir, monkeypatch):
+    monkeypatch.setattr(config, "image_retry_attempts", 0)
+
+    def half_failed(prompts, *args, **kwargs):
+        return [
+            {"panel_id": p["panel_id"], "status": "generated" if p["panel_id"] <= 5 else "failed",
+             "image_url": f"https://mock/{p['panel_id']}.png" if p["panel_id"] <= 5 else ""}
+            for p in prompts
+        ]
+
+    monkeypatch.setattr(agent_core, "generate_images_from_prompts", half_failed)
+    record = BatchRunner(str(workdir / "out.jsonl")).run_one(ITEM)
+
+    assert record["status"] == "partial"
+    assert record["error"] == "第 6, 7, 8, 9 格未生成图片"
+    assert len(record["result"]) == 9
+
+
+def test_expired_deadline_is_failed(workdir):
+    runner = BatchRunner(str(workdir / "out.jsonl"), timeout=0.001)
+    summary = runner.run([ITEM])
+
+    record, = read_jsonl(workdir / "out.jsonl")
+    assert record["status"] == "failed"
+    assert record["error"]
+    assert summary["failed"] == 1 and summary["completed"] == 0
+
+
+def test_completed_ids_only_skips_completed(workdir):
+    output = workdir / "out.jsonl"
+    write_jsonl(output, [
+        {"id": "a", "status": "completed"},
+        {"id": "b", "status": "partial"},
+        {"id": "c", "status": "failed"},
+        {"id": "d", "status": "failed"},
+        {"id": "d", "status": "completed"},  # 同一 id 以最后一行为准
+        {"id": "a", "status": "partial"},
+    ])
+    with open(output, "a", encoding="utf-8") as f:
+        f.write('{"id": "e", "sta')  # 进程被强制结束时不完整的最后一行
+
+    assert completed_ids(str(output)) == {"d"}
+
+
+def test_run_batch_resumes_incomplete_items(workdir, monkeypatch, capsys):
+    prompts = workdir / "prompts.jsonl"
+    output = workdir / "results.jsonl"
+    write_jsonl(prompts, [
+        {"id": "done", "prompt": "机器人学习人类情感"},
+        {"id": "partial", "prompt": "少年发现了时间旅行的秘密"},
+        {"id": "new", "prompt": "一只会魔法的小猫咪在森林里冒险"},
+    ])
+    write_jsonl(output, [
+        {"id": "done", "status": "completed", "result": []},
+        {"id": "partial", "status": "partial", "result": []},
+    ])
+
+    ran = []
+    run_one = BatchRunner.run_one
+    monkeypatch.setattr(BatchRunner, "run_one", lambda self, item: ran.append(item["id"]) or run_one(self, item))
+
+    assert run_batch([str(prompts), "--output", str(output), "--concurrency", "2"]) == 0
+    assert sorted(ran) == ["new", "partial"]
+    assert completed_ids(str(output)) == {"done", "partial", "new"}
+    assert "部分完成: 0" in capsys.readouterr().out
+
+    # 全部完成后再次运行不再生成
+    ran.clear()
+    assert run_batch([str(prompts), "--output", str(output)]) == 0
+    assert ran == []
+
+
+def test_read_items_sanitizes_project_names(workdir):
+    path = workdir / "prompts.jsonl"
+    write_jsonl(path, [
+        {"id": "a", "prompt": "p", "project_name": "../../etc/x"},
+        {"id": "b", "prompt": "p", "project_name": ".."},
+        {"id": "c", "prompt": "p"},
+    ])
+
+    assert [item["project_name"] for item in read_items(str(path))] == [".._.._etc_x", "__", "batch_c"]
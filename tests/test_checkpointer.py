@@ -0,0 +1,164 @@
+"""
+流程检查点测试：续跑键、一次性运行的清理、过期 thread 的清理
+"""
+
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import agent_core
+import checkpointer
+from agent_core import StoryCreationAgent
+from memory import MemorySystem
+
+
+class Crash(BaseException):
+    """模拟进程崩溃（节点只捕获 Exception，BaseException 会中断整个流程）"""
+
+
+@pytest.fixture
+def saver(config, workdir, monkeypatch):
+    """启用检查点，数据库写入临时目录；测试结束后关闭连接"""
+    monkeypatch.setattr(config, "checkpoint_enabled", True)
+    monkeypatch.setattr(config, "checkpoint_path", str(workdir / "ck.sqlite"))
+    checkpointer.close_checkpointer()
+    saver = checkpointer.get_checkpointer()
+    if saver is None:
+        pytest.skip("未安装 langgraph-checkpoint-sqlite")
+    yield saver
+    checkpointer.close_checkpointer()
+
+
+def thread_ids(saver):
+    with saver.lock:
+        return {row[0] for row in saver.conn.execute("SELECT DISTINCT thread_id FROM checkpoints")}
+
+
+def crash_on_images(monkeypatch):
+    """让文生图步骤崩溃，返回恢复原函数的回调"""
+    original = agent_core.generate_images_from_prompts
+
+    def crash(*args, **kwargs):
+        raise Crash()
+
+    monkeypatch.setattr(agent_core, "generate_images_from_prompts", crash)
+    return lambda: monkeypatch.setattr(agent_core, "generate_images_from_prompts", original)
+
+
+def test_resume_key_continues_from_last_node(saver, monkeypatch):
+    recover = crash_on_images(monkeypatch)
+    agent = StoryCreationAgent(MemorySystem("续跑"))
+    key = StoryCreationAgent.resume_key("续跑", "一只猫")
+    with pytest.raises(Crash):
+        agent.run("续跑", "一只猫", thread_id=key)
+    assert thread_ids(saver) == {key}
+
+    recover()
+    frames = []
+    monkeypatch.setattr(agent_core, "generate_frames_from_llm", lambda *a, **k: frames.append(1))
+
+    agent = StoryCreationAgent(MemorySystem("续跑"))
+    result = agent.run("续跑", "一只猫", thread_id=key)
+
+    assert agent.resumed
+    assert frames == []  # LLM 步骤没有重新执行
+    assert len(result) == 9
+    assert thread_ids(saver) == set()
+
+
+def test_run_without_key_never_resumes_and_cleans_up(saver, monkeypatch):
+    recover = crash_on_images(monkeypatch)
+    agent = StoryCreationAgent(MemorySystem("一次性"))
+    with pytest.raises(Crash):
+        agent.run("一次性", "一只猫")
+    assert thread_ids(saver) == set()
+
+    recover()
+    agent = StoryCreationAgent(MemorySystem("一次性"))
+    assert len(agent.run("一次性", "一只猫")) == 9
+    assert not agent.resumed
+
+
+def test_purge_expired_threads(saver, monkeypatch):
+    crash_on_images(monkeypatch)
+    for key in ("old", "fresh"):
+        with pytest.raises(Crash):
+            StoryCreationAgent(MemorySystem(key)).run(key, "一只猫", thread_id=key)
+
+    # 把 old 的最后一个检查点改成两天前
+    latest = saver.get_tuple({"configurable": {"thread_id": "old"}})
+    latest.checkpoint["ts"] = (datetime.now(timezone.utc) - timedelta(days=2)).isoformat()
+    saver.put(latest.config, latest.checkpoint, latest.metadata, {})
+
+    assert checkpointer.purge_expired_threads(saver, ttl=86400) == 1
+    assert thread_ids(saver) == {"fresh"}
+
+
+def test_purge_runs_when_checkpointer_opens(saver, config, monkeypatch):
+    purged = []
+    monkeypatch.setattr(checkpointer, "purge_expired_threads", lambda saver, ttl: purged.append(ttl))
+    monkeypatch.setattr(config, "checkpoint_ttl", 60.0)
+
+    checkpointer.close_checkpointer()
+    checkpointer.get_checkpointer()
+    checkpointer.get_checkpointer()  # 间隔未到，不重复清理
+    assert purged == [60.0]
+
+    monkeypatch.setattr(checkpointer, "_last_purge", time.monotonic() - checkpointer.PURGE_INTERVAL)
+    checkpointer.get_checkpointer()
+    assert purged == [60.0, 60.0]
+
+
+def test_run_aborted_by_deadline_keeps_checkpoint(saver, monkeypatch):
+    from deadline import Deadline, DeadlineExceeded
+
+    generate_frames = agent_core.generate_frames_from_llm
+
+    def slow_frames(*args, **kwargs):
+        result = generate_frames(*args, **kwargs)
+        time.sleep(0.2)
+        return result
+
+    monkeypatch.setattr(agent_core, "generate_frames_from_llm", slow_frames)
+    key = StoryCreationAgent.resume_key("超时", "一只猫")
+    with pytest.raises(DeadlineExceeded):
+        StoryCreationAgent(MemorySystem("超时")).run("超时", "一只猫", deadline=Deadline.after(0.1), thread_id=key)
+    assert thread_ids(saver) == {key}
+
+    frames = []
+    monkeypatch.setattr(agent_core, "generate_frames_from_llm", lambda *a, **k: frames.append(1))
+    agent = StoryCreationAgent(MemorySystem("超时"))
+    assert len(agent.run("超时", "一只猫", thread_id=key)) == 9
+    assert agent.resumed and frames == []
+    assert thread_ids(saver) == set()
+
+
+def test_resume_redraws_only_abandoned_panels(saver, monkeypatch):
+    from deadline import Deadline, DeadlineExceeded
+
+    def partly_abandoned(prompts, *args, deadline=None, **kwargs):
+        time.sleep(max(0.0, deadline.remaining()))
+        return [
+            {"panel_id": p["panel_id"], "status": "generated" if p["panel_id"] <= 3 else "cancelled",
+             "image_url": f"https://img/{p['panel_id']}.png" if p["panel_id"] <= 3 else ""}
+            for p in prompts
+        ]
+
+    monkeypatch.setattr(agent_core, "generate_images_from_prompts", partly_abandoned)
+    key = StoryCreationAgent.resume_key("补画", "一只猫")
+    with pytest.raises(DeadlineExceeded):
+        StoryCreationAgent(MemorySystem("补画")).run("补画", "一只猫", deadline=Deadline.after(1.5), thread_id=key)
+
+    redrawn = []
+
+    def redraw(prompts, *args, **kwargs):
+        redrawn.extend(p["panel_id"] for p in prompts)
+        return [{"panel_id": p["panel_id"], "status": "generated", "image_url": f"https://img/{p['panel_id']}.png"}
+                for p in prompts]
+
+    monkeypatch.setattr(agent_core, "generate_images_from_prompts", redraw)
+    result = StoryCreationAgent(MemorySystem("补画")).run("补画", "一只猫", thread_id=key)
+
+    assert redrawn == [4, 5, 6, 7, 8, 9]
+    assert all(item["url"] for item in result)
@@ -0,0 +1,36 @@
+"""Deadline：剩余预算、超时计算和到期后的放弃"""
+
+import time
+
+import pytest
+
+from deadline import Deadline, DeadlineExceeded
+
+
+def test_unlimited_deadline_uses_default_timeout():
+    deadline = Deadline.after(0)
+    assert deadline.remaining() is None
+    assert not deadline.expired()
+    assert deadline.timeout(60) == 60
+    assert deadline.to_state() == 0.0
+
+
+def test_timeout_is_capped_by_remaining_budget():
+    deadline = Deadline.after(5)
+    assert 0 < deadline.timeout(60) <= 5
+    assert deadline.timeout(1) == 1
+
+
+def test_expired_deadline_raises_with_stage():
+    deadline = Deadline(time.time() - 1)
+    assert deadline.expired()
+    assert deadline.remaining() == 0.0
+    with pytest.raises(DeadlineExceeded, match="LLM 调用"):
+        deadline.timeout(60, "LLM 调用")
+
+
+def test_state_round_trip():
+    deadline = Deadline.after(30)
+    restored = Deadline.from_state({"deadline": deadline.to_state()})
+    assert restored.expires_at == deadline.expires_at
+    assert Deadline.from_state({"deadline": 0.0}).remaining() is None
@@ -0,0 +1,144 @@
+"""
+文生图客户端测试：Stability 响应流式解码落盘，本地图片在画面结果中的处理
+"""
+
+import base64
+import json
+from pathlib import Path
+
+import pytest
+
+import image_client
+import tools
+from image_client import ImageClient
+
+
+PNG = [b"\x89PNG first image", b"\x89PNG second image"]
+
+
+class FakeResponse:
+    """按小块返回 Stability 风格的 JSON 响应体"""
+
+    def __init__(self, images):
+        self.body = json.dumps({
+            "artifacts": [{"base64": base64.b64encode(data).decode("ascii"), "finishReason": "SUCCESS"} for data in images]
+        }).encode()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.body), 7):
+            yield self.body[start:start + 7]
+
+
+@pytest.fixture
+def stability(config, workdir, monkeypatch):
+    """不走模拟模式的 Stability 客户端，HTTP 响应由 FakeResponse 提供"""
+    calls = []
+
+    def fake_post(cancel_token, url, **kwargs):
+        calls.append(kwargs)
+        return FakeResponse(PNG[:kwargs["json"]["samples"]])
+
+    monkeypatch.setattr(image_client, "http_post", fake_post)
+    monkeypatch.setattr(config, "image_save_dir", str(workdir / "images"))
+    monkeypatch.setattr(config, "use_mock_mode", False)
+    client = ImageClient()
+    client.provider = "stability"
+    client.image_config = dict(client.image_config, api_key="k", base_url="http://stability", model="sdxl")
+    client.calls = calls
+    monkeypatch.setattr(tools, "get_image_client", lambda: client)
+    return client
+
+
+PROMPTS = [{"panel_id": panel_id, "positive_prompt": "一只猫", "negative_prompt": ""} for panel_id in (1, 2)]
+
+
+@pytest.mark.parametrize("keep_base64", [True, False])
+def test_stability_without_save_path_streams_to_save_dir(stability, workdir, keep_base64):
+    stability.image_config["keep_base64"] = keep_base64
+
+    result = stability._generate_provider("一只猫", None, 5, None, n=2)
+
+    assert stability.calls[0]["stream"] is True
+    assert [Path(path).parent for path in result["local_paths"]] == [workdir / "images"] * 2
+    assert [Path(path).read_bytes() for path in result["local_paths"]] == PNG
+    assert result["local_path"] == result["local_paths"][0]
+    if keep_base64:
+        assert base64.b64decode(result["images_base64"][1]) == PNG[1]
+    else:
+        assert "base64" not in result and "images_base64" not in result
+
+
+def test_stability_calls_write_distinct_files(stability):
+    first = stability._generate_provider("一只猫", None, 5, None, n=1)
+    second = stability._generate_provider("一只猫", None, 5, None, n=1)
+
+    assert first["local_path"] != second["local_path"]
+    assert Path(second["local_path"]).read_bytes() == PNG[0]
+
+
+def test_batched_stability_panels_keep_local_files(stability):
+    images = tools.generate_images_from_prompts(PROMPTS, {})
+
+    assert len(stability.calls) == 1  # 两格提示词相同，合并为一次请求
+    assert [img["status"] for img in images] == ["generated", "generated"]
+    assert [Path(img["local_path"]).read_bytes() for img in images] == PNG
+    assert all(img["image_url"] == img["local_path"] for img in images)
+
+
+def test_panel_without_image_is_failed(stability, monkeypatch):
+    monkeypatch.setattr(stability, "generate_group", lambda group, *args, **kwargs: {
+        prompt_data["panel_id"]: {"provider": "stability", "prompt": prompt_data["positive_prompt"]}
+        for prompt_data in group
+    })
+
+    images = tools.generate_images_from_prompts(PROMPTS, {})
+
+    assert [(img["status"], img["image_url"], img["error"]) for img in images] == [("failed", "", "提供商未返回图片")] * 2
+
+
+class TaskResponse:
+    def __init__(self, output):
+        self.output = output
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"output": self.output}
+
+
+def test_task_whose_status_query_keeps_failing_is_given_up(config, monkeypatch):
+    queries = []
+    cancelled = []
+
+    def fake_get(cancel_token, url, **kwargs):
+        task_id = url.rsplit("/", 1)[-1]
+        queries.append(task_id)
+        if task_id == "broken":
+            raise ConnectionError("connection reset")
+        status = "SUCCEEDED" if queries.count(task_id) >= 3 else "RUNNING"
+        return TaskResponse({"task_status": status, "results": [{"url": "https://img/ok.png"}]})
+
+    monkeypatch.setattr(image_client, "http_get", fake_get)
+    client = ImageClient()
+    client.provider = "dashscope"
+    client.image_config = dict(client.image_config, api_key="k", base_url="http://dashscope",
+                               poll_interval=0.001, poll_max_interval=0.001, poll_max_failures=4)
+    monkeypatch.setattr(client, "_cancel_dashscope_task", cancelled.append)
+
+    results = client.poll_dashscope_tasks({1: "ok", 2: "broken"})  # 没有截止时间
+
+    assert results[1]["url"] == "https://img/ok.png"
+    assert queries.count("broken") == 4
+    assert results[2]["task_id"] == "broken" and "连续 4 次查询任务状态失败" in results[2]["error"]
+    assert "cancelled" not in results[2]
+    assert cancelled == ["broken"]
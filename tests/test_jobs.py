@@ -0,0 +1,62 @@
+"""CancelToken / JobRegistry：取消信号、会话关闭和任务登记"""
+
+import threading
+
+import pytest
+
+from jobs import CancelToken, JobCancelled, JobExists, JobRegistry, http_get
+
+
+def test_cancel_sets_reason_and_check_raises():
+    token = CancelToken()
+    token.check("开始")
+    token.cancel("客户端已断开")
+    assert token.cancelled
+    with pytest.raises(JobCancelled, match="客户端已断开，放弃: 生成图片"):
+        token.check("生成图片")
+
+
+def test_cancel_is_idempotent_and_keeps_first_reason():
+    token = CancelToken()
+    token.cancel("第一次")
+    token.cancel("第二次")
+    assert token.reason == "第一次"
+
+
+def test_cancel_closes_registered_sessions():
+    token = CancelToken()
+    session = token.session()
+    closed = threading.Event()
+    session.close = closed.set
+    token.cancel()
+    assert closed.is_set()
+
+
+def test_session_after_cancel_raises():
+    token = CancelToken()
+    token.cancel("已取消")
+    with pytest.raises(JobCancelled):
+        token.session()
+
+
+def test_http_request_on_cancelled_token_does_not_send():
+    token = CancelToken()
+    token.cancel("已取消")
+    with pytest.raises(JobCancelled):
+        http_get(token, "http://127.0.0.1:9/never")
+
+
+def test_registry_rejects_duplicate_running_job_and_cancels():
+    registry = JobRegistry()
+    job = registry.create("job-1")
+    with pytest.raises(JobExists):
+        registry.create("job-1")
+
+    assert registry.cancel("job-1", "用户取消")["status"] == "cancelled"
+    assert registry.token_for("job-1").cancelled
+
+    registry.finish("job-1")
+    assert registry.get("job-1") is None
+    assert registry.cancel("job-1") is None
+    # 结束后可以重新使用同一 job_id
+    assert registry.create("job-1") is not job
@@ -0,0 +1,74 @@
+"""LLM 输出的 JSON 提取、校验和修复"""
+
+import pytest
+
+from json_utils import JSONExtractionError, extract_json, parse_llm_json, response_json_schema, schema_name
+from schemas import CharacterList, ComicOutline, ImagePrompt, StoryData
+
+
+@pytest.mark.parametrize("text", [
+    '{"a": 1, "b": [1, 2]}',
+    '```json\n{"a": 1, "b": [1, 2]}\n```',
+    '好的，结果如下：\n{"a": 1, "b": [1, 2],}\n以上。',
+    '说明 {不是 JSON} 然后 {"a": 1, "b": [1, 2,]}',
+])
+def test_extract_json_tolerates_fences_prose_and_trailing_commas(text):
+    assert extract_json(text, dict) == {"a": 1, "b": [1, 2]}
+
+
+def test_extract_json_keeps_braces_and_commas_inside_strings():
+    assert extract_json('前言 {"s": "a,}] {x", "n": 1}') == {"s": "a,}] {x", "n": 1}
+
+
+def test_extract_json_unwraps_single_list_field():
+    assert extract_json('{"characters": [{"name": "A"}]}', list) == [{"name": "A"}]
+
+
+@pytest.mark.parametrize("text", ["", "没有 JSON", '{"a": 1', "[1, 2"])
+def test_extract_json_raises_when_nothing_parses(text):
+    with pytest.raises(JSONExtractionError):
+        extract_json(text, dict)
+
+
+def test_parse_llm_json_validates_and_fills_defaults():
+    data = parse_llm_json('{"panel_breakdown": [{"panel_id": 1}], "extra": "保留"}', ComicOutline)
+    assert data["title"] == "未命名漫画"
+    assert data["panel_breakdown"][0]["plot_point"] == ""
+    assert data["extra"] == "保留"
+
+
+def test_parse_llm_json_rejects_missing_key_fields_and_keeps_raw_text():
+    text = '{"panel_id": 1, "positive_prompt": ""}'
+    with pytest.raises(JSONExtractionError) as info:
+        parse_llm_json(text, ImagePrompt)
+    assert info.value.text == text
+
+
+def test_repair_is_called_once_with_error_and_schema():
+    prompts = []
+
+    def repair(prompt):
+        prompts.append(prompt)
+        return '[{"name": "小猫"}]'
+
+    assert parse_llm_json("角色：小猫", CharacterList, repair=repair) == [{
+        "name": "小猫", "role": "配角", "appearance": "", "personality": "", "visual_tags": []
+    }]
+    assert len(prompts) == 1
+    assert "JSON Schema" in prompts[0] and "角色：小猫" in prompts[0]
+
+
+def test_failed_repair_raises_with_original_text():
+    calls = []
+    with pytest.raises(JSONExtractionError) as info:
+        parse_llm_json("垃圾输出", StoryData, repair=lambda prompt: calls.append(prompt) or "仍然不是 JSON")
+    assert len(calls) == 1
+    assert info.value.text == "垃圾输出"
+
+
+def test_response_schema_is_object_rooted_without_refs():
+    schema = response_json_schema(CharacterList)
+    assert schema["type"] == "object" and "items" in schema["properties"]
+    assert "$ref" not in str(schema) and "$defs" not in str(schema)
+    assert schema_name(CharacterList) == "CharacterList"
+    assert "$ref" not in str(response_json_schema(StoryData))
@@ -0,0 +1,73 @@
+"""LLMClient：模拟模式的结构化输出与真实调用走同一条解析路径；提供商失败时不回退到模拟数据"""
+
+from typing import List
+
+import pytest
+
+import llm_client
+import tools
+from LLM_conversion import generate_story_data
+from llm_client import LLMClient
+from schemas import CharacterList, ComicOutline, ImagePrompt, StoryData, StorySegment
+
+
+@pytest.fixture
+def client(monkeypatch):
+    instance = LLMClient()
+    # 跳过模拟延迟
+    monkeypatch.setattr(llm_client.time, "sleep", lambda seconds: None)
+    monkeypatch.setattr(llm_client, "_llm_client", instance)
+    return instance
+
+
+@pytest.mark.parametrize("schema", [ComicOutline, CharacterList, StoryData])
+def test_mock_mode_returns_schema_valid_data(client, schema):
+    assert client.generate("任意提示词", schema=schema)
+
+
+def test_mock_panels_follow_prompt_ids(client):
+    assert client.generate("【当前格子】\n格子ID: 4\n情节点: x", schema=StorySegment)["panel_id"] == 4
+    prompts = client.generate("格子ID 2\n...\n\n格子ID 5\n...", schema=List[ImagePrompt])
+    assert [item["panel_id"] for item in prompts] == [2, 5]
+
+
+def test_mock_mode_story_data_is_nine_real_frames(client):
+    data = generate_story_data("一只小猫的冒险")
+    assert [frame["frame_index"] for frame in data["frames"]] == list(range(1, 10))
+    assert all(frame["visual_prompt"] for frame in data["frames"])
+
+    result = tools.generate_frames_from_llm("一只小猫的冒险", {})
+    assert result["total_frames"] == 9
+    # 不是 generate_frames_from_llm 出错时的默认占位帧
+    assert result["segments"][0]["text"] != "第1帧场景"
+
+
+def test_mock_outline_and_characters_are_not_fallbacks(client, config):
+    outline = tools.generate_comic_outline("时间旅行", {})
+    assert outline["title"] == "时光旅行者"
+    assert len(outline["panel_breakdown"]) == config.comic_panels
+    assert [c["name"] for c in tools.design_characters(outline, {})] == ["林晨", "林祖父"]
+
+
+def test_provider_failure_is_raised_not_mocked(client, config, monkeypatch):
+    monkeypatch.setattr(config, "use_mock_mode", False)
+
+    def broken(*args, **kwargs):
+        raise ConnectionError("provider down")
+
+    monkeypatch.setattr(client, "_call_provider", broken)
+    with pytest.raises(ConnectionError):
+        client.generate("提示词", schema=StoryData)
+    with pytest.raises(ConnectionError):
+        client.generate("提示词")
+
+
+def test_story_data_reports_provider_failure(client, config, monkeypatch):
+    monkeypatch.setattr(config, "use_mock_mode", False)
+
+    def broken(*args, **kwargs):
+        raise ConnectionError("provider down")
+
+    monkeypatch.setattr(client, "_call_provider", broken)
+    with pytest.raises(Exception, match="模型调用失败"):
+        generate_story_data("一只猫")
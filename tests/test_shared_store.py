@@ -0,0 +1,105 @@
+"""共享存储（SQLite）：结果缓存和跨进程任务状态；文生图结果缓存在重绘 / 重试时不复用旧图片"""
+
+import itertools
+import time
+
+import pytest
+
+import image_client
+import shared_store
+import tools
+from shared_store import SharedStore, result_cache_key
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """使用临时文件的全局共享存储"""
+    instance = SharedStore(str(tmp_path / "shared.sqlite"))
+    monkeypatch.setattr(shared_store, "_shared_store", instance)
+    yield instance
+    instance.close()
+
+
+def test_cache_round_trip_and_expiry(store):
+    key = result_cache_key("openai", "gpt", 0.7, "prompt")
+    assert store.cache_get("llm", key) is None
+
+    store.cache_set("llm", key, {"text": "结果"})
+    assert store.cache_get("llm", key) == {"text": "结果"}
+    assert store.cache_get("image", key) is None
+
+    store.cache_set("image", key, "url", ttl=0.01)
+    time.sleep(0.02)
+    assert store.cache_get("image", key) is None
+
+
+def test_cache_key_depends_on_every_part():
+    assert result_cache_key("a", 1, None) == result_cache_key("a", 1, None)
+    assert result_cache_key("a", 1, None) != result_cache_key("a", 1, "")
+    assert result_cache_key("a", 1) != result_cache_key("a", 2)
+
+
+def test_job_registration_and_cancel_across_connections(store, tmp_path):
+    other_worker = SharedStore(str(store.path))
+    try:
+        assert store.job_register("job-1")
+        # 本进程仍在运行的任务：其他连接无法重复登记
+        assert not other_worker.job_register("job-1")
+
+        assert other_worker.job_request_cancel("job-1", "用户取消")["status"] == "cancelled"
+        assert store.job_cancel_reason("job-1") == "用户取消"
+
+        store.job_finish("job-1")
+        assert other_worker.job_request_cancel("job-1", "再次取消") is None
+        assert other_worker.job_register("job-1")
+    finally:
+        other_worker.close()
+
+
+def test_job_held_by_dead_process_can_be_taken_over(store):
+    store.job_register("job-2")
+    with store._lock:
+        store._conn.execute("UPDATE jobs SET pid = ? WHERE job_id = ?", (2 ** 22 + 12345, "job-2"))
+    assert store.job_register("job-2")
+
+
+@pytest.fixture
+def real_image_client(store, config, monkeypatch):
+    """启用结果缓存的真实模式文生图客户端，提供商调用每次返回新的 URL"""
+    monkeypatch.setattr(config, "use_mock_mode", False)
+    monkeypatch.setattr(config, "result_cache_enabled", True)
+    monkeypatch.setattr(config, "image_provider", "dalle")
+    client = image_client.ImageClient()
+    counter = itertools.count(1)
+    calls = []
+
+    def fake_dalle(prompt, save_path=None, timeout=None, cancel_token=None, n=None):
+        calls.append(prompt)
+        return {"url": f"https://provider.example.com/{next(counter)}.png", "provider": "dalle", "prompt": prompt}
+
+    monkeypatch.setattr(client, "_generate_dalle_http", fake_dalle)
+    monkeypatch.setattr(image_client, "_image_client", client)
+    client.calls = calls
+    return client
+
+
+def test_image_cache_is_reused_unless_bypassed(real_image_client):
+    first = real_image_client.generate("a cat")
+    assert real_image_client.generate("a cat")["url"] == first["url"]
+
+    fresh = real_image_client.generate("a cat", use_cache=False)
+    assert fresh["url"] != first["url"]
+    # 新结果写回缓存，之后的普通调用拿到最新的图片
+    assert real_image_client.generate("a cat")["url"] == fresh["url"]
+    assert len(real_image_client.calls) == 2
+
+
+def test_regenerate_path_returns_fresh_images(real_image_client):
+    prompts = [{"panel_id": 1, "positive_prompt": "a cat"}, {"panel_id": 2, "positive_prompt": "a dog"}]
+    original = tools.generate_images_from_prompts(prompts, {})
+    cached = tools.generate_images_from_prompts(prompts, {})
+    assert [img["image_url"] for img in cached] == [img["image_url"] for img in original]
+
+    regenerated = tools.generate_images_from_prompts(prompts[:1], {}, use_cache=False)
+    assert regenerated[0]["status"] == "generated"
+    assert regenerated[0]["image_url"] != original[0]["image_url"]
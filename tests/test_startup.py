@@ -0,0 +1,54 @@
+"""
+启动耗时：在新解释器中导入各入口，检查不会提前加载重型依赖，且导入时间在预算之内
+（benchmark.py 的 startup.* 用例给出详细数值，这里只做回归断言）
+"""
+
+import json
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+# 入口 -> (在新解释器中执行的代码, 导入时间预算（秒）, 不应加载的模块)
+ENTRIES = {
+    "main_help": (
+        "import sys, runpy; sys.argv = ['main.py', '--help']; runpy.run_path('main.py', run_name='__main__')",
+        0.5,
+        ("langgraph", "pydantic", "requests", "openai"),
+    ),
+    "cli": ("import cli", 1.0, ("langgraph", "pydantic", "openai")),
+    "tools": ("import tools", 1.0, ("langgraph", "pydantic", "openai")),
+    "api": ("import APIController", 3.0, ("langgraph", "openai")),
+}
+
+PROBE = """
+import contextlib, io, json, sys, time
+started = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    exec({code!r})
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+
+def _measure(code: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(code=code)],
+        cwd=ROOT, capture_output=True, text=True, check=True, timeout=60
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize("name", sorted(ENTRIES))
+def test_entry_import_is_lazy_and_within_budget(name):
+    code, budget, forbidden = ENTRIES[name]
+    # 取 3 次中的最小值，排除机器抖动
+    runs = [_measure(code) for _ in range(3)]
+
+    loaded = {module.split(".")[0] for module in runs[0]["modules"]}
+    assert not loaded & set(forbidden), f"{name} 导入时加载了 {sorted(loaded & set(forbidden))}"
+
+    best = min(run["seconds"] for run in runs)
+    assert best < budget, f"{name} 导入耗时 {best:.3f}s，超过预算 {budget}s"
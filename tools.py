@@ -5,22 +5,39 @@
 - design_characters: 设计角色形象
 - generate_story_segments: 生成分段故事文本
 - generate_image_prompts: 生成图片提示词
+- generate_segments_and_prompts: 流水线生成分段文本和提示词（每格文本完成即生成该格提示词）
 - generate_images_from_prompts: 文生图
 """
 
-from typing import Dict, Any, List, Optional
+from typing import Callable, Dict, Any, List, Optional, Tuple
 import time
-import json
 import os
 import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from llm_client import get_llm_client
 from image_client import get_image_client
 from config import get_config
+from deadline import Deadline, DeadlineExceeded, as_deadline
+from jobs import CancelToken, JobCancelled
+from logger import get_logger
+from metrics import IMAGE_QUEUE_WAIT
+from tracing import start_span, wrap_context
 from LLM_conversion import generate_story_data
+from json_utils import JSONExtractionError
 
 
-def call_llm(prompt: str, task_type: str, system_prompt: Optional[str] = None) -> str:
+logger = get_logger("tools")
+
+
+def call_llm(
+    prompt: str,
+    task_type: str,
+    system_prompt: Optional[str] = None,
+    deadline: Optional[Deadline] = None,
+    cancel_token: Optional[CancelToken] = None,
+    schema: Any = None,
+    cache_prefix: Optional[str] = None
+) -> Any:
     """
     调用语言模型生成内容
     根据配置自动选择使用真实 API 还是模拟模式
@@ -29,25 +46,47 @@ def call_llm(prompt: str, task_type: str, system_prompt: Optional[str] = None) -
         prompt: 用户提示词
         task_type: 任务类型（用于日志显示）
         system_prompt: 系统提示词
+        deadline: 请求截止时间（可选），只使用剩余预算
+        cancel_token: 取消信号（可选），已取消时不再发起调用
+        schema: 输出格式（可选），schemas.py 中的模型；指定时使用提供商的结构化输出并返回校验后的数据
+        cache_prefix: 可缓存的上下文（可选），多次调用间相同的内容（如大纲、角色信息），发送在 prompt 之前
 
     Returns:
-        生成的文本内容
+        生成的文本内容；指定 schema 时为校验后的数据
+
+    Raises:
+        DeadlineExceeded: 调用前截止时间已到
+        JobCancelled: 任务已被取消
+        JSONExtractionError: 指定了 schema，但输出不符合格式
     """
     config = get_config()
+    as_deadline(deadline).check(task_type)
+    if cancel_token:
+        cancel_token.check(task_type)
 
-    print(f"\n[{'模拟' if config.use_mock_mode else 'LLM'} 调用] {task_type}...")
+    logger.info("%s 调用: %s", "模拟" if config.use_mock_mode else "LLM", task_type)
+    logger.debug("提示词: %s", prompt, extra={"task": task_type})
 
     llm_client = get_llm_client()
-    return llm_client.generate(prompt, system_prompt)
+    return llm_client.generate(
+        prompt, system_prompt, deadline=deadline, cancel_token=cancel_token, schema=schema, cache_prefix=cache_prefix
+    )
 
 
-def generate_comic_outline(user_input: str, memory_context: Dict[str, Any]) -> Dict[str, Any]:
+def generate_comic_outline(
+    user_input: str,
+    memory_context: Dict[str, Any],
+    deadline: Optional[Deadline] = None,
+    cancel_token: Optional[CancelToken] = None
+) -> Dict[str, Any]:
     """
     生成漫画大纲
 
     Args:
         user_input: 用户输入的漫画创意
         memory_context: 来自 Memory 的上下文信息
+        deadline: 请求截止时间（可选）
+        cancel_token: 取消信号（可选）
 
     Returns:
         包含漫画大纲的字典
@@ -87,32 +126,25 @@ def generate_comic_outline(user_input: str, memory_context: Dict[str, Any]) -> D
 
 请直接返回JSON，不要包含其他文字说明。"""
 
-    outline_text = call_llm(prompt, "生成漫画大纲")
+    # schemas 依赖 pydantic，首次调用时才导入（不拖慢 tools 的导入）
+    from schemas import ComicOutline
 
-    # 尝试解析 JSON
+    # 结构化输出（必要时由客户端请求修复一次），仍不符合格式时使用默认结构
     try:
-        # 清理可能的markdown代码块标记
-        cleaned_text = outline_text.strip()
-        if cleaned_text.startswith("```json"):
-            cleaned_text = cleaned_text[7:]
-        if cleaned_text.startswith("```"):
-            cleaned_text = cleaned_text[3:]
-        if cleaned_text.endswith("```"):
-            cleaned_text = cleaned_text[:-3]
-        cleaned_text = cleaned_text.strip()
-
-        outline_data = json.loads(cleaned_text)
+        outline_data = call_llm(
+            prompt, "生成漫画大纲", deadline=deadline, cancel_token=cancel_token, schema=ComicOutline
+        )
         outline_data["created_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
         return outline_data
-    except json.JSONDecodeError:
+    except JSONExtractionError as e:
         # 如果解析失败，返回默认结构（使用配置的格数）
-        print("⚠️ LLM 返回格式不是有效 JSON，使用默认结构")
+        logger.warning("LLM 返回格式不是有效 JSON，使用默认结构: %s", e)
         return {
             "title": "未命名漫画",
             "theme": "冒险",
             "style": comic_style,
             "total_panels": comic_panels,
-            "plot_outline": outline_text[:200],
+            "plot_outline": e.text[:200],
             "panel_breakdown": [
                 {"panel_id": i, "plot_point": f"第{i}格情节"}
                 for i in range(1, comic_panels + 1)
@@ -121,13 +153,20 @@ def generate_comic_outline(user_input: str, memory_context: Dict[str, Any]) -> D
         }
 
 
-def design_characters(comic_outline: Dict[str, Any], memory_context: Dict[str, Any]) -> List[Dict[str, Any]]:
+def design_characters(
+    comic_outline: Dict[str, Any],
+    memory_context: Dict[str, Any],
+    deadline: Optional[Deadline] = None,
+    cancel_token: Optional[CancelToken] = None
+) -> List[Dict[str, Any]]:
     """
     设计角色形象
 
     Args:
         comic_outline: 漫画大纲
         memory_context: Memory 上下文
+        deadline: 请求截止时间（可选）
+        cancel_token: 取消信号（可选）
 
     Returns:
         角色列表
@@ -158,23 +197,13 @@ def design_characters(comic_outline: Dict[str, Any], memory_context: Dict[str, A
 
 请直接返回JSON数组，不要包含其他文字说明。"""
 
-    characters_text = call_llm(prompt, "设计角色形象")
+    from schemas import CharacterList
 
-    # 尝试解析 JSON
+    # 结构化输出（必要时由客户端请求修复一次），仍不符合格式时使用默认角色
     try:
-        cleaned_text = characters_text.strip()
-        if cleaned_text.startswith("```json"):
-            cleaned_text = cleaned_text[7:]
-        if cleaned_text.startswith("```"):
-            cleaned_text = cleaned_text[3:]
-        if cleaned_text.endswith("```"):
-            cleaned_text = cleaned_text[:-3]
-        cleaned_text = cleaned_text.strip()
-
-        characters = json.loads(cleaned_text)
-        return characters
-    except json.JSONDecodeError:
-        print("⚠️ LLM 返回格式不是有效 JSON，使用默认角色")
+        return call_llm(prompt, "设计角色形象", deadline=deadline, cancel_token=cancel_token, schema=CharacterList)
+    except JSONExtractionError as e:
+        logger.warning("LLM 返回格式不是有效 JSON，使用默认角色: %s", e)
         return [
             {
                 "name": "主角",
@@ -186,48 +215,27 @@ def design_characters(comic_outline: Dict[str, Any], memory_context: Dict[str, A
         ]
 
 
-def generate_story_segments(
-    comic_outline: Dict[str, Any],
-    characters: List[Dict[str, Any]],
-    memory_context: Dict[str, Any]
-) -> List[Dict[str, Any]]:
+def _map_panels(worker: Callable[[Any], Any], items: List[Any]) -> List[Any]:
     """
-    生成分段故事文本
+    并发执行每一格的 LLM 调用，结果顺序与 items 相同（即 panel_id 顺序）
 
-    Args:
-        comic_outline: 漫画大纲
-        characters: 角色列表
-        memory_context: Memory 上下文
-
-    Returns:
-        分段文本列表
+    线程数不超过 MAX_CONCURRENT_REQUESTS；同时发往提供商的请求数另由 LLM 客户端的全局并发上限约束。
+    任一格抛出异常（如 JobCancelled、DeadlineExceeded）时放弃尚未开始的格子并向上抛出。
     """
-    segments = []
-    panel_breakdown = comic_outline.get("panel_breakdown", [])
-
-    # 构建角色信息字符串
-    char_info = "\n".join([
-        f"- {c['name']} ({c['role']}): {c.get('appearance', '')}"
-        for c in characters
-    ])
-
-    # 为每个格子生成详细文本
-    for panel_data in panel_breakdown:
-        panel_id = panel_data.get("panel_id")
-        plot_point = panel_data.get("plot_point")
-
-        prompt = f"""你是一个专业的漫画分镜师。请为这一格漫画生成详细文本。
+    if len(items) <= 1:
+        return [worker(item) for item in items]
 
-【漫画信息】
-标题: {comic_outline.get('title')}
-总体情节: {comic_outline.get('plot_outline')}
+    max_workers = max(1, min(get_config().max_concurrent_requests, len(items)))
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="panel-llm")
+    try:
+        futures = [executor.submit(wrap_context(worker), item) for item in items]
+        return [future.result() for future in futures]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
-【角色信息】
-{char_info}
 
-【当前格子】
-格子ID: {panel_id}
-情节点: {plot_point}
+# 逐格 / 批量生成的系统提示词：不含任何与本次故事相关的内容，保证每次请求的开头完全相同（可被提示词缓存命中）
+SEGMENT_SYSTEM_PROMPT = """你是一个专业的漫画分镜师。请根据漫画信息和角色信息，为指定的一格漫画生成详细文本。
 
 【要求】
 - 生成这一格的详细场景描述
@@ -236,164 +244,469 @@ def generate_story_segments(
 - 字数控制在 50-100 字
 
 【输出格式 - 请严格按照此JSON格式输出】
-{{
-  "panel_id": {panel_id},
+{
+  "panel_id": 格子ID,
   "scene_description": "场景描述",
   "characters_in_scene": ["角色1", "角色2"],
   "dialogue": "对话内容（如果有）",
   "action": "动作描述",
   "emotion": "情绪氛围",
   "text": "完整文本描述（50-100字）"
-}}
+}
 
 请直接返回JSON，不要包含其他文字说明。"""
 
-        segment_text = call_llm(prompt, f"生成第{panel_id}格文本")
+SEGMENTS_BATCH_SYSTEM_PROMPT = """你是一个专业的漫画分镜师。请根据漫画信息和角色信息，为格子列表中的每一格漫画生成详细文本。
+
+【要求】
+- 为每一格生成详细的场景描述
+- 包含角色动作、对话、表情
+- 描述要适合漫画表现（视觉化）
+- 每格字数控制在 50-100 字
+- 每个格子输出一个对象，panel_id 与格子ID一一对应，不要遗漏或合并格子
+
+【输出格式 - 请严格按照此JSON格式输出】
+[
+  {
+    "panel_id": 格子ID,
+    "scene_description": "场景描述",
+    "characters_in_scene": ["角色1", "角色2"],
+    "dialogue": "对话内容（如果有）",
+    "action": "动作描述",
+    "emotion": "情绪氛围",
+    "text": "完整文本描述（50-100字）"
+  }
+]
+
+请直接返回JSON数组，不要包含其他文字说明。"""
+
+IMAGE_PROMPT_SYSTEM_PROMPT = """你是一个专业的 AI 绘画提示词工程师。请将指定格子的漫画文本转换为文生图 prompt。
+
+【要求】
+- 生成适合 Stable Diffusion / DALL-E 的英文 prompt
+- 包含场景、角色、动作、光线、构图
+- 如果有角色，必须包含该角色的详细外观描述（确保一致性）
+- 指定漫画风格（manga style, comic style, etc.）
+- 添加质量标签（high quality, detailed, etc.）
+
+【输出格式 - 请严格按照此JSON格式输出】
+{
+  "panel_id": 格子ID,
+  "positive_prompt": "详细的正向提示词",
+  "negative_prompt": "负向提示词（要避免的元素）",
+  "style_tags": ["manga", "high_quality"]
+}
+
+请直接返回JSON，不要包含其他文字说明。"""
+
+IMAGE_PROMPTS_BATCH_SYSTEM_PROMPT = """你是一个专业的 AI 绘画提示词工程师。请将格子列表中每一格的漫画文本转换为文生图 prompt。
+
+【要求】
+- 为每一格生成适合 Stable Diffusion / DALL-E 的英文 prompt
+- 包含场景、角色、动作、光线、构图
+- 格子中出现的角色，必须包含该角色的详细外观描述（确保一致性）
+- 指定漫画风格（manga style, comic style, etc.）
+- 添加质量标签（high quality, detailed, etc.）
+- 每个格子输出一个对象，panel_id 与格子ID一一对应，不要遗漏或合并格子
+
+【输出格式 - 请严格按照此JSON格式输出】
+[
+  {
+    "panel_id": 格子ID,
+    "positive_prompt": "详细的正向提示词",
+    "negative_prompt": "负向提示词（要避免的元素）",
+    "style_tags": ["manga", "high_quality"]
+  }
+]
+
+请直接返回JSON数组，不要包含其他文字说明。"""
+
+
+def _character_info(characters: List[Dict[str, Any]]) -> str:
+    """构建角色信息字符串（分段文本的提示词使用）"""
+    return "\n".join([
+        f"- {c['name']} ({c['role']}): {c.get('appearance', '')}"
+        for c in characters
+    ])
+
+
+def _story_context(comic_outline: Dict[str, Any], characters: List[Dict[str, Any]]) -> str:
+    """各格共用的故事上下文（大纲 + 角色信息），作为可缓存的前缀发送"""
+    return f"""【漫画信息】
+标题: {comic_outline.get('title')}
+总体情节: {comic_outline.get('plot_outline')}
+
+【角色信息】
+{_character_info(characters)}"""
+
+
+def _generate_segment(
+    panel_data: Dict[str, Any],
+    story_context: str,
+    deadline: Optional[Deadline] = None,
+    cancel_token: Optional[CancelToken] = None
+) -> Dict[str, Any]:
+    """生成一格的详细文本（story_context 为各格共用的可缓存前缀）"""
+    panel_id = panel_data.get("panel_id")
+    plot_point = panel_data.get("plot_point")
+
+    prompt = f"""【当前格子】
+格子ID: {panel_id}
+情节点: {plot_point}"""
 
-        # 尝试解析 JSON
+    from schemas import StorySegment
+
+    # 结构化输出（必要时由客户端请求修复一次），仍不符合格式时使用默认结构
+    try:
+        return call_llm(
+            prompt, f"生成第{panel_id}格文本", system_prompt=SEGMENT_SYSTEM_PROMPT,
+            deadline=deadline, cancel_token=cancel_token, schema=StorySegment, cache_prefix=story_context
+        )
+    except JSONExtractionError as e:
+        logger.warning("文本解析失败，使用默认结构: %s", e, extra={"panel_id": panel_id})
+        return {
+            "panel_id": panel_id,
+            "scene_description": plot_point,
+            "characters_in_scene": [],
+            "dialogue": "",
+            "action": plot_point,
+            "emotion": "中性",
+            "text": e.text[:100]
+        }
+
+
+def _generate_image_prompt(
+    segment: Dict[str, Any],
+    comic_style: str,
+    char_appearances: Dict[str, str],
+    deadline: Optional[Deadline] = None,
+    cancel_token: Optional[CancelToken] = None
+) -> Dict[str, Any]:
+    """生成一格的文生图提示词"""
+    panel_id = segment.get("panel_id")
+    scene_desc = segment.get("scene_description", "")
+    chars_in_scene = segment.get("characters_in_scene", [])
+    action = segment.get("action", "")
+    text = segment.get("text", "")
+
+    # 构建角色外观描述（如果有角色在场景中）
+    char_desc_parts = []
+    for char_name in chars_in_scene:
+        if char_name in char_appearances:
+            char_desc_parts.append(f"{char_name}: {char_appearances[char_name]}")
+
+    char_descriptions = ", ".join(char_desc_parts) if char_desc_parts else "no characters"
+
+    prompt = f"""【当前格子信息】
+格子ID: {panel_id}
+文本: {text}
+场景: {scene_desc}
+角色: {char_descriptions}
+动作: {action}"""
+
+    from schemas import ImagePrompt
+
+    # 结构化输出（必要时由客户端请求修复一次），仍不符合格式时使用简化 prompt
+    try:
+        return call_llm(
+            prompt, f"生成第{panel_id}格提示词", system_prompt=IMAGE_PROMPT_SYSTEM_PROMPT,
+            deadline=deadline, cancel_token=cancel_token, schema=ImagePrompt,
+            cache_prefix=f"【漫画风格】\n{comic_style}"
+        )
+    except JSONExtractionError as e:
+        logger.warning("提示词解析失败，使用简化 prompt: %s", e, extra={"panel_id": panel_id})
+        # 构建简化的 prompt
+        positive = f"{comic_style} style, {scene_desc}, {action}, {char_descriptions}, high quality, detailed"
+        return {
+            "panel_id": panel_id,
+            "positive_prompt": positive,
+            "negative_prompt": "blurry, low quality, distorted, bad anatomy",
+            "style_tags": [comic_style, "high_quality"]
+        }
+
+
+def _use_batch(batched: Optional[bool]) -> bool:
+    """是否使用批量模式（参数未指定时取 LLM_PANEL_BATCH）"""
+    return get_config().llm_panel_batch if batched is None else batched
+
+
+def _batch_panels(
+    prompt: str,
+    system_prompt: str,
+    task_type: str,
+    item_schema: Any,
+    panel_ids: List[Any],
+    deadline: Optional[Deadline] = None,
+    cancel_token: Optional[CancelToken] = None
+) -> Dict[Any, Dict[str, Any]]:
+    """
+    一次请求生成所有格子的结果
+
+    Args:
+        prompt: 批量提示词（本次故事的内容和格子列表）
+        system_prompt: 系统提示词（要求返回 JSON 数组）
+        task_type: 任务类型（用于日志显示）
+        item_schema: 单格结果的模型（StorySegment / ImagePrompt）
+        panel_ids: 需要的格子 ID
+
+    Returns:
+        panel_id -> 校验通过的结果；缺失、重复、不属于 panel_ids 或不符合格式的格子不在其中
+    """
+    from json_utils import extract_json, validate_json
+
+    try:
+        items = call_llm(
+            prompt, task_type, system_prompt=system_prompt,
+            deadline=deadline, cancel_token=cancel_token, schema=List[item_schema]
+        )
+    except JSONExtractionError as e:
+        # 数组整体不符合格式：逐项校验原始输出，保留其中有效的格子
         try:
-            cleaned_text = segment_text.strip()
-            if cleaned_text.startswith("```json"):
-                cleaned_text = cleaned_text[7:]
-            if cleaned_text.startswith("```"):
-                cleaned_text = cleaned_text[3:]
-            if cleaned_text.endswith("```"):
-                cleaned_text = cleaned_text[:-3]
-            cleaned_text = cleaned_text.strip()
-
-            segment = json.loads(cleaned_text)
-            segments.append(segment)
-        except json.JSONDecodeError:
-            print(f"⚠️ 第{panel_id}格文本解析失败，使用默认结构")
-            segments.append({
-                "panel_id": panel_id,
-                "scene_description": plot_point,
-                "characters_in_scene": [],
-                "dialogue": "",
-                "action": plot_point,
-                "emotion": "中性",
-                "text": segment_text[:100] if len(segment_text) > 100 else segment_text
-            })
+            raw_items = extract_json(e.text, list)
+        except JSONExtractionError:
+            logger.warning("批量结果不是有效 JSON: %s", e, extra={"task": task_type})
+            return {}
+        items = []
+        for item in raw_items:
+            try:
+                items.append(validate_json(item, item_schema))
+            except JSONExtractionError:
+                continue
+
+    expected = set(panel_ids)
+    results = {}
+    for item in items:
+        panel_id = item["panel_id"]
+        if panel_id in expected and panel_id not in results:
+            results[panel_id] = item
+
+    if len(items) != len(expected):
+        logger.warning("批量结果数量不符: 期望 %d 格，返回 %d 格", len(expected), len(items), extra={"task": task_type})
+    return results
+
+
+def _complete_batch(
+    items: List[Dict[str, Any]],
+    batch_results: Dict[Any, Dict[str, Any]],
+    worker: Callable[[Any], Any]
+) -> List[Any]:
+    """批量结果中缺失或无效的格子逐格补齐，结果顺序与 items 相同"""
+    missing = [item for item in items if item.get("panel_id") not in batch_results]
+    if missing:
+        logger.info("批量结果缺少 %d 格，逐格补齐", len(missing), extra={"panel_ids": [m.get("panel_id") for m in missing]})
+
+    filled = iter(_map_panels(worker, missing))
+    return [
+        batch_results[item.get("panel_id")] if item.get("panel_id") in batch_results else next(filled)
+        for item in items
+    ]
+
 
-    return segments
+def _segments_batch_prompt(story_context: str, panel_breakdown: List[Dict[str, Any]]) -> str:
+    """一次生成所有格子文本的用户提示词（大纲和角色信息只发送一次）"""
+    panels = "\n".join(
+        f"格子ID {panel_data.get('panel_id')}: {panel_data.get('plot_point')}" for panel_data in panel_breakdown
+    )
+
+    return f"""{story_context}
+
+【格子列表】（格子ID: 情节点）
+{panels}
+
+**必须输出恰好 {len(panel_breakdown)} 个对象。**"""
+
+
+def _prompts_batch_prompt(segments: List[Dict[str, Any]], comic_style: str, char_appearances: Dict[str, str]) -> str:
+    """一次生成所有格子提示词的用户提示词（风格和角色外观只发送一次）"""
+    appearances = "\n".join(f"- {name}: {appearance}" for name, appearance in char_appearances.items()) or "（无）"
+    panels = "\n\n".join(
+        f"""格子ID {segment.get('panel_id')}
+文本: {segment.get('text', '')}
+场景: {segment.get('scene_description', '')}
+角色: {', '.join(segment.get('characters_in_scene', [])) or 'no characters'}
+动作: {segment.get('action', '')}"""
+        for segment in segments
+    )
+
+    return f"""【漫画风格】
+{comic_style}
+
+【角色外观】
+{appearances}
+
+【格子列表】
+{panels}
+
+**必须输出恰好 {len(segments)} 个对象。**"""
+
+
+def generate_story_segments(
+    comic_outline: Dict[str, Any],
+    characters: List[Dict[str, Any]],
+    memory_context: Dict[str, Any],
+    deadline: Optional[Deadline] = None,
+    cancel_token: Optional[CancelToken] = None,
+    batched: Optional[bool] = None
+) -> List[Dict[str, Any]]:
+    """
+    生成分段故事文本（结果按 panel_id 顺序返回）
+
+    Args:
+        comic_outline: 漫画大纲
+        characters: 角色列表
+        memory_context: Memory 上下文
+        deadline: 请求截止时间（可选）
+        cancel_token: 取消信号（可选）
+        batched: 是否批量生成（默认取 LLM_PANEL_BATCH）：一次请求生成所有格子，
+            缺失或无效的格子再逐格补齐；否则各格并发调用
+
+    Returns:
+        分段文本列表
+    """
+    panel_breakdown = comic_outline.get("panel_breakdown", [])
+    story_context = _story_context(comic_outline, characters)
+
+    def generate_one(panel_data: Dict[str, Any]) -> Dict[str, Any]:
+        return _generate_segment(panel_data, story_context, deadline, cancel_token)
+
+    if not (_use_batch(batched) and len(panel_breakdown) > 1):
+        return _map_panels(generate_one, panel_breakdown)
+
+    from schemas import StorySegment
+
+    batch_results = _batch_panels(
+        _segments_batch_prompt(story_context, panel_breakdown),
+        SEGMENTS_BATCH_SYSTEM_PROMPT,
+        "批量生成格子文本",
+        StorySegment,
+        [panel_data.get("panel_id") for panel_data in panel_breakdown],
+        deadline,
+        cancel_token
+    )
+    return _complete_batch(panel_breakdown, batch_results, generate_one)
 
 
 def generate_image_prompts(
     segments: List[Dict[str, Any]],
     characters: List[Dict[str, Any]],
     comic_outline: Dict[str, Any],
-    memory_context: Dict[str, Any]
+    memory_context: Dict[str, Any],
+    deadline: Optional[Deadline] = None,
+    cancel_token: Optional[CancelToken] = None,
+    batched: Optional[bool] = None
 ) -> List[Dict[str, Any]]:
     """
-    生成图片提示词
+    生成图片提示词（结果按 panel_id 顺序返回）
 
     Args:
         segments: 分段文本列表
         characters: 角色列表
         comic_outline: 漫画大纲
         memory_context: Memory 上下文
+        deadline: 请求截止时间（可选）
+        cancel_token: 取消信号（可选）
+        batched: 是否批量生成（默认取 LLM_PANEL_BATCH）：一次请求生成所有格子，
+            缺失或无效的格子再逐格补齐；否则各格并发调用
 
     Returns:
         图片提示词列表
     """
-    prompts = []
     comic_style = comic_outline.get("style", "manga")
 
     # 构建角色外观字典
     char_appearances = {c["name"]: c.get("appearance", "") for c in characters}
 
-    for segment in segments:
-        panel_id = segment.get("panel_id")
-        scene_desc = segment.get("scene_description", "")
-        chars_in_scene = segment.get("characters_in_scene", [])
-        action = segment.get("action", "")
-        text = segment.get("text", "")
-
-        # 构建角色外观描述（如果有角色在场景中）
-        char_desc_parts = []
-        for char_name in chars_in_scene:
-            if char_name in char_appearances:
-                char_desc_parts.append(f"{char_name}: {char_appearances[char_name]}")
+    def generate_one(segment: Dict[str, Any]) -> Dict[str, Any]:
+        return _generate_image_prompt(segment, comic_style, char_appearances, deadline, cancel_token)
 
-        char_descriptions = ", ".join(char_desc_parts) if char_desc_parts else "no characters"
+    if not (_use_batch(batched) and len(segments) > 1):
+        return _map_panels(generate_one, segments)
 
-        prompt = f"""你是一个专业的 AI 绘画提示词工程师。请将漫画文本转换为文生图 prompt。
+    from schemas import ImagePrompt
 
-【漫画风格】
-{comic_style}
+    batch_results = _batch_panels(
+        _prompts_batch_prompt(segments, comic_style, char_appearances),
+        IMAGE_PROMPTS_BATCH_SYSTEM_PROMPT,
+        "批量生成提示词",
+        ImagePrompt,
+        [segment.get("panel_id") for segment in segments],
+        deadline,
+        cancel_token
+    )
+    return _complete_batch(segments, batch_results, generate_one)
 
-【当前格子信息】
-文本: {text}
-场景: {scene_desc}
-角色: {char_descriptions}
-动作: {action}
 
-【要求】
-- 生成适合 Stable Diffusion / DALL-E 的英文 prompt
-- 包含场景、角色、动作、光线、构图
-- 如果有角色，必须包含该角色的详细外观描述（确保一致性）
-- 指定漫画风格（manga style, comic style, etc.）
-- 添加质量标签（high quality, detailed, etc.）
+def generate_segments_and_prompts(
+    comic_outline: Dict[str, Any],
+    characters: List[Dict[str, Any]],
+    memory_context: Dict[str, Any],
+    deadline: Optional[Deadline] = None,
+    cancel_token: Optional[CancelToken] = None,
+    batched: Optional[bool] = None
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    流水线方式生成分段文本和图片提示词：每一格的文本返回后立即生成该格的提示词，
+    不等待其余格的文本（结果与依次调用 generate_story_segments、generate_image_prompts 相同）
 
-【输出格式 - 请严格按照此JSON格式输出】
-{{
-  "panel_id": {panel_id},
-  "positive_prompt": "详细的正向提示词",
-  "negative_prompt": "负向提示词（要避免的元素）",
-  "style_tags": ["manga", "high_quality"]
-}}
+    Args:
+        comic_outline: 漫画大纲
+        characters: 角色列表
+        memory_context: Memory 上下文
+        deadline: 请求截止时间（可选）
+        cancel_token: 取消信号（可选）
+        batched: 是否批量生成（默认取 LLM_PANEL_BATCH）；批量模式下两个阶段各一次请求，不做流水线
 
-请直接返回JSON，不要包含其他文字说明。"""
+    Returns:
+        (分段文本列表, 图片提示词列表)，均按 panel_id 顺序
+    """
+    if _use_batch(batched):
+        segments = generate_story_segments(comic_outline, characters, memory_context, deadline, cancel_token, True)
+        prompts = generate_image_prompts(segments, characters, comic_outline, memory_context, deadline, cancel_token, True)
+        return segments, prompts
 
-        prompt_text = call_llm(prompt, f"生成第{panel_id}格提示词")
+    story_context = _story_context(comic_outline, characters)
+    comic_style = comic_outline.get("style", "manga")
+    char_appearances = {c["name"]: c.get("appearance", "") for c in characters}
 
-        # 尝试解析 JSON
-        try:
-            cleaned_text = prompt_text.strip()
-            if cleaned_text.startswith("```json"):
-                cleaned_text = cleaned_text[7:]
-            if cleaned_text.startswith("```"):
-                cleaned_text = cleaned_text[3:]
-            if cleaned_text.endswith("```"):
-                cleaned_text = cleaned_text[:-3]
-            cleaned_text = cleaned_text.strip()
-
-            prompt_data = json.loads(cleaned_text)
-            prompts.append(prompt_data)
-        except json.JSONDecodeError:
-            print(f"⚠️ 第{panel_id}格提示词解析失败，使用简化prompt")
-            # 构建简化的 prompt
-            positive = f"{comic_style} style, {scene_desc}, {action}, {char_descriptions}, high quality, detailed"
-            prompts.append({
-                "panel_id": panel_id,
-                "positive_prompt": positive,
-                "negative_prompt": "blurry, low quality, distorted, bad anatomy",
-                "style_tags": [comic_style, "high_quality"]
-            })
+    def generate_panel(panel_data: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        segment = _generate_segment(panel_data, story_context, deadline, cancel_token)
+        return segment, _generate_image_prompt(segment, comic_style, char_appearances, deadline, cancel_token)
 
-    return prompts
+    results = _map_panels(generate_panel, comic_outline.get("panel_breakdown", []))
+    return [segment for segment, _ in results], [prompt_data for _, prompt_data in results]
 
 
 def generate_images_from_prompts(
     prompts: List[Dict[str, Any]],
-    memory_context: Dict[str, Any]
+    memory_context: Dict[str, Any],
+    deadline: Optional[Deadline] = None,
+    cancel_token: Optional[CancelToken] = None,
+    use_cache: bool = True
 ) -> List[Dict[str, Any]]:
     """
     从提示词生成图片（并行生成，直接返回 URL，不下载）
+    提示词相同的画面会合并为一次多图请求，结果按 panel_id 拆分
 
     Args:
         prompts: 图片提示词列表
         memory_context: Memory 上下文
+        deadline: 请求截止时间（可选），到期后不再启动新的图片生成，
+                  尚未开始的任务会被取消并标记为 cancelled
+        cancel_token: 取消信号（可选），取消后不再调度新的图片，
+                      取消尚未开始的任务并中断进行中的请求
+        use_cache: 是否读取文生图结果缓存（RESULT_CACHE_ENABLED）；重绘和重试失败画面时传 False，
+                   否则相同提示词会直接拿回缓存中的旧图片
 
     Returns:
         生成的图片信息列表
     """
     config = get_config()
+    deadline = as_deadline(deadline)
     images = []
 
     if config.use_mock_mode:
         # 模拟模式：返回模拟的图片 URL
-        print("\n[模拟模式] 生成模拟图片 URL")
+        logger.info("模拟模式：生成模拟图片 URL")
         for prompt_data in prompts:
             panel_id = prompt_data.get("panel_id")
 
@@ -403,125 +716,301 @@ def generate_images_from_prompts(
                 "prompt": prompt_data.get("positive_prompt", ""),
                 "status": "mocked"
             })
-            print(f"  ✓ [模拟] Panel {panel_id}: https://mock.example.com/comic_panel_{panel_id}.png")
+            logger.debug("模拟图片已生成", extra={"panel_id": panel_id})
+    elif get_image_client().supports_async_tasks():
+        # 异步任务模式：先提交全部任务，再由当前线程统一轮询，不占用工作线程
+        images = generate_images_via_tasks(prompts, deadline, cancel_token)
     else:
         # 真实模式：并行调用图片生成 API
         image_client = get_image_client()
 
-        print(f"\n🚀 并行生成 {len(prompts)} 张图片...")
-
-        def generate_single_image(prompt_data: Dict[str, Any]) -> Dict[str, Any]:
-            """生成单张图片的工作函数"""
-            panel_id = prompt_data.get("panel_id")
-            positive_prompt = prompt_data.get("positive_prompt", "")
-            negative_prompt = prompt_data.get("negative_prompt", "")
-
-            try:
-                print(f"  🎨 [开始] Panel {panel_id}")
+        logger.info("并行生成 %d 张图片", len(prompts))
 
-                # 调用图片生成 API，获取 URL
-                image_url = image_client.generate(
-                    prompt=positive_prompt,
-                    negative_prompt=negative_prompt
-                )
+        def cancelled_result(prompt_data: Dict[str, Any], reason: str) -> Dict[str, Any]:
+            """因截止时间到达或任务取消而放弃的图片"""
+            return {
+                "panel_id": prompt_data.get("panel_id"),
+                "image_url": "",
+                "prompt": prompt_data.get("positive_prompt", ""),
+                "status": "cancelled",
+                "error": reason
+            }
 
-                print(f"  ✓ [完成] Panel {panel_id}: {image_url}")
+        def failed_result(prompt_data: Dict[str, Any], error: str) -> Dict[str, Any]:
+            """生成失败的图片"""
+            return {
+                "panel_id": prompt_data.get("panel_id"),
+                "image_url": "",
+                "prompt": prompt_data.get("positive_prompt", ""),
+                "status": "failed",
+                "error": error
+            }
 
-                return {
-                    "panel_id": panel_id,
-                    "image_url": image_url,
-                    "prompt": positive_prompt,
-                    "status": "generated"
-                }
+        def generate_panel_group(group: List[Dict[str, Any]], submitted_at: float) -> List[Dict[str, Any]]:
+            """生成一组图片的工作函数（提示词相同的画面合并为一次请求）"""
+            panel_ids = [prompt_data.get("panel_id") for prompt_data in group]
+            queue_wait = time.perf_counter() - submitted_at
+            IMAGE_QUEUE_WAIT.observe(queue_wait, provider=image_client.provider)
 
-            except Exception as e:
-                print(f"  ✗ [失败] Panel {panel_id}: {e}")
-                return {
-                    "panel_id": panel_id,
-                    "image_url": "",
-                    "prompt": positive_prompt,
-                    "status": "failed",
-                    "error": str(e)
-                }
+            with start_span("image.render", panel_ids=panel_ids, queue_wait_ms=round(queue_wait * 1000, 1)):
+                try:
+                    logger.debug("开始生成", extra={"panel_ids": panel_ids})
+
+                    # 调用图片生成 API，获取 URL（只使用剩余预算）
+                    results = image_client.generate_group(
+                        group, deadline=deadline, cancel_token=cancel_token, use_cache=use_cache
+                    )
+
+                    group_images = []
+                    for prompt_data in group:
+                        panel_id = prompt_data.get("panel_id")
+                        result = results.get(panel_id, {})
+                        image_url = result.get("url") or result.get("local_path") or result.get("mock_url", "")
+
+                        if result.get("error"):
+                            # 提供商调用失败后返回的占位图：标记为失败，保留占位图作兜底展示
+                            logger.warning("图片生成失败: %s", result["error"], extra={"panel_id": panel_id})
+                            failed = failed_result(prompt_data, result["error"])
+                            failed["image_url"] = image_url
+                            group_images.append(failed)
+                            continue
+
+                        if not image_url:
+                            logger.warning("提供商未返回图片", extra={"panel_id": panel_id})
+                            group_images.append(failed_result(prompt_data, "提供商未返回图片"))
+                            continue
+
+                        logger.info("图片生成完成", extra={"panel_id": panel_id, "url": image_url})
+
+                        image = {
+                            "panel_id": panel_id,
+                            "image_url": image_url,
+                            "prompt": prompt_data.get("positive_prompt", ""),
+                            "status": "generated"
+                        }
+                        if result.get("local_path"):
+                            # 以 base64 返回的图片已写入本地文件，转存时直接读取该文件
+                            image["local_path"] = result["local_path"]
+                        group_images.append(image)
+                    return group_images
+
+                except (DeadlineExceeded, JobCancelled) as e:
+                    logger.warning("图片生成已取消: %s", e, extra={"panel_ids": panel_ids})
+                    return [cancelled_result(prompt_data, str(e)) for prompt_data in group]
 
-        # 使用线程池并行生成（最多同时 5 个任务）
-        max_workers = min(5, len(prompts))
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                except Exception as e:
+                    logger.warning("图片生成失败: %s", e, extra={"panel_ids": panel_ids})
+                    return [failed_result(prompt_data, str(e)) for prompt_data in group]
+
+        def should_stop() -> bool:
+            """截止时间已到或任务已取消"""
+            return deadline.expired() or (cancel_token is not None and cancel_token.cancelled)
+
+        # 合并可以共用一次请求的画面
+        groups = image_client.group_prompts(prompts)
+        if len(groups) < len(prompts):
+            logger.info("%d 张图片合并为 %d 次请求", len(prompts), len(groups))
+
+        # 使用线程池并行生成：线程数不超过 MAX_CONCURRENT_IMAGES，
+        # 同时发往提供商的请求数另由文生图客户端的全局并发上限约束（多个请求共享）
+        max_workers = max(1, min(config.max_concurrent_images, len(groups)))
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        pending = set()
+        try:
             # 提交所有任务
-            future_to_prompt = {
-                executor.submit(generate_single_image, prompt_data): prompt_data
-                for prompt_data in prompts
+            future_to_group = {
+                executor.submit(wrap_context(generate_panel_group), group, time.perf_counter()): group
+                for group in groups
             }
 
-            # 收集结果
-            for future in as_completed(future_to_prompt):
-                try:
-                    result = future.result()
-                    images.append(result)
-                except Exception as e:
-                    prompt_data = future_to_prompt[future]
-                    panel_id = prompt_data.get("panel_id")
-                    print(f"  ✗ [异常] Panel {panel_id}: {e}")
-                    images.append({
-                        "panel_id": panel_id,
-                        "image_url": "",
-                        "prompt": prompt_data.get("positive_prompt", ""),
-                        "status": "failed",
-                        "error": str(e)
-                    })
+            # 收集结果（定期检查截止时间和取消信号）
+            pending = set(future_to_group)
+            while pending and not should_stop():
+                remaining = deadline.remaining()
+                poll_interval = 0.5 if remaining is None else min(0.5, remaining)
+                done, pending = wait(pending, timeout=poll_interval, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    try:
+                        images.extend(future.result())
+                    except Exception as e:
+                        group = future_to_group[future]
+                        logger.error("图片任务异常: %s", e, extra={"panel_ids": [p.get("panel_id") for p in group]})
+                        images.extend(failed_result(prompt_data, str(e)) for prompt_data in group)
+
+            if pending:
+                # 截止时间已到或任务已取消：取消尚未开始的任务，进行中的请求由取消信号中断
+                reason = cancel_token.reason if cancel_token and cancel_token.cancelled else "请求截止时间已到"
+                abandoned = 0
+                for future in pending:
+                    future.cancel()
+                    for prompt_data in future_to_group[future]:
+                        images.append(cancelled_result(prompt_data, reason))
+                        abandoned += 1
+                logger.warning("%s，已放弃 %d 张未完成的图片", reason, abandoned)
+        finally:
+            # 放弃的任务不再等待，避免结果算完再丢弃
+            executor.shutdown(wait=not pending, cancel_futures=True)
 
         # 按 panel_id 排序
         images.sort(key=lambda x: x.get("panel_id", 0))
 
-        print(f"\n✅ 并行生成完成！成功: {sum(1 for img in images if img['status'] == 'generated')}/{len(images)}")
+        logger.info("并行生成完成，成功 %d/%d", sum(1 for img in images if img["status"] == "generated"), len(images))
+
+    return images
+
+
+def generate_images_via_tasks(
+    prompts: List[Dict[str, Any]],
+    deadline: Optional[Deadline] = None,
+    cancel_token: Optional[CancelToken] = None
+) -> List[Dict[str, Any]]:
+    """
+    使用异步任务接口生成图片：一次提交全部画面，再在单个协调循环中批量轮询
+    （提示词相同的画面合并为一个多图任务）
+
+    Args:
+        prompts: 图片提示词列表
+        deadline: 请求截止时间（可选）
+        cancel_token: 取消信号（可选）
+
+    Returns:
+        生成的图片信息列表（按 panel_id 排序）
+    """
+    image_client = get_image_client()
+    deadline = as_deadline(deadline)
+    images = []
+    tasks = {}
+
+    # 提示词相同的画面合并为一个多图任务
+    groups = image_client.group_prompts(prompts)
+
+    logger.info("提交 %d 个文生图任务（%d 张图片）", len(groups), len(prompts))
+
+    with start_span("image.submit_tasks", groups=len(groups)):
+        for group_index, group in enumerate(groups):
+            first = group[0]
+            panel_ids = [prompt_data.get("panel_id") for prompt_data in group]
+
+            try:
+                timeout = deadline.timeout(image_client.image_config["timeout"], "提交文生图任务")
+                if cancel_token:
+                    cancel_token.check("提交文生图任务")
+
+                task_id = image_client.submit_dashscope_task(
+                    first.get("positive_prompt", ""),
+                    first.get("negative_prompt", ""),
+                    timeout=timeout,
+                    cancel_token=cancel_token,
+                    n=len(group)
+                )
+                tasks[group_index] = task_id
+                logger.debug("文生图任务已提交", extra={"panel_ids": panel_ids, "task_id": task_id})
+
+            except (DeadlineExceeded, JobCancelled) as e:
+                images.extend({
+                    "panel_id": prompt_data.get("panel_id"),
+                    "image_url": "",
+                    "prompt": prompt_data.get("positive_prompt", ""),
+                    "status": "cancelled",
+                    "error": str(e)
+                } for prompt_data in group)
+            except Exception as e:
+                logger.warning("提交文生图任务失败: %s", e, extra={"panel_ids": panel_ids})
+                images.extend({
+                    "panel_id": prompt_data.get("panel_id"),
+                    "image_url": "",
+                    "prompt": prompt_data.get("positive_prompt", ""),
+                    "status": "failed",
+                    "error": str(e)
+                } for prompt_data in group)
+
+    with start_span("image.poll_tasks", tasks=len(tasks)):
+        results = image_client.poll_dashscope_tasks(tasks, deadline=deadline, cancel_token=cancel_token)
+
+    # 按 panel_id 拆分多图任务的结果
+    for group_index, task_result in results.items():
+        urls = task_result.get("urls", [])
+        for index, prompt_data in enumerate(groups[group_index]):
+            panel_id = prompt_data.get("panel_id")
+            image = {
+                "panel_id": panel_id,
+                "image_url": urls[index] if index < len(urls) else "",
+                "prompt": prompt_data.get("positive_prompt", ""),
+                "task_id": task_result.get("task_id", "")
+            }
+            if "error" in task_result:
+                image["status"] = "cancelled" if task_result.get("cancelled") else "failed"
+                image["error"] = task_result["error"]
+                logger.warning("文生图任务%s: %s", image["status"], task_result["error"], extra={"panel_id": panel_id})
+            elif not image["image_url"]:
+                image["status"] = "failed"
+                image["error"] = "任务返回的图片数量不足"
+                logger.warning("文生图任务失败: %s", image["error"], extra={"panel_id": panel_id})
+            else:
+                image["status"] = "generated"
+                logger.info("图片生成完成", extra={"panel_id": panel_id, "url": image["image_url"]})
+            images.append(image)
+
+    images.sort(key=lambda x: x.get("panel_id", 0))
+
+    logger.info("任务轮询完成，成功 %d/%d", sum(1 for img in images if img["status"] == "generated"), len(images))
 
     return images
 
 
 def download_image(url: str, save_path: str) -> None:
     """
-    下载图片到本地
+    下载图片到本地（流式写入，不在内存中缓冲整张图片）
 
     Args:
         url: 图片 URL
         save_path: 保存路径
     """
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
+        with requests.get(url, timeout=30, stream=True) as response:
+            response.raise_for_status()
 
-        with open(save_path, 'wb') as f:
-            f.write(response.content)
+            with open(save_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    f.write(chunk)
     except Exception as e:
-        print(f"  ⚠️ 下载图片失败: {e}")
+        logger.warning("下载图片失败: %s", e, extra={"url": url})
         raise
 
 
-def generate_frames_from_llm(user_input: str, memory_context: Dict[str, Any]) -> Dict[str, Any]:
+def generate_frames_from_llm(
+    user_input: str,
+    memory_context: Dict[str, Any],
+    deadline: Optional[Deadline] = None,
+    cancel_token: Optional[CancelToken] = None
+) -> Dict[str, Any]:
     """
     使用 LLM_conversion 生成 9 帧漫画的文本和提示词（一次性请求）
 
     Args:
         user_input: 用户输入的漫画创意
         memory_context: Memory 上下文
+        deadline: 请求截止时间（可选）
+        cancel_token: 取消信号（可选）
 
     Returns:
         包含 character_settings, main_story, frames 的字典
     """
-    print(f"\n[LLM Conversion] 正在生成 9 帧漫画...")
+    logger.info("LLM Conversion: 正在生成 9 帧漫画")
 
     try:
         # 调用 LLM_conversion.py 的核心函数
-        story_data = generate_story_data(user_input)
+        story_data = generate_story_data(user_input, deadline=deadline, cancel_token=cancel_token)
 
         # 验证数据结构
         frames = story_data.get("frames", [])
         if len(frames) != 9:
-            print(f"⚠️ 返回的帧数不是 9 ({len(frames)}帧)，请检查")
+            logger.warning("返回的帧数不是 9（%d 帧），请检查", len(frames))
 
-        print(f"✓ 角色设定: {story_data.get('character_settings', '')[:50]}...")
-        print(f"✓ 故事概要: {story_data.get('main_story', '')[:50]}...")
-        print(f"✓ 生成帧数: {len(frames)}")
+        logger.info("故事数据已生成", extra={"frames": len(frames)})
+        logger.debug("角色设定: %s", story_data.get("character_settings", ""))
+        logger.debug("故事概要: %s", story_data.get("main_story", ""))
 
         # 转换为标准格式
         result = {
@@ -559,8 +1048,11 @@ def generate_frames_from_llm(user_input: str, memory_context: Dict[str, Any]) ->
 
         return result
 
+    except (DeadlineExceeded, JobCancelled):
+        # 预算已耗尽或任务已取消，后续步骤也不会继续，不再生成占位内容
+        raise
     except Exception as e:
-        print(f"✗ LLM Conversion 失败: {e}")
+        logger.error("LLM Conversion 失败: %s", e)
         # 返回默认结构（9帧）
         return {
             "character_settings": "默认角色设定",
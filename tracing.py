@@ -0,0 +1,244 @@
+"""
+链路追踪模块（OpenTelemetry 风格）
+每个 /api/generate_storybook 请求对应一条 trace，子 span 覆盖：
+LangGraph 各节点、LLM 调用、每一格画面的生成（可看出线程池中的重叠）、Memory 持久化和结果文件写入。
+
+- 当前 span 保存在 contextvars 中；提交到线程池的任务需用 wrap_context() 携带上下文
+- span 结束后放入队列，由后台线程批量导出，不阻塞请求线程
+- 导出目标：本地 JSONL 文件（默认）或 OTLP/HTTP JSON 接口（如本地 collector）
+"""
+
+import atexit
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import requests
+
+from config import get_config
+from logger import get_logger
+
+
+logger = get_logger("tracing")
+
+# 当前活动的 span
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+# 导出批大小和最长等待时间（秒）
+EXPORT_BATCH_SIZE = 64
+EXPORT_INTERVAL = 2.0
+
+
+class Span:
+    """一段计时的操作"""
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = "ok"
+        self.error = ""
+        self.thread = threading.current_thread().name
+
+    def set_attribute(self, key: str, value: Any):
+        """设置属性"""
+        self.attributes[key] = value
+
+    def end(self, error: Optional[BaseException] = None):
+        """结束 span"""
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.status = "error"
+            self.error = f"{type(error).__name__}: {error}"
+        get_span_exporter().export(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典（本地文件导出格式）"""
+        end_ns = self.end_ns or time.time_ns()
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_ns / 1e9,
+            "duration_ms": round((end_ns - self.start_ns) / 1e6, 3),
+            "thread": self.thread,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes
+        }
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """转换为 OTLP/HTTP JSON 格式的 span"""
+        otlp = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [
+                {"key": key, "value": {"stringValue": str(value)}}
+                for key, value in {**self.attributes, "thread.name": self.thread}.items()
+            ],
+            "status": {"code": 2, "message": self.error} if self.status == "error" else {"code": 1}
+        }
+        if self.parent_id:
+            otlp["parentSpanId"] = self.parent_id
+        return otlp
+
+
+class SpanExporter:
+    """后台批量导出已结束的 span"""
+
+    def __init__(self):
+        config = get_config()
+        self.exporter = config.trace_exporter
+        self.file_path = Path(config.trace_file)
+        self.otlp_endpoint = config.trace_otlp_endpoint
+        self.service_name = config.trace_service_name
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter in ("file", "otlp")
+
+    def export(self, span: Span):
+        """放入导出队列（不阻塞）"""
+        if not self.enabled:
+            return
+        self._ensure_worker()
+        self._queue.put(span)
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                self._thread.start()
+                atexit.register(self.shutdown)
+
+    def _run(self):
+        """攒批导出：满 EXPORT_BATCH_SIZE 或等待 EXPORT_INTERVAL 秒后写出一次"""
+        batch: List[Span] = []
+        stopping = False
+        while not stopping:
+            try:
+                span = self._queue.get(timeout=EXPORT_INTERVAL)
+                if span is None:
+                    stopping = True
+                else:
+                    batch.append(span)
+                    if len(batch) < EXPORT_BATCH_SIZE:
+                        continue
+            except queue.Empty:
+                pass
+
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    logger.warning("导出追踪数据失败: %s", e)
+                batch = []
+
+    def _write(self, batch: List[Span]):
+        if self.exporter == "otlp":
+            payload = {
+                "resourceSpans": [{
+                    "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                    "scopeSpans": [{"scope": {"name": "storybook"}, "spans": [span.to_otlp() for span in batch]}]
+                }]
+            }
+            requests.post(self.otlp_endpoint, json=payload, timeout=5).raise_for_status()
+        else:
+            self.file_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.file_path, "a", encoding="utf-8") as f:
+                for span in batch:
+                    f.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+
+    def shutdown(self, timeout: float = 5.0):
+        """写出剩余的 span 并停止后台线程"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+
+# 全局导出器实例
+_span_exporter: Optional[SpanExporter] = None
+
+
+def get_span_exporter() -> SpanExporter:
+    """获取全局 span 导出器（单例模式）"""
+    global _span_exporter
+    if _span_exporter is None:
+        _span_exporter = SpanExporter()
+    return _span_exporter
+
+
+def current_span() -> Optional[Span]:
+    """当前活动的 span"""
+    return _current_span.get()
+
+
+def current_trace_id() -> str:
+    """当前 trace ID（没有活动 span 时返回空字符串）"""
+    span = _current_span.get()
+    return span.trace_id if span else ""
+
+
+@contextmanager
+def start_span(name: str, new_trace: bool = False, **attributes) -> Iterator[Span]:
+    """
+    开始一个 span，并设为当前 span
+
+    Args:
+        name: span 名称
+        new_trace: 是否强制开始新的 trace（API 请求入口使用）
+        **attributes: span 属性
+
+    Yields:
+        Span
+    """
+    parent = None if new_trace else _current_span.get()
+    span = Span(
+        name,
+        trace_id=parent.trace_id if parent else os.urandom(16).hex(),
+        parent_id=parent.span_id if parent else None,
+        attributes=attributes
+    )
+    token = _current_span.set(span)
+    error: Optional[BaseException] = None
+    try:
+        yield span
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end(error)
+
+
+def wrap_context(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """携带当前上下文（含当前 span）到线程池任务中执行"""
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.run(fn, *args, **kwargs)
+
+    return run